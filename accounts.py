@@ -0,0 +1,247 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from google_clients import build_service
+from journal import LOCK_TIMEOUT
+from mailer import SMTPPool, smtp_settings_from_env
+from rate_limit import RateLimiter
+
+# Account pools for sharding one run across several Google credentials and
+# SMTP sender accounts. Each account has its own rate limiter, because API
+# and sending quotas are per user, so adding accounts adds capacity. An
+# account that hits a hard limit (full Drive, daily sending cap, rejected
+# login) is marked exhausted and the remaining accounts take over.
+
+# Messages per sender per day; 0 means no local cap, relying on the server
+# to refuse once its limit is hit. Gmail allows about 500 per day on
+# consumer accounts and 2000 on Workspace.
+DEFAULT_DAILY_SEND_LIMIT = 0
+
+# Save the daily send counters after this many sends, not on every message.
+LEDGER_FLUSH_EVERY = 20
+
+
+class AccountExhausted(Exception):
+    """Every account in a pool is exhausted (or over its daily limit)."""
+
+
+# --- Google Accounts ---
+class GoogleAccount:
+    """One Google credential with its own per-thread clients and rate limiter."""
+
+    def __init__(self, name, credentials):
+        self.name = name
+        self.credentials = credentials
+        self.limiter = RateLimiter.from_env()
+        self.exhausted = False
+        self._local = threading.local()
+
+    def build(self, name, version):
+        return build_service(name, version, self.credentials)
+
+    def drive(self):
+        if not hasattr(self._local, 'drive'):
+            self._local.drive = self.build('drive', 'v3')
+        return self._local.drive
+
+    def slides(self):
+        if not hasattr(self._local, 'slides'):
+            self._local.slides = self.build('slides', 'v1')
+        return self._local.slides
+
+
+def account_name(credentials, index):
+    """Stable name for a credential; used to find a row's copy again on resume."""
+    return getattr(credentials, 'service_account_email', None) or f"akun-{index + 1}"
+
+
+def google_accounts(credentials):
+    """GoogleAccounts for one credential or a list of them, primary first."""
+    if not isinstance(credentials, (list, tuple)):
+        credentials = [credentials]
+    return [GoogleAccount(account_name(creds, i), creds) for i, creds in enumerate(credentials)]
+
+
+# --- Sender Accounts ---
+class SenderAccount:
+    """One SMTP login with its pool, rate limiter and daily send counter."""
+
+    def __init__(self, email, password, daily_limit=DEFAULT_DAILY_SEND_LIMIT, sent_today=0):
+        self.email = email
+        self.name = email
+        self.password = password
+        self.daily_limit = daily_limit
+        self.sent_today = sent_today
+        self.unsaved = 0
+        self.limiter = RateLimiter.from_env()
+        self.exhausted = False
+        self.pool = None
+
+    def remaining(self):
+        if not self.daily_limit:
+            return float('inf')
+        return self.daily_limit - self.sent_today
+
+    def open(self, size):
+        if self.pool is None:
+            self.pool = SMTPPool(self.email, self.password, size=size, **smtp_settings_from_env())
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+def sender_accounts_from_env(primary_email, primary_password):
+    """Sender logins: EMAIL_SENDER plus EMAIL_SENDERS.
+
+    EMAIL_SENDERS is a comma-separated list of ``email:app_password`` or
+    ``email:app_password:daily_limit`` entries.
+    """
+    try:
+        default_limit = int(os.getenv("EMAIL_DAILY_LIMIT") or DEFAULT_DAILY_SEND_LIMIT)
+    except ValueError:
+        default_limit = DEFAULT_DAILY_SEND_LIMIT
+    accounts = []
+    if primary_email:
+        accounts.append((primary_email, primary_password, default_limit))
+    for entry in (os.getenv("EMAIL_SENDERS") or "").split(","):
+        parts = [part.strip() for part in entry.split(":")]
+        if len(parts) < 2 or not parts[0] or parts[0] in [a[0] for a in accounts]:
+            continue
+        limit = default_limit
+        if len(parts) > 2 and parts[2].isdigit():
+            limit = int(parts[2])
+        accounts.append((parts[0], parts[1], limit))
+    return accounts
+
+
+# --- Pools ---
+class AccountPool:
+    """Hands out accounts that still have quota, spreading the load evenly."""
+
+    def __init__(self, accounts, ledger=None):
+        if not accounts:
+            raise ValueError("Pool akun kosong.")
+        self.accounts = list(accounts)
+        self.by_name = {account.name: account for account in self.accounts}
+        self.ledger = ledger
+        self._cycle = itertools.cycle(self.accounts)
+        self._lock = threading.Lock()
+        self._since_flush = 0
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def available(self):
+        return [a for a in self.accounts if not a.exhausted]
+
+    def next(self):
+        """Round-robin over accounts that are not exhausted."""
+        with self._lock:
+            for _ in range(len(self.accounts)):
+                account = next(self._cycle)
+                if not account.exhausted:
+                    return account
+        raise AccountExhausted("Semua akun Google sudah mencapai batas kuota.")
+
+    def exhaust(self, account):
+        with self._lock:
+            account.exhausted = True
+
+    # --- Sending quota ---
+    def reserve(self):
+        """Take one send from the sender with the most quota left."""
+        with self._lock:
+            candidates = [a for a in self.accounts if not a.exhausted and a.remaining() > 0]
+            if not candidates:
+                raise AccountExhausted("Semua akun pengirim sudah mencapai batas kirim harian.")
+            account = max(candidates, key=lambda a: (a.remaining(), -a.sent_today))
+            account.sent_today += 1
+            account.unsaved += 1
+            self._since_flush += 1
+            flush = self._since_flush >= LEDGER_FLUSH_EVERY
+        if flush:
+            self.flush()
+        return account
+
+    def release(self, account):
+        """Give back a reservation whose message was not accepted."""
+        with self._lock:
+            account.sent_today -= 1
+            account.unsaved -= 1
+
+    def flush(self):
+        if self.ledger is None:
+            return
+        with self._lock:
+            deltas = {a.name: a.unsaved for a in self.accounts if a.unsaved}
+            for account in self.accounts:
+                account.unsaved = 0
+            self._since_flush = 0
+        if deltas:
+            self.ledger.add(deltas)
+
+    def open(self, size):
+        for account in self.accounts:
+            account.open(size)
+
+    def close(self):
+        for account in self.accounts:
+            account.close()
+        self.flush()
+
+
+def sender_pool(accounts, ledger=None):
+    """AccountPool of SenderAccounts from ``(email, password, limit)`` tuples."""
+    sent = ledger.load() if ledger else {}
+    return AccountPool(
+        [SenderAccount(email, password, limit, sent.get(email, 0)) for email, password, limit in accounts],
+        ledger,
+    )
+
+
+# --- Daily Quota Ledger ---
+class QuotaLedger:
+    """Messages sent per sender per day, kept across runs in SQLite.
+
+    Lives in the journal database so daily caps hold when an event is split
+    over several runs on the same day.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("JOURNAL_PATH") or "journal.sqlite3"
+        with sqlite3.connect(self.path, timeout=LOCK_TIMEOUT) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS send_quota ("
+                "account TEXT NOT NULL, day TEXT NOT NULL, sent INTEGER NOT NULL, "
+                "PRIMARY KEY (account, day))"
+            )
+
+    @staticmethod
+    def today():
+        return time.strftime("%Y-%m-%d")
+
+    def load(self):
+        with sqlite3.connect(self.path, timeout=LOCK_TIMEOUT) as conn:
+            cursor = conn.execute("SELECT account, sent FROM send_quota WHERE day = ?", (self.today(),))
+            return dict(cursor.fetchall())
+
+    def add(self, deltas):
+        day = self.today()
+        with sqlite3.connect(self.path, timeout=LOCK_TIMEOUT) as conn:
+            conn.executemany(
+                "INSERT INTO send_quota (account, day, sent) VALUES (?, ?, ?) "
+                "ON CONFLICT (account, day) DO UPDATE SET sent = sent + excluded.sent",
+                [(name, day, count) for name, count in deltas.items()],
+            )
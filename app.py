@@ -1,22 +1,18 @@
 import streamlit as st
-import pandas as pd
+import io
 import json
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import io
-import time
 from dotenv import load_dotenv
 
-# OAuth Imports
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pickle
+from engine import (
+    check_storage_quota, cleanup_service_account_files, clear_token, count_temp_files,
+    load_credentials, load_settings, missing_settings, open_participants, parse_participants, plan_run,
+)
+from google_clients import build_service, credential_identity
+from jobs import DuplicateJobError, JobQueue, ensure_workers, workers_from_env
+from pipeline import STAGES, batch_size_from_env, concurrency_from_env
+from planning import describe
+from templating import parse_fields
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -28,152 +24,29 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- Validasi Email Sederhana ---
-def is_valid_email(email):
-    return "@" in email and "." in email
-
-# --- Google API Auth ---
-def authenticate_google(service_account_info):
-    creds = service_account.Credentials.from_service_account_info(
-        service_account_info,
-        scopes=[
-            'https://www.googleapis.com/auth/drive',
-            'https://www.googleapis.com/auth/presentations'
-        ]
-    )
-    drive_service = build('drive', 'v3', credentials=creds)
-    slides_service = build('slides', 'v1', credentials=creds)
-    return drive_service, slides_service
-
-# --- Google OAuth User Auth ---
-def authenticate_user_oauth(client_config):
-    SCOPES = [
-        'https://www.googleapis.com/auth/drive',
-        'https://www.googleapis.com/auth/presentations'
-    ]
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-            
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception:
-                creds = None
-                
-        if not creds:
-            # Create a temporary file for client_secret if it's passed as dict
-            # But here we expect client_config to be the dict from json.load
-            # Flow.from_client_config is cleaner than saving to file
-            flow = InstalledAppFlow.from_client_config(
-                client_config, SCOPES)
-            creds = flow.run_local_server(port=0)
-            
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    drive_service = build('drive', 'v3', credentials=creds)
-    slides_service = build('slides', 'v1', credentials=creds)
-    return drive_service, slides_service
-
-# --- Clear Token Function ---
-def clear_token():
-    if os.path.exists('token.pickle'):
-        os.remove('token.pickle')
-        return True
-    return False
-
-# --- Storage Management ---
-def check_storage_quota(service):
-    try:
-        about = service.about().get(fields="storageQuota").execute()
-        quota = about.get('storageQuota', {})
-        usage = int(quota.get('usage', 0))
-        limit_str = quota.get('limit')
-        limit = int(limit_str) if limit_str else -1
-        
-        usage_mb = usage / (1024 * 1024)
-        limit_mb = limit / (1024 * 1024) if limit != -1 else -1
-        return usage_mb, limit_mb
-    except Exception as e:
-        return 0, 0
-
-def cleanup_service_account_files(service):
-    deleted_count = 0
-    errors = []
-    try:
-        # List all files owned by 'me' (the service account) that are not in trash
-        page_token = None
-        while True:
-            response = service.files().list(
-                q="'me' in owners and trashed=false",
-                spaces='drive',
-                fields='nextPageToken, files(id, name)',
-                pageToken=page_token
-            ).execute()
-            
-            for file in response.get('files', []):
-                try:
-                    service.files().delete(fileId=file['id']).execute()
-                    deleted_count += 1
-                except Exception as e:
-                    errors.append(f"Gagal hapus {file.get('name')}: {str(e)}")
-            
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-                
-        # Also empty headers trash if possible (not always necessary if we delete permanently)
-        try:
-             service.files().emptyTrash().execute()
-        except:
-             pass
-             
-        return deleted_count, errors
-    except Exception as e:
-        return deleted_count, [str(e)]
-
-# --- Fungsi Kirim Email ---
-def send_email_with_attachment(sender_email, sender_password, recipient_email, subject, body, pdf_bytes, filename):
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = recipient_email
-    msg['Subject'] = subject
-
-    msg.attach(MIMEText(body, 'plain'))
-
-    part = MIMEApplication(pdf_bytes, Name=filename)
-    part['Content-Disposition'] = f'attachment; filename="{filename}"'
-    msg.attach(part)
-
-    try:
-        if "gmail" in sender_email:
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-        else:
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-        server.quit()
-        return True, "Email terkirim."
-    except Exception as e:
-        return False, str(e)
-
-# --- Load Email Body ---
-def load_email_body():
-    try:
-        with open("email_body.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
+# --- Job Queue ---
+# Runs execute in worker processes (jobs.py); the page only submits and polls.
+@st.cache_resource(show_spinner=False)
+def cached_job_queue():
+    return JobQueue()
+
+job_queue = cached_job_queue()
+
+# --- Cached Google Credentials ---
+# Kept across reruns and keyed by credential identity, so pressing a button
+# does not re-authenticate. Underscore arguments are not hashed by
+# Streamlit, so the secrets never become part of the key. Only the
+# (thread-safe) credentials are shared between sessions; API clients are
+# not thread-safe, so each use builds its own, which needs no network call.
+@st.cache_resource(show_spinner=False)
+def cached_credentials(identity, auth_type, token_version, _credential_info):
+    return load_credentials(auth_type, _credential_info)
+
+def get_credentials(auth_type, credential_info):
+    identity = credential_identity(auth_type, credential_info)
+    # A new or refreshed token.pickle gets a new cache entry.
+    token_version = os.path.getmtime('token.pickle') if auth_type == "oauth" and os.path.exists('token.pickle') else None
+    return cached_credentials(identity, auth_type, token_version, credential_info)
 
 # --- UI Setup ---
 st.title("🎓 Automasi Pengiriman Sertifikat Masal")
@@ -193,7 +66,8 @@ with st.expander("📚 Panduan Setup & Tutorial (Baca Dulu)", expanded=False):
           EMAIL_SUBJECT=Subjek Email
           ```
     3.  **Email Body**:
-        - Edit file `email_body.txt` untuk mengubah isi email. Gunakan `{{nama}}` untuk nama peserta.
+        - Edit file `email_body.txt` untuk mengubah isi email (atau buat `email_body.html` untuk email HTML). Gunakan `{{nama}}` untuk nama peserta.
+        - Placeholder lain (misal `{{nomor_sertifikat}}`) diisi dari kolom CSV/XLSX dengan judul yang sama, atau dari isian tetap di bawah.
     4.  **Sertifikat Template**:
         - Pastikan ID Google Slides benar dan file sudah dishare ke email service account.
     """)
@@ -222,9 +96,16 @@ else:
         st.sidebar.success("Token tersimpan ditemukan! (Otomatis login)")
         if st.sidebar.button("Logout / Reset Token"):
             if clear_token():
+                cached_credentials.clear()
                 st.sidebar.warning("Token dihapus. Silakan refresh halaman.")
                 st.rerun()
 
+extra_service_accounts = st.sidebar.file_uploader(
+    "Service Account tambahan (opsional)", type="json", accept_multiple_files=True,
+    help="Peserta dibagi ke semua akun Google agar kuota Drive/Slides bertambah. "
+         "Template harus dibagikan ke setiap service account."
+)
+
 # --- Google Slide Template ---
 template_id = st.sidebar.text_input("ID Google Slides Template", help="ID bisa diambil dari URL Google Slides (bagian acak di tengah URL).")
 
@@ -235,13 +116,25 @@ if auth_type == "service_account":
     st.sidebar.header("🧹 Manajemen Penyimpanan")
     
     if uploaded_file is not None:
-        if st.sidebar.button("Cek Kuota & Bersihkan"):
+        sweep_all = st.sidebar.checkbox(
+            "Termasuk file lama tanpa tag", value=False,
+            help="Biasanya hanya salinan yang dibuat aplikasi ini (ditandai appProperties) yang dihapus. "
+                 "Centang untuk menghapus semua file milik service account, misal sisa dari versi lama."
+        )
+        try:
+            uploaded_file.seek(0)
+            service_account_info = json.load(uploaded_file)
+            uploaded_file.seek(0) # Reset pointer
+        except Exception as e:
+            st.sidebar.error(f"File service account tidak valid: {e}")
+            st.stop()
+        sweep_key = (credential_identity(auth_type, service_account_info), sweep_all)
+
+        # Step 1: quota and a dry-run count; nothing is deleted yet.
+        if st.sidebar.button("Cek Kuota & File Sementara"):
             try:
-                # Re-auth just for checking
-                uploaded_file.seek(0)
-                service_account_info = json.load(uploaded_file)
-                drive_service, _ = authenticate_google(service_account_info)
-                uploaded_file.seek(0) # Reset pointer
+                creds = get_credentials(auth_type, service_account_info)
+                drive_service = build_service('drive', 'v3', creds)
 
                 usage, limit = check_storage_quota(drive_service)
                 limit_str = f"{limit:.2f} MB" if limit != -1 else "Unlimited"
@@ -250,217 +143,324 @@ if auth_type == "service_account":
                 
                 if usage > 13000: # Warning near 15GB
                     st.sidebar.warning("Penyimpanan hampir penuh!")
-                
-                with st.sidebar.status("Membersihkan file temporary...", expanded=True) as status:
-                    count, errors = cleanup_service_account_files(drive_service)
-                    status.write(f"Berhasil menghapus {count} file.")
-                    if errors:
-                        status.warning(f"Error pada {len(errors)} file.")
-                
-                if count > 0:
-                    st.sidebar.success(f"Berhasil mengosongkan ruang! ({count} file dihapus)")
-                else:
-                    st.sidebar.info("Tidak ada file yang perlu dihapus.")
-                    
+
+                count, errors = count_temp_files(drive_service, tagged_only=not sweep_all)
+                if errors:
+                    st.sidebar.error(f"Gagal menghitung file: {errors[0]}")
+                st.session_state['sweep_count'] = (sweep_key, count)
             except Exception as e:
                 st.sidebar.error(f"Gagal cek storage: {e}")
+
+        # Step 2: delete what the dry run found, in parallel batch requests.
+        checked_key, found = st.session_state.get('sweep_count', (None, 0))
+        if checked_key == sweep_key:
+            if not found:
+                st.sidebar.info("Tidak ada file yang perlu dihapus.")
+            elif st.sidebar.button(f"🧹 Hapus {found} file sementara", type="primary"):
+                try:
+                    creds = get_credentials(auth_type, service_account_info)
+                    drive_service = build_service('drive', 'v3', creds)
+                    with st.sidebar.status("Membersihkan file temporary...", expanded=True) as status:
+                        progress = status.progress(0.0)
+                        count, errors = cleanup_service_account_files(
+                            drive_service, creds, tagged_only=not sweep_all,
+                            on_progress=lambda done, total: progress.progress(done / max(total, 1))
+                        )
+                        status.write(f"Berhasil menghapus {count} file.")
+                        if errors:
+                            status.warning(f"Error pada {len(errors)} file.")
+                    del st.session_state['sweep_count']
+
+                    if count > 0:
+                        st.sidebar.success(f"Berhasil mengosongkan ruang! ({count} file dihapus)")
+                    else:
+                        st.sidebar.info("Tidak ada file yang perlu dihapus.")
+                except Exception as e:
+                    st.sidebar.error(f"Gagal membersihkan storage: {e}")
     else:
         st.sidebar.caption("Upload Service Account JSON dulu untuk cek storage.")
 else:
     # OAUTH MODE
     st.sidebar.markdown("---")
     st.sidebar.info("ℹ️ Mode OAuth menggunakan penyimpanan pribadi Anda.")
+
+# --- Pipeline Concurrency ---
+st.sidebar.markdown("---")
+with st.sidebar.expander("⚡ Performa (Worker per Tahap)", expanded=False):
+    default_concurrency = concurrency_from_env()
+    pipeline_concurrency = {
+        stage: st.number_input(
+            f"Worker {stage}", min_value=1, max_value=32,
+            value=default_concurrency[stage], key=f"workers_{stage}"
+        )
+        for stage in STAGES
+    }
+    st.caption("Jumlah worker dihitung per akun (akun Google untuk copy/replace/export/cleanup, akun pengirim untuk send).")
+    resume_run = st.checkbox(
+        "Lanjutkan run sebelumnya (resume)", value=True,
+        help="Peserta yang sudah terkirim pada run dengan template & daftar peserta yang sama akan dilewati."
+    )
+    render_mode = st.radio(
+        "Mode Render",
+        ("google", "local"),
+        index=1 if os.getenv("RENDER_MODE", "google") == "local" else 0,
+        format_func=lambda m: "Google Slides" if m == "google" else "Lokal (offline, tanpa API per peserta)",
+        help="Mode lokal mengekspor template sekali, lalu menulis nama peserta di PDF secara lokal. Jika gagal, otomatis kembali ke Google Slides."
+    )
+    render_batch_size = st.number_input(
+        "Peserta per batch render", min_value=1, max_value=100,
+        value=batch_size_from_env(),
+        help="Lebih dari 1: satu salinan template + satu export PDF dipakai untuk banyak peserta sekaligus, lalu PDF dipecah per peserta."
+    )
 # --- Main Area ---
 st.subheader("📋 Data Peserta")
-st.markdown("Masukkan data peserta dengan format: `Nama Lengkap, email@target.com` (Satu peserta per baris)")
+st.markdown("Upload file CSV/XLSX (kolom `Nama` dan `Email`), atau masukkan data peserta dengan format: `Nama Lengkap, email@target.com` (Satu peserta per baris)")
+st.caption("Kolom lain di CSV/XLSX mengisi placeholder dengan nama yang sama: kolom `Nomor Sertifikat` → `{{nomor_sertifikat}}`.")
 
+roster_file = st.file_uploader("Upload Data Peserta (CSV/XLSX)", type=["csv", "txt", "xlsx"])
 raw_participants = st.text_area("List Peserta", height=200, placeholder="Budi Santoso, budi@example.com\nSiti Aminah, siti@example.com")
+fixed_fields = st.text_area(
+    "Isian Tetap (opsional)", height=100,
+    value="\n".join(f"{key}={value}" for key, value in parse_fields(os.getenv("TEMPLATE_FIELDS")).items()),
+    placeholder="acara=Seminar Nasional\ntanggal=1 Mei 2026",
+    help="Satu `kunci=nilai` per baris, sama untuk semua peserta. Mengisi placeholder {{kunci}} di template dan email."
+)
+
+if st.button("🧮 Hitung Rencana (dry run)", help="Hitung jumlah email, render, dan panggilan API tanpa mengirim apa pun."):
+    # Offline: the template is not read, so every roster column counts as
+    # certificate content and PDF cache hits are not known.
+    if not (roster_file or raw_participants):
+        st.error("Mohon isi Data Peserta dulu.")
+    else:
+        try:
+            if roster_file is not None:
+                participants = open_participants(io.BytesIO(roster_file.getvalue()), roster_file.name)
+            else:
+                participants = parse_participants(raw_participants)
+            settings = dict(load_settings(), fields=parse_fields(fixed_fields))
+            plan = plan_run(None, template_id, participants, settings, render_batch_size, render_mode)
+        except Exception as e:
+            st.error(f"Gagal menghitung rencana: {e}")
+        else:
+            st.info("\n".join(f"- {line}" for line in describe(plan)))
+            st.caption("Perkiraan tanpa membaca template dan tanpa memeriksa run sebelumnya (resume).")
 
 if st.button("🚀 Mulai Kirim Sertifikat", type="primary"):
     # Load settings from env and file
-    email_sender = os.getenv("EMAIL_SENDER")
-    email_password = os.getenv("EMAIL_PASSWORD")
-    email_subject = os.getenv("EMAIL_SUBJECT")
-    target_folder_id = os.getenv("TARGET_FOLDER_ID")
-    email_body_template = load_email_body()
+    settings = load_settings()
 
     # Validasi Input dan Config
-    missing_config = []
-    if not email_sender: missing_config.append("EMAIL_SENDER di .env")
-    if not email_password: missing_config.append("EMAIL_PASSWORD di .env")
-    if not email_subject: missing_config.append("EMAIL_SUBJECT di .env")
-    if not email_body_template: missing_config.append("File email_body.txt")
-
-    if not email_body_template: missing_config.append("File email_body.txt")
+    missing_config = missing_settings(settings)
 
     if missing_config:
         st.error(f"Konfigurasi belum lengkap: {', '.join(missing_config)}")
-    elif (not uploaded_file and not os.path.exists('token.pickle')) or not template_id or not raw_participants:
+    elif (not uploaded_file and not os.path.exists('token.pickle')) or not template_id or not (roster_file or raw_participants):
         st.error("Mohon lengkapi Credential JSON, Template ID, dan Data Peserta.")
     else:
-        # 1. Parse Data Peserta
-        participants = []
-        try:
-            lines = raw_participants.strip().split('\n')
-            for line in lines:
-                parts = line.split(',')
-                if len(parts) >= 2:
-                    name = parts[0].strip()
-                    email_addr = parts[1].strip()
-                    if is_valid_email(email_addr):
-                        participants.append({'nama': name, 'email': email_addr})
-            
-            df_participants = pd.DataFrame(participants)
-            if df_participants.empty:
-               st.error("Format data peserta tidak valid. Pastikan format: Nama, Email")
-               st.stop()
-               
+        # 1. Data Peserta
+        # An uploaded roster is handed to the worker as is and parsed
+        # there; pasted lines are checked here first.
+        if roster_file is not None:
+            roster, roster_name = roster_file.getvalue(), roster_file.name
+        else:
+            try:
+                participants = parse_participants(raw_participants)
+            except Exception as e:
+                st.error(f"Gagal memparsing data peserta: {e}")
+                st.stop()
+            if not participants:
+                st.error("Format data peserta tidak valid. Pastikan format: Nama, Email")
+                st.stop()
             st.info(f"Terdeteksi {len(participants)} peserta.")
-            
-        except Exception as e:
-            st.error(f"Gagal memparsing data peserta: {e}")
-            st.stop()
+            roster, roster_name = raw_participants.strip().encode("utf-8"), "peserta.txt"
 
         # 2. Init Google Auth
-        # 2. Init Google Auth
+        # Logging in here (browser flow for OAuth) leaves a valid token for
+        # the worker, which cannot open a browser itself.
         try:
             if auth_type == "service_account":
-                service_account_info = json.load(uploaded_file)
-                drive_service, slides_service = authenticate_google(service_account_info)
+                credential_info = json.load(uploaded_file)
+                get_credentials(auth_type, credential_info)
                 st.success("Autentikasi Service Account Berhasil!")
             else:
                 # OAuth
                 if uploaded_file:
-                    client_config = json.load(uploaded_file)
+                    credential_info = json.load(uploaded_file)
                 elif os.path.exists('token.pickle'):
                     # If we have a token but no file, we hope the token is valid. 
                     # If invalid, we need client_config which might be missing if file not uploaded.
                     # For robust code, ideally we always ask for file or store client_config too.
                     # But often token.pickle is enough.
-                    client_config = None 
+                    credential_info = None 
                 else:
                     st.error("Butuh file client_secret.json untuk login pertama kali.")
                     st.stop()
                     
-                drive_service, slides_service = authenticate_user_oauth(client_config)
+                get_credentials(auth_type, credential_info)
                 st.success("Autentikasi OAuth User Berhasil!")
+
+            extra_credentials = [json.load(extra) for extra in extra_service_accounts or []]
+            for info in extra_credentials:
+                get_credentials("service_account", info)
                 
         except Exception as e:
             st.error(f"Autentikasi Gagal: {e}")
             st.stop()
 
-        # 3. Processing Loop
-        progress_bar = st.progress(0)
-        status_log = st.empty()
-        results = []
-
-        total = len(participants)
-        
-        for idx, p in enumerate(participants):
-            name = p['nama']
-            email = p['email']
-            status_text = f"Memproses ({idx+1}/{total}): {name}..."
-            status_log.text(status_text)
-            
-            start_time = time.strftime("%H:%M:%S")
-            log_entry = {'Nama': name, 'Email': email, 'Waktu': start_time, 'Status': '', 'Detail': ''}
-            
-            try:
-                # A. Copy Template
-                copy_title = f"Sertifikat - {name}"
-                body = {'name': copy_title}
-                
-                # Use target folder if specified
-                if target_folder_id:
-                     body['parents'] = [target_folder_id]
+        # 3. Submit to the job queue
+        try:
+            job_id = job_queue.submit(
+                {
+                    'template_id': template_id,
+                    'auth_type': auth_type,
+                    'credential_info': credential_info,
+                    'extra_credentials': extra_credentials,
+                    'concurrency': pipeline_concurrency,
+                    'batch_size': render_batch_size,
+                    'render_mode': render_mode,
+                    'resume': resume_run,
+                    'fields': parse_fields(fixed_fields),
+                },
+                title=f"{roster_name} → {template_id}",
+                roster=roster, roster_name=roster_name,
+            )
+        except DuplicateJobError as e:
+            # Show the running job instead of starting a second one.
+            st.error(f"{e} Tunggu sampai selesai atau batalkan dulu.")
+            st.session_state['job_id'] = e.job_id
+        else:
+            ensure_workers(job_queue)
+            st.session_state['job_id'] = job_id
+            st.success(f"Job #{job_id} masuk antrian. Progres bisa dipantau di bawah, halaman boleh ditutup.")
 
-                try:
-                    drive_response = drive_service.files().copy(
-                        fileId=template_id, body=body).execute()
-                    copy_id = drive_response.get('id')
-                except Exception as copy_error:
-                    error_msg = str(copy_error)
-                    if "404" in error_msg:
-                        log_entry['Status'] = '❌ Template Tidak Ditemukan'
-                        log_entry['Detail'] = (
-                            f"File Template ID '{template_id}' tidak ditemukan atau tidak bisa diakses "
-                            f"oleh akun yang login saat ini. Pastikan file ada dan Anda memiliki akses."
-                        )
-                    elif "403" in error_msg:
-                         log_entry['Status'] = '❌ Akses Ditolak'
-                         log_entry['Detail'] = "Akun tidak memiliki izin untuk mengedit/copy template ini."
-                    else:
-                        log_entry['Status'] = '❌ Gagal Copy Template'
-                        log_entry['Detail'] = error_msg
-                    
-                    # Skip to next participant if copy failed
-                    results.append(log_entry)
-                    progress_bar.progress((idx + 1) / total)
-                    continue
+# --- Job Queue ---
+STATUS_LABELS = {
+    "queued": "⏳ Antri", "running": "▶️ Berjalan", "done": "✅ Selesai",
+    "failed": "❌ Gagal", "cancelled": "⛔ Dibatalkan",
+}
 
-                try:
-                    # B. Replace Text
-                    requests = [
-                        {
-                            'replaceAllText': {
-                                'containsText': {
-                                    'text': '{{nama}}',
-                                    'matchCase': True
-                                },
-                                'replaceText': name
-                            }
-                        }
-                    ]
-                    slides_service.presentations().batchUpdate(
-                        presentationId=copy_id, body={'requests': requests}).execute()
-                    
-                    # C. Export to PDF
-                    request_pdf = drive_service.files().export_media(
-                        fileId=copy_id, mimeType='application/pdf')
-                    fh = io.BytesIO()
-                    downloader = MediaIoBaseDownload(fh, request_pdf)
-                    done = False
-                    while done is False:
-                        status, done = downloader.next_chunk()
-                    
-                    pdf_bytes = fh.getvalue()
-                    
-                    # D. Send Email
-                    # Personalize body if it contains {{nama}}
-                    personal_body = email_body_template.replace("{{nama}}", name) if email_body_template else ""
-                    
-                    sent, msg = send_email_with_attachment(
-                        email_sender, email_password, email, 
-                        email_subject, personal_body, pdf_bytes, f"Sertifikat_{name.replace(' ', '_')}.pdf"
-                    )
-                    
-                    if sent:
-                        log_entry['Status'] = '✅ Berhasil'
-                    else:
-                        log_entry['Status'] = '❌ Gagal Email'
-                        log_entry['Detail'] = msg
-
-                finally:
-                    # E. Cleanup (Delete temp file) - ALWAYS RUN
-                    try:
-                        drive_service.files().delete(fileId=copy_id).execute()
-                    except Exception as cleanup_error:
-                        # Log cleanup error but don't fail the row if email was sent
-                        if log_entry['Status'] == '✅ Berhasil':
-                             log_entry['Detail'] += f" (Gagal hapus temp: {str(cleanup_error)})"
-                        pass
 
-            except Exception as e:
-                log_entry['Status'] = '❌ Error System'
-                log_entry['Detail'] = str(e)
-            
-            results.append(log_entry)
-            progress_bar.progress((idx + 1) / total)
-
-        status_log.text("Proses Selesai!")
-        
-        # 4. Report
-        st.divider()
-        st.subheader("Laporan Pengiriman")
-        df_results = pd.DataFrame(results)
-        st.dataframe(df_results)
+# Rows per page of the failure table, and rows in the "latest" table.
+FAILURE_PAGE_SIZE = 50
+RECENT_ROWS = 10
+
+
+def ui_refresh_seconds():
+    """How often the job monitor polls the queue (UI_REFRESH_SECONDS, default 2)."""
+    try:
+        return max(0.5, float(os.getenv("UI_REFRESH_SECONDS") or 2))
+    except ValueError:
+        return 2.0
+
+
+def failure_table(job_id, failed):
+    """One page of failed rows; only that page is read from the queue."""
+    pages = max(1, -(-failed // FAILURE_PAGE_SIZE))
+    page = st.number_input(f"Halaman (dari {pages})", min_value=1, max_value=pages, value=1,
+                           key=f"failure_page_{job_id}") if pages > 1 else 1
+    rows = job_queue.failures(job_id, FAILURE_PAGE_SIZE, (page - 1) * FAILURE_PAGE_SIZE)
+    st.dataframe([log_entry for _, log_entry in rows], hide_index=True)
+
+
+@st.fragment(run_every=ui_refresh_seconds())
+def job_monitor():
+    jobs = job_queue.list()
+    if not jobs:
+        st.caption("Belum ada job.")
+        return
+    import pandas as pd
+
+    st.dataframe(
+        pd.DataFrame([{
+            'Job': f"#{job['id']}",
+            'Status': STATUS_LABELS.get(job['status'], job['status']),
+            'Progres': f"{job['done']}/{job['total']}" + ("" if job['roster_done'] else "+"),
+            'Gagal': job['failed'],
+            'Sertifikat/menit': round(job['throughput'], 1),
+            'Data': job['title'],
+        } for job in jobs]),
+        hide_index=True,
+    )
+
+    ids = [job['id'] for job in jobs]
+    selected = st.session_state.get('job_id')
+    job_id = st.selectbox(
+        "Detail job", ids, index=ids.index(selected) if selected in ids else 0,
+        format_func=lambda i: f"#{i}",
+    )
+    st.session_state['job_id'] = job_id
+    job = job_queue.get(job_id)
+
+    if job['status'] in ("queued", "running"):
+        if st.button("⛔ Batalkan job", key=f"cancel_{job_id}"):
+            job_queue.cancel(job_id)
+        if job['status'] == "queued" and not job_queue.live_workers():
+            ensure_workers(job_queue)
+        total = max(job['total'], 1)
+        suffix = "" if job['roster_done'] else " (membaca & merencanakan data peserta, pengiriman dimulai setelahnya)"
+        st.progress(min(job['done'] / total, 1.0),
+                    text=f"{STATUS_LABELS[job['status']]}: {job['done']}/{job['total']}{suffix} "
+                         f"— {job['throughput']:.1f} sertifikat/menit")
+    for level, message in job_queue.notices(job_id):
+        (st.warning if level == "warning" else st.info)(message)
+    if job['error']:
+        st.error(f"Job gagal: {job['error']}")
+
+    if not job['done']:
+        return
+
+    # Report: counts come from the queue and rows are read a page at a time,
+    # so a 10k-row job costs no more to watch than a small one.
+    st.subheader("Laporan Pengiriman")
+    col_ok, col_failed, col_download = st.columns(3)
+    col_ok.metric("Berhasil", job['done'] - job['failed'])
+    col_failed.metric("Gagal", job['failed'])
+    col_download.download_button(
+        "Download Laporan CSV", lambda: job_queue.export_csv(job_id), f"laporan-job-{job_id}.csv", "text/csv",
+        key=f"report_{job_id}",
+    )
+    summary = job['summary'] or {}
+    if 'cache_hits' in summary:
+        st.caption(
+            f"Cache PDF: {summary['cache_hits']} hit, {summary['cache_misses']} miss "
+            f"(hit = sertifikat diambil dari cache tanpa panggilan API Google)."
+        )
+    if 'copy_pool_hits' in summary:
+        st.caption(
+            f"Salinan template siap pakai: {summary['copy_pool_hits']} dipakai, "
+            f"{summary['copy_pool_misses']} harus disalin langsung."
+        )
+    if job['failed']:
+        st.caption("❌ Peserta yang gagal")
+        failure_table(job_id, job['failed'])
+    if job['status'] == "running":
+        st.caption("Terakhir selesai")
+        st.dataframe([log_entry for _, log_entry in job_queue.recent(job_id, RECENT_ROWS)], hide_index=True)
+
+    # Metrics
+    metrics_summary = summary.get('metrics')
+    if not metrics_summary:
+        return
+    with st.expander("⏱️ Metrics Run (Latensi per Tahap)", expanded=False):
+        st.write(
+            f"**Durasi:** {metrics_summary['elapsed_seconds']:.1f} detik — "
+            f"**Throughput:** {metrics_summary['certificates_per_minute']:.1f} sertifikat/menit"
+        )
+        for title, key in (("Per Tahap", 'stages'), ("Per Panggilan API", 'api')):
+            if metrics_summary[key]:
+                st.caption(title)
+                st.dataframe(pd.DataFrame(metrics_summary[key]).T)
+        if metrics_summary['retries']:
+            st.caption(f"Retry: {metrics_summary['retries']}")
+        col_json, col_prom = st.columns(2)
+        col_json.download_button("Download JSON", json.dumps(metrics_summary, indent=2, sort_keys=True),
+                                 f"metrics-{job_id}.json", "application/json")
+        col_prom.download_button("Download Prometheus", summary.get('prometheus', ""),
+                                 f"metrics-{job_id}.prom", "text/plain")
+
+
+st.divider()
+st.subheader("📦 Antrian Job")
+st.caption(f"Job dijalankan oleh worker terpisah ({workers_from_env()} proses, `JOB_WORKERS`); "
+           "menutup atau me-refresh halaman tidak menghentikan pengiriman.")
+job_monitor()
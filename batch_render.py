@@ -0,0 +1,200 @@
+import uuid
+
+from pypdf import PdfReader, PdfWriter
+
+from metrics import SKIPPED
+from drive_cleanup import tag
+from pipeline import (cache_store, certificate_fields, describe_copy_error, download_pdf, journal_cleaned, replace_requests,
+                      send_job, template_placeholders)
+from rate_limit import RetryLater, is_account_limit_error
+from spool import close_quietly, file_size, spooled
+
+# Batch-and-split rendering: one Drive copy, one Slides batchUpdate and one
+# PDF export serve a whole chunk of participants. The template slides are
+# duplicated once per participant inside the copy, every duplicate gets its
+# own replacements for all template fields, and the exported deck is split
+# into per-row PDFs locally.
+#
+# Drive limits exports to 10 MB, so keep RENDER_BATCH_SIZE small enough that
+# a whole chunk's deck stays under that size.
+
+
+def chunk_units(units, batch_size):
+    """Pack planned units (see planning.py) into chunks of about ``batch_size`` rows.
+
+    A unit is never split, so an address's certificates are rendered and
+    sent by the same chunk; a unit larger than ``batch_size`` is a chunk
+    of its own.
+    """
+    chunk = []
+    for unit in units:
+        if all(row.get('cached') for row in unit):
+            # Already rendered: goes straight to sending on its own.
+            yield {'rows': unit, 'cached': True}
+            continue
+        if chunk and len(chunk) + len(unit) > batch_size:
+            yield {'rows': chunk}
+            chunk = []
+        chunk.extend(unit)
+        if len(chunk) >= batch_size:
+            yield {'rows': chunk}
+            chunk = []
+    if chunk:
+        yield {'rows': chunk}
+
+
+def render_rows(job):
+    """Rows of a chunk that still need a PDF (cached rows already have one)."""
+    return [row for row in job['rows'] if not row.get('cached')]
+
+
+def build_chunk_requests(slide_ids, rows_fields, placeholders, id_prefix):
+    """Build the single batchUpdate body for a chunk.
+
+    ``rows_fields[i]`` holds the field values of the chunk's ``i``-th row
+    and ``placeholders`` maps placeholder text to field key. Returns
+    ``(requests, pages)`` where ``pages[i]`` lists the 0-based PDF page
+    numbers that belong to row ``i``. Duplicates of a slide are inserted
+    right after it, so creating them from the last participant backwards
+    leaves each slide's copies in participant order: slide ``j`` of
+    participant ``i`` ends up on page ``j * len(rows_fields) + i``.
+    """
+    count = len(rows_fields)
+    requests = []
+    page_ids = [list(slide_ids)] + [[] for _ in range(count - 1)]
+    for j, slide_id in enumerate(slide_ids):
+        for i in range(count - 1, 0, -1):
+            new_id = f"{id_prefix}_{i}_{j}"
+            requests.append({
+                'duplicateObject': {
+                    'objectId': slide_id,
+                    'objectIds': {slide_id: new_id}
+                }
+            })
+        for i in range(1, count):
+            page_ids[i].append(f"{id_prefix}_{i}_{j}")
+
+    for i, fields in enumerate(rows_fields):
+        requests.extend(replace_requests(placeholders, fields, page_ids[i]))
+
+    pages = [[j * count + i for j in range(len(slide_ids))] for i in range(count)]
+    return requests, pages
+
+
+def split_pdf(pdf, pages):
+    """Split one exported deck (a binary file) into a spooled PDF per entry of ``pages``."""
+    reader = PdfReader(pdf)
+    expected = sum(len(p) for p in pages)
+    if len(reader.pages) != expected:
+        raise ValueError(f"PDF batch berisi {len(reader.pages)} halaman, seharusnya {expected}.")
+
+    parts = []
+    for page_numbers in pages:
+        writer = PdfWriter()
+        for number in page_numbers:
+            writer.add_page(reader.pages[number])
+        out = spooled()
+        writer.write(out)
+        out.seek(0)
+        parts.append(out)
+    return parts
+
+
+# --- Chunk Stages ---
+def stage_copy_chunk(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    rows = job['rows']
+    account = ctx.google(job)
+    pooled = ctx.take_copy(account)
+    if pooled:
+        job['copy_id'] = pooled
+        return
+    body = tag({'name': f"Sertifikat Batch - {rows[0]['nama']} (+{len(rows) - 1})"})
+    # Use target folder if specified
+    if ctx.target_folder_id:
+        body['parents'] = [ctx.target_folder_id]
+
+    try:
+        drive_response = account.limiter.call('drive_copy', lambda: account.drive().files().copy(
+            fileId=ctx.template_id, body=body).execute())
+        job['copy_id'] = drive_response.get('id')
+    except RetryLater:
+        raise
+    except Exception as copy_error:
+        if is_account_limit_error(copy_error):
+            ctx.fail_over(job, account, copy_error)
+        status, detail = describe_copy_error(ctx.template_id, copy_error)
+        for row in rows:
+            row['log']['Status'] = status
+            row['log']['Detail'] = detail
+        job['failed'] = True
+
+
+def template_slide_ids(ctx):
+    """Slide object IDs of the template, read once per run.
+
+    Drive copies keep the template's object IDs, so every chunk copy can be
+    addressed with them without another presentations.get call.
+    """
+    def fetch():
+        presentation = ctx.slides().presentations().get(
+            presentationId=ctx.template_id, fields='slides(objectId)').execute()
+        return [slide['objectId'] for slide in presentation.get('slides', [])]
+
+    slide_ids = ctx.cached('template_slide_ids', fetch)
+    if not slide_ids:
+        raise ValueError("Template tidak memiliki slide.")
+    return slide_ids
+
+
+def stage_render_chunk(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    slide_ids = template_slide_ids(ctx)
+    rows_fields = [certificate_fields(row) for row in render_rows(job)]
+    requests, job['pages'] = build_chunk_requests(
+        slide_ids, rows_fields, template_placeholders(ctx), f"c{uuid.uuid4().hex[:8]}")
+    account = ctx.google(job)
+    account.limiter.call('slides_update', lambda: account.slides().presentations().batchUpdate(
+        presentationId=job['copy_id'], body={'requests': requests}).execute())
+
+
+def stage_export_chunk(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    account = ctx.google(job)
+    pdf = account.limiter.call('drive_export', lambda: download_pdf(account.drive(), job['copy_id']))
+    try:
+        ctx.metrics.add_bytes('export', file_size(pdf))
+        parts = split_pdf(pdf, job['pages'])
+    finally:
+        pdf.close()
+    for row, part in zip(render_rows(job), parts):
+        row['pdf'] = part
+        cache_store(ctx, row, part)
+
+
+def stage_send_chunk(ctx, job):
+    # One email per address in the chunk; a failed address does not fail
+    # the others.
+    send_job(ctx, job)
+
+
+def stage_cleanup_chunk(ctx, job):
+    for row in job['rows']:
+        close_quietly(row.pop('pdf', None))
+    copy_id = job.get('copy_id')
+    if not copy_id:
+        return SKIPPED
+    ctx.defer_delete(ctx.google(job), copy_id, journal_cleaned(ctx, job))
+
+
+def chunk_stages(ctx):
+    return [
+        ("copy", lambda job: stage_copy_chunk(ctx, job), False),
+        ("replace", lambda job: stage_render_chunk(ctx, job), False),
+        ("export", lambda job: stage_export_chunk(ctx, job), False),
+        ("send", lambda job: stage_send_chunk(ctx, job), False),
+        ("cleanup", lambda job: stage_cleanup_chunk(ctx, job), True),
+    ]
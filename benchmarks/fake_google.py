@@ -0,0 +1,260 @@
+import email
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+from pypdf import PdfWriter
+
+# In-process stand-in for the Drive v3 and Slides v1 endpoints the app uses.
+# It plugs in below googleapiclient as the ``http`` object, so requests go
+# through the real discovery-built clients, HttpRequest and
+# MediaIoBaseDownload; only the network is replaced. Every endpoint has a
+# configurable latency and a share of calls can fail with 429/503.
+
+TEMPLATE_ID = "TEMPLATE"
+TEMPLATE_SLIDE_ID = "p1"
+# The template's one text box, holding the {{nama}} placeholder.
+TEMPLATE_NAME_BOX = {
+    'objectId': "name_box",
+    'shape': {'text': {'textElements': [{'textRun': {'content': "{{nama}}\n"}}]}},
+}
+
+# endpoint: default latency in seconds
+DEFAULT_LATENCY = {
+    "copy": 0.05,
+    "batch_update": 0.05,
+    "export": 0.08,
+    "delete": 0.03,
+    "get": 0.02,
+    "list": 0.05,
+    "about": 0.02,
+    "batch": 0.1,
+}
+
+_ROUTES = [
+    ("POST", re.compile(r"^/batch/drive/v3$"), "batch"),
+    ("POST", re.compile(r"^/drive/v3/files/([^/]+)/copy$"), "copy"),
+    ("GET", re.compile(r"^/drive/v3/files/([^/]+)/export$"), "export"),
+    ("DELETE", re.compile(r"^/drive/v3/files/trash$"), "empty_trash"),
+    ("DELETE", re.compile(r"^/drive/v3/files/([^/]+)$"), "delete"),
+    ("GET", re.compile(r"^/drive/v3/files/([^/]+)$"), "get"),
+    ("GET", re.compile(r"^/drive/v3/files$"), "list"),
+    ("GET", re.compile(r"^/drive/v3/about$"), "about"),
+    ("POST", re.compile(r"^/v1/presentations/([^/]+):batchUpdate$"), "batch_update"),
+    ("GET", re.compile(r"^/v1/presentations/([^/]+)$"), "presentation"),
+]
+
+
+def _response(status, content=b"", content_type="application/json", **headers):
+    if isinstance(content, (dict, list)):
+        content = json.dumps(content).encode("utf-8")
+    return httplib2.Response(dict({
+        'status': status, 'content-type': content_type, 'content-length': str(len(content)),
+    }, **headers)), content
+
+
+def _byte_range(content, header):
+    """206 response for a ``bytes=start-end`` Range header, as Drive sends them."""
+    match = re.match(r"bytes=(\d+)-(\d*)$", header or "")
+    if not match:
+        return _response(200, content, "application/pdf")
+    start = int(match.group(1))
+    end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+    return _response(206, content[start:end + 1], "application/pdf",
+                     **{'content-range': f"bytes {start}-{end}/{len(content)}"})
+
+
+def _error(status, reason):
+    return _response(status, {'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}})
+
+
+class FakeGoogle:
+    """Shared state of the fake Drive/Slides backend.
+
+    ``latency`` overrides DEFAULT_LATENCY per endpoint; every call sleeps a
+    uniformly jittered +/-50% around it, times ``latency_scale``.
+    ``error_rate`` is the share of copy/batchUpdate/export/delete calls that
+    fail with a retryable 429 or 503. ``pdf_kb`` pads each exported page.
+    """
+
+    def __init__(self, latency=None, latency_scale=1.0, error_rate=0.0, pdf_kb=0, seed=None):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.pdf_kb = pdf_kb
+        self.files = {TEMPLATE_ID: {'name': 'Template', 'slides': 1}}
+        self.calls = {}
+        self.errors = 0
+        self._next_id = 0
+        self._pdfs = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def http(self):
+        """A fresh httplib2-compatible object; build one per client."""
+        return FakeHttp(self)
+
+    def live_copies(self):
+        with self._lock:
+            return len(self.files) - 1
+
+    # --- Behaviour ---
+    def _delay(self, endpoint):
+        base = self.latency.get(endpoint, 0.0) * self.latency_scale
+        if base > 0:
+            time.sleep(base * self._random.uniform(0.5, 1.5))
+
+    def _inject_error(self, endpoint):
+        if endpoint not in ("copy", "batch_update", "export", "delete") or self.error_rate <= 0:
+            return None
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return None
+            self.errors += 1
+            status = self._random.choice((429, 503))
+        return _error(status, "rateLimitExceeded" if status == 429 else "backendError")
+
+    def _pdf(self, pages):
+        with self._lock:
+            if pages not in self._pdfs:
+                writer = PdfWriter()
+                for _ in range(pages):
+                    writer.add_blank_page(842, 595)
+                if self.pdf_kb:
+                    writer.add_metadata({'/Padding': "x" * (self.pdf_kb * 1024 * pages)})
+                out = io.BytesIO()
+                writer.write(out)
+                self._pdfs[pages] = out.getvalue()
+            return self._pdfs[pages]
+
+    def handle(self, method, uri, body, headers=None, inner=False):
+        parsed = urlparse(uri)
+        for route_method, pattern, endpoint in _ROUTES:
+            match = pattern.match(parsed.path) if route_method == method else None
+            if match:
+                break
+        else:
+            return _error(404, "notFound")
+
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if endpoint == "batch":
+            self._delay(endpoint)
+            return self._batch((headers or {}).get('content-type', ''), body)
+        if not inner:
+            # Calls inside a batch share the batch's latency.
+            self._delay(endpoint)
+        failure = self._inject_error(endpoint)
+        if failure is not None:
+            return failure
+        file_id = unquote(match.group(1)) if match.groups() else None
+        query = parse_qs(parsed.query)
+        if endpoint == "export":
+            query['range'] = [(headers or {}).get('range', '')]
+        return getattr(self, f"_{endpoint}")(file_id, query, json.loads(body) if body else {})
+
+    # --- Endpoints ---
+    def _copy(self, file_id, query, body):
+        with self._lock:
+            if file_id not in self.files:
+                return _error(404, "notFound")
+            self._next_id += 1
+            new_id = f"copy-{self._next_id}"
+            self.files[new_id] = {'name': body.get('name', ''), 'slides': self.files[file_id]['slides'],
+                                  'tagged': bool(body.get('appProperties'))}
+        return _response(200, {'id': new_id})
+
+    def _batch_update(self, file_id, query, body):
+        duplicates = sum(1 for request in body.get('requests', []) if 'duplicateObject' in request)
+        with self._lock:
+            if file_id not in self.files:
+                return _error(404, "notFound")
+            self.files[file_id]['slides'] += duplicates
+        return _response(200, {'presentationId': file_id, 'replies': [{} for _ in body.get('requests', [])]})
+
+    def _export(self, file_id, query, body):
+        with self._lock:
+            entry = self.files.get(file_id)
+        if entry is None:
+            return _error(404, "notFound")
+        return _byte_range(self._pdf(entry['slides']), query['range'][0])
+
+    def _delete(self, file_id, query, body):
+        with self._lock:
+            if self.files.pop(file_id, None) is None:
+                return _error(404, "notFound")
+        return _response(204)
+
+    def _empty_trash(self, file_id, query, body):
+        return _response(204)
+
+    def _get(self, file_id, query, body):
+        with self._lock:
+            entry = self.files.get(file_id)
+        if entry is None:
+            return _error(404, "notFound")
+        return _response(200, {'id': file_id, 'name': entry['name'], 'headRevisionId': 'bench-1', 'version': '1'})
+
+    def _list(self, file_id, query, body):
+        page_size = int(query.get('pageSize', ['100'])[0])
+        offset = int(query.get('pageToken', ['0'])[0])
+        tagged_only = "appProperties has" in query.get('q', [''])[0]
+        with self._lock:
+            ids = [key for key, entry in self.files.items()
+                   if key != TEMPLATE_ID and (entry.get('tagged') or not tagged_only)]
+        page = [{'id': key, 'name': self.files.get(key, {}).get('name', '')} for key in ids[offset:offset + page_size]]
+        result = {'files': page}
+        if offset + page_size < len(ids):
+            result['nextPageToken'] = str(offset + page_size)
+        return _response(200, result)
+
+    def _batch(self, content_type, body):
+        """Run every part of a multipart/mixed batch request through ``handle``."""
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        message = email.message_from_string(f"Content-Type: {content_type}\r\n\r\n{body}")
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().lstrip().partition("\n")
+            method, uri, _ = request_line.split(" ", 2)
+            _, _, inner_body = rest.replace("\r\n", "\n").partition("\n\n")
+            response, content = self.handle(method, uri, inner_body.strip() or None, inner=True)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {response.status} OK\r\nContent-Type: application/json\r\n\r\n"
+                f"{content.decode('utf-8')}\r\n"
+            )
+        payload = "".join(parts) + f"--{boundary}--\r\n"
+        return _response(200, payload.encode("utf-8"), f"multipart/mixed; boundary={boundary}")
+
+    def _about(self, file_id, query, body):
+        return _response(200, {'storageQuota': {'usage': '0', 'limit': str(15 * 1024 ** 3)}})
+
+    def _presentation(self, file_id, query, body):
+        with self._lock:
+            entry = self.files.get(file_id)
+        if entry is None:
+            return _error(404, "notFound")
+        slides = [{'objectId': TEMPLATE_SLIDE_ID, 'pageElements': [TEMPLATE_NAME_BOX]}]
+        slides += [{'objectId': f"s{i}"} for i in range(1, entry['slides'])]
+        return _response(200, {'presentationId': file_id, 'slides': slides})
+
+
+class FakeHttp:
+    """The slice of the httplib2.Http interface googleapiclient calls."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        return self.backend.handle(method, uri, body, headers)
@@ -0,0 +1,229 @@
+"""Offline end-to-end benchmark of the certificate pipeline.
+
+Runs the real pipeline (stages, rate limiter, journal, SMTP pool) against
+the fake Drive/Slides backend in fake_google.py and the local SMTP sink in
+smtp_sink.py, once per roster size, each in a fresh process so peak memory
+is measured per size. Results are printed and saved to benchmarks/results/
+as JSON; pass ``--compare`` with an earlier file to see the difference.
+
+    python benchmarks/run_benchmark.py
+    python benchmarks/run_benchmark.py --sizes 10,1000 --batch-size 10 --error-rate 0.05
+    python benchmarks/run_benchmark.py --compare benchmarks/results/<earlier>.json
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [ROOT, BENCH_DIR]
+
+from metrics import percentile  # noqa: E402
+
+DEFAULT_SIZES = "10,1000,10000"
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+RATE_ENV_VARS = ("RATE_DRIVE_COPY", "RATE_DRIVE_EXPORT", "RATE_DRIVE_DELETE", "RATE_SLIDES_UPDATE", "RATE_SMTP_SEND")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline sertifikat dengan Google API palsu & SMTP sink lokal.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Jumlah peserta per run (default {DEFAULT_SIZES}).")
+    parser.add_argument("--batch-size", type=int, default=1, help="RENDER_BATCH_SIZE untuk run benchmark.")
+    parser.add_argument("--workers", help="Worker per tahap (per akun), misal copy=8,send=4.")
+    parser.add_argument("--google-accounts", type=int, default=1, help="Jumlah akun Google palsu untuk sharding.")
+    parser.add_argument("--senders", type=int, default=1, help="Jumlah akun pengirim untuk sharding.")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Pengali latensi semua endpoint palsu (0 = tanpa latensi).")
+    parser.add_argument("--smtp-latency", type=float, default=0.02, help="Latensi per email di SMTP sink (detik).")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Porsi panggilan Drive/Slides yang gagal 429/503 (0-1).")
+    parser.add_argument("--smtp-error-rate", type=float, default=0.0, help="Porsi email yang dijawab 451 (0-1).")
+    parser.add_argument("--copy-pool", type=int,
+                        help="Salinan template siap pakai per akun (default COPY_POOL_SIZE; 0 = mati).")
+    parser.add_argument("--pdf-kb", type=int, default=0, help="Tambahan ukuran PDF per halaman (KB).")
+    parser.add_argument("--respect-rate-limits", action="store_true",
+                        help="Pakai RATE_* dari environment; default: rate limiter dibuat longgar.")
+    parser.add_argument("--no-journal", action="store_true", help="Jalankan tanpa journal SQLite.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="File hasil (default: benchmarks/results/<waktu>-<commit>.json).")
+    parser.add_argument("--no-save", action="store_true", help="Jangan simpan hasil ke file.")
+    parser.add_argument("--compare", metavar="JSON", help="Bandingkan dengan file hasil sebelumnya.")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    return parser
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# --- One Run ---
+def run_once(size, args):
+    if not args.respect_rate_limits:
+        for name in RATE_ENV_VARS:
+            os.environ[name] = "10000"
+    os.environ["PDF_CACHE"] = "off"
+
+    from googleapiclient.discovery import build_from_document
+
+    import journal
+    import pipeline
+    from accounts import AccountPool, GoogleAccount, SenderAccount
+    from copy_pool import pool_size_from_env
+    from fake_google import TEMPLATE_ID, FakeGoogle
+    from google_clients import discovery_document
+    from send_certificates import parse_workers
+    from smtp_sink import SMTPSink
+
+    class FakeAccount(GoogleAccount):
+        """GoogleAccount whose clients talk to the fake backend."""
+
+        def __init__(self, name, google):
+            super().__init__(name, None)
+            self.google = google
+
+        def build(self, name, version):
+            return build_from_document(discovery_document(name, version), http=self.google.http())
+
+    google = FakeGoogle(latency_scale=args.latency_scale, error_rate=args.error_rate,
+                        pdf_kb=args.pdf_kb, seed=args.seed)
+    concurrency = dict(pipeline.concurrency_from_env(), **(parse_workers(args.workers) if args.workers else {}))
+    fed = {}
+    latencies = []
+    statuses = collections.Counter()
+
+    def participants():
+        for i in range(size):
+            email = f"peserta{i}@example.com"
+            fed[email] = time.perf_counter()
+            yield {'nama': f"Peserta {i}", 'email': email}
+
+    with SMTPSink(latency=args.smtp_latency, error_rate=args.smtp_error_rate, seed=args.seed) as sink, \
+            tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(SMTP_HOST=sink.host, SMTP_PORT=str(sink.port), SMTP_STARTTLS="false")
+        ctx = pipeline.CertificateContext(None, TEMPLATE_ID, None, "bench@example.com", "", "Sertifikat", "Halo {{nama}}")
+        ctx.google_accounts = AccountPool(
+            [FakeAccount(f"bench-{i + 1}", google) for i in range(max(1, args.google_accounts))])
+        ctx.senders = AccountPool(
+            [SenderAccount(f"bench{i + 1}@example.com", "") for i in range(max(1, args.senders))])
+        ctx.copy_pool_size = pool_size_from_env() if args.copy_pool is None else args.copy_pool
+        if not args.no_journal:
+            ctx.journal = journal.JobJournal(os.path.join(tmp, "journal.sqlite3"), run_key=f"bench-{size}")
+        started = time.perf_counter()
+        try:
+            for row, log_entry in pipeline.run_certificates(ctx, participants(), concurrency, args.batch_size):
+                latencies.append(time.perf_counter() - fed[row['email']])
+                statuses['ok' if log_entry['Status'].startswith('✅') else 'failed'] += 1
+        finally:
+            if ctx.journal:
+                ctx.journal.close()
+        seconds = time.perf_counter() - started
+        smtp = {'messages': sink.messages, 'bytes': sink.bytes, 'errors': sink.errors}
+
+    latencies.sort()
+    summary = ctx.metrics.summary()
+    return {
+        'size': size,
+        'seconds': round(seconds, 3),
+        'certificates_per_minute': round(size * 60 / seconds, 1) if seconds else 0.0,
+        'ok': statuses['ok'],
+        'failed': statuses['failed'],
+        'latency': {f"p{round(q * 100)}": round(percentile(latencies, q), 4) for q in (0.5, 0.95, 0.99)},
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': summary['stages'],
+        'api': summary['api'],
+        'retries': summary['retries'],
+        'copy_pool': ctx.copy_pool_stats,
+        'fake_google': {'calls': google.calls, 'errors': google.errors, 'live_copies': google.live_copies()},
+        'smtp': smtp,
+        'threads_left': threading.active_count() - 1,
+    }
+
+
+# --- Driver ---
+def run_in_subprocess(size, argv):
+    command = [sys.executable, os.path.abspath(__file__), *argv, "--single", str(size)]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Benchmark {size} peserta gagal (exit {completed.returncode}).")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results, previous=None):
+    previous = {r['size']: r for r in (previous or {}).get('results', [])}
+    print(f"{'peserta':>8} {'detik':>8} {'sert/menit':>11} {'ok':>6} {'gagal':>6} "
+          f"{'p50':>7} {'p95':>7} {'p99':>7} {'RSS MB':>7}")
+    for r in results:
+        latency = r['latency']
+        print(f"{r['size']:>8} {r['seconds']:>8.2f} {r['certificates_per_minute']:>11.1f} {r['ok']:>6} "
+              f"{r['failed']:>6} {latency['p50']:>7.3f} {latency['p95']:>7.3f} {latency['p99']:>7.3f} "
+              f"{r['peak_rss_mb'] or 0:>7.1f}")
+        old = previous.get(r['size'])
+        if old:
+            speed = (r['certificates_per_minute'] / old['certificates_per_minute'] - 1) * 100 \
+                if old['certificates_per_minute'] else 0.0
+            print(f"{'':>8} vs sebelumnya: throughput {speed:+.1f}%, "
+                  f"p95 {r['latency']['p95'] - old['latency']['p95']:+.3f}s, "
+                  f"RSS {(r['peak_rss_mb'] or 0) - (old['peak_rss_mb'] or 0):+.1f} MB")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+    if args.single is not None:
+        print(json.dumps(run_once(args.single, args)))
+        return 0
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"Menjalankan {size} peserta...", file=sys.stderr)
+        results.append(run_in_subprocess(size, argv))
+
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('single', 'compare', 'output')},
+        'results': results,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    print_table(results, previous)
+
+    if not args.no_save:
+        path = args.output or os.path.join(
+            RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Hasil disimpan di {path}", file=sys.stderr)
+    return 1 if any(r['failed'] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import random
+import socketserver
+import threading
+import time
+
+# Local SMTP sink for benchmarks and tests: speaks just enough ESMTP for
+# smtplib (no TLS, no AUTH), counts connections, accepted messages and
+# bytes, and can add latency per message, answer a share of them with a
+# transient 451, keep the raw DATA of each message, or drop a connection
+# after a number of messages.
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connected()
+        self._reply("220 localhost benchmark sink")
+        accepted = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].decode("ascii", "replace").upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250 8BITMIME\r\n")
+            elif command in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data in iter(self.rfile.readline, b""):
+                    if data == b".\r\n":
+                        break
+                    lines.append(data)
+                self._reply(sink.accept(b"".join(lines)))
+                accepted += 1
+                if sink.drop_after and accepted >= sink.drop_after:
+                    # Hang up without a 421, like a server timing the session out.
+                    return
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.02, latency_scale=1.0, error_rate=0.0, seed=None,
+                 keep=False, drop_after=0):
+        self.latency = latency * latency_scale
+        self.error_rate = error_rate
+        self.keep = keep
+        self.drop_after = drop_after
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        # Raw DATA of each accepted message (still dot-stuffed) when ``keep``.
+        self.data = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def accept(self, data):
+        """Reply line for one finished DATA block."""
+        if self.latency > 0:
+            time.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        with self._lock:
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                self.errors += 1
+                return "451 4.3.0 Try again later"
+            self.messages += 1
+            self.bytes += len(data)
+            if self.keep:
+                self.data.append(data)
+        return "250 OK: queued"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
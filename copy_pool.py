@@ -0,0 +1,145 @@
+import os
+import queue
+import threading
+
+from drive_cleanup import TOOL_PROPERTIES, tag
+from rate_limit import backoff_delay, is_account_limit_error
+
+# Pre-warmed template copies. files.copy is one of the slowest Drive calls
+# and every participant (or chunk) needs a fresh copy, so background
+# threads keep COPY_POOL_SIZE copies per Google account ready in
+# TARGET_FOLDER_ID and the copy stage takes one instead of waiting. When
+# the pool is empty the stage copies directly as before. A pool never makes
+# more copies than the planned run needs (``budget``), so a small or fully
+# cached run does not fill Drive with copies nobody takes.
+#
+# Copies are tagged with the run they were made for. Unused copies are
+# deleted when the run ends; after a crash, the next start of the same run
+# deletes the ones that no journaled row is using.
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_WORKERS = 2
+POOL_PROPERTY = 'pool'
+
+
+def _int_from_env(name, default):
+    try:
+        return max(0, int(os.getenv(name) or default))
+    except ValueError:
+        return default
+
+
+def pool_size_from_env():
+    """Copies kept ready per Google account (COPY_POOL_SIZE, 0 = off)."""
+    return _int_from_env("COPY_POOL_SIZE", DEFAULT_POOL_SIZE)
+
+
+def pool_workers_from_env():
+    return max(1, _int_from_env("COPY_POOL_WORKERS", DEFAULT_POOL_WORKERS))
+
+
+def pool_body(ctx, run_id):
+    body = tag({'name': "Sertifikat - (siap pakai)"})
+    body['appProperties'][POOL_PROPERTY] = run_id
+    if ctx.target_folder_id:
+        body['parents'] = [ctx.target_folder_id]
+    return body
+
+
+def leftover_copies(service, run_id):
+    """IDs of pool copies made for ``run_id`` that still exist."""
+    query = "'me' in owners and trashed=false" + "".join(
+        f" and appProperties has {{ key='{key}' and value='{value}' }}"
+        for key, value in dict(TOOL_PROPERTIES, **{POOL_PROPERTY: run_id}).items()
+    )
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=query, spaces='drive', fields='nextPageToken, files(id)', pageSize=1000, pageToken=page_token
+        ).execute()
+        for file in response.get('files', []):
+            yield file['id']
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            return
+
+
+class CopyPool:
+    """Keeps up to ``size`` fresh copies of the template ready for one account.
+
+    At most ``budget`` copies are made in total (None = no limit).
+    """
+
+    def __init__(self, account, template_id, body, size, workers=DEFAULT_POOL_WORKERS, budget=None):
+        self.account = account
+        self.template_id = template_id
+        self.body = body
+        self.hits = 0
+        self.misses = 0
+        self._budget = budget
+        self._budget_lock = threading.Lock()
+        self._ready = queue.Queue()
+        # Copies ready or being made; a take frees one slot.
+        self._slots = threading.Semaphore(size)
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._fill, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def _fill(self):
+        failures = 0
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=0.2):
+                continue
+            if self._stop.is_set() or self.account.exhausted or not self._spend(1):
+                self._slots.release()
+                return
+            try:
+                response = self.account.limiter.call('drive_copy', lambda: self.account.drive().files().copy(
+                    fileId=self.template_id, body=self.body).execute())
+            except Exception as e:
+                self._spend(-1)
+                self._slots.release()
+                if is_account_limit_error(e):
+                    # The copy stage fails the account over; nothing to prefetch.
+                    return
+                failures += 1
+                self._stop.wait(backoff_delay(failures))
+                continue
+            failures = 0
+            self._ready.put(response['id'])
+
+    def _spend(self, count):
+        """Reserve (or give back) copies from the budget; False when it is used up."""
+        with self._budget_lock:
+            if self._budget is None:
+                return True
+            if count > 0 and self._budget < count:
+                return False
+            self._budget -= count
+            return True
+
+    def take(self):
+        """A ready copy ID, or None when none is ready right now."""
+        try:
+            copy_id = self._ready.get_nowait()
+        except queue.Empty:
+            self.misses += 1
+            # The caller copies directly; that copy comes out of the budget.
+            self._spend(1)
+            return None
+        self._slots.release()
+        self.hits += 1
+        return copy_id
+
+    def close(self):
+        """Stop prefetching and return the IDs of copies nobody took."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=30)
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._ready.get_nowait())
+            except queue.Empty:
+                return leftovers
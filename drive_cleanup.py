@@ -0,0 +1,226 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limit import RetryLater, backoff_delay, http_status, is_quota_error, is_retryable, max_retries_from_env
+
+# Fast deletion of the temporary presentation copies this tool creates.
+# Every copy is tagged with TOOL_PROPERTIES (Drive appProperties) so a
+# sweep only touches our own files. Deletes go out as Drive batch HTTP
+# requests of up to BATCH_LIMIT calls, several batches in flight at once;
+# individual calls that fail transiently are retried in a later round.
+# DeferredDeleter lets the pipeline hand off its per-row deletes instead of
+# waiting for them.
+
+TOOL_PROPERTIES = {'createdBy': 'automasi-sertifikat'}
+# Drive accepts at most 100 calls per batch request.
+BATCH_LIMIT = 100
+DEFAULT_SWEEP_WORKERS = 4
+# Seconds a deferred delete may wait for its batch to fill up.
+DEFER_INTERVAL = 2.0
+
+
+def tag(body):
+    """Mark a files.copy/create body as a temporary file of this tool."""
+    body['appProperties'] = dict(TOOL_PROPERTIES)
+    return body
+
+
+def temp_files_query(tagged_only=True):
+    query = "'me' in owners and trashed=false"
+    if tagged_only:
+        query += "".join(f" and appProperties has {{ key='{key}' and value='{value}' }}"
+                         for key, value in TOOL_PROPERTIES.items())
+    return query
+
+
+def list_temp_files(service, tagged_only=True):
+    """Yield ``{id, name}`` of files to sweep; all files owned by 'me' if not ``tagged_only``."""
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=temp_files_query(tagged_only),
+            spaces='drive',
+            fields='nextPageToken, files(id, name)',
+            pageSize=1000,
+            pageToken=page_token
+        ).execute()
+        yield from response.get('files', [])
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            return
+
+
+# --- Batch Deletes ---
+def delete_batch(service, file_ids, limiter=None):
+    """Delete up to BATCH_LIMIT files in one batch request.
+
+    Returns ``(deleted, retry, errors)``: the number deleted (files that
+    were already gone count too), IDs to try again and ``{id: message}``
+    for permanent failures.
+    """
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = exception
+
+    batch = service.new_batch_http_request(callback=callback)
+    for file_id in file_ids:
+        batch.add(service.files().delete(fileId=file_id), request_id=file_id)
+    try:
+        if limiter is not None:
+            limiter.call('drive_delete', batch.execute, cost=len(file_ids))
+        else:
+            batch.execute()
+    except RetryLater:
+        return 0, list(file_ids), {}
+    except Exception as e:
+        if is_retryable(e):
+            return 0, list(file_ids), {}
+        return 0, [], {file_id: str(e) for file_id in file_ids}
+
+    deleted, retry, errors = 0, [], {}
+    throttled = False
+    for file_id in file_ids:
+        error = outcomes.get(file_id)
+        if error is None or http_status(error) == 404:
+            deleted += 1
+        elif is_retryable(error):
+            retry.append(file_id)
+            throttled = throttled or is_quota_error(error)
+        else:
+            errors[file_id] = str(error)
+    if throttled and limiter is not None:
+        # Once per batch: the calls in it were throttled together.
+        limiter.buckets['drive_delete'].throttle()
+    return deleted, retry, errors
+
+
+def delete_files(service_factory, file_ids, limiter=None, workers=DEFAULT_SWEEP_WORKERS,
+                 batch_size=BATCH_LIMIT, max_retries=None, on_progress=None):
+    """Delete ``file_ids`` in concurrent batch requests; returns ``(deleted, errors)``.
+
+    ``service_factory()`` returns a Drive client for the calling thread
+    (clients are not thread-safe). Failed calls are retried with backoff
+    up to ``max_retries`` rounds. ``on_progress(deleted, total)`` is called
+    after every batch.
+    """
+    pending = list(dict.fromkeys(file_ids))
+    total = len(pending)
+    max_retries = max_retries_from_env() if max_retries is None else max_retries
+    batch_size = max(1, min(batch_size, BATCH_LIMIT))
+    deleted, errors = 0, {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            pending = []
+            # Results come back in the calling thread, so on_progress may
+            # touch UI state.
+            for done, retry, failed in pool.map(lambda ids: delete_batch(service_factory(), ids, limiter), batches):
+                deleted += done
+                pending.extend(retry)
+                errors.update(failed)
+                if on_progress is not None:
+                    on_progress(deleted, total)
+    for file_id in pending:
+        errors[file_id] = "Masih gagal setelah retry."
+    return deleted, errors
+
+
+def sweep(service, service_factory=None, tagged_only=True, dry_run=False, on_progress=None):
+    """Delete every temporary file (see list_temp_files); returns ``(count, errors)``.
+
+    With ``dry_run`` nothing is deleted and ``count`` is the number of
+    files that would be.
+    """
+    files = list(list_temp_files(service, tagged_only))
+    if dry_run:
+        return len(files), []
+    deleted, errors = delete_files(service_factory or (lambda: service), [f['id'] for f in files],
+                                   workers=DEFAULT_SWEEP_WORKERS if service_factory else 1,
+                                   on_progress=on_progress)
+    names = {f['id']: f.get('name') for f in files}
+    return deleted, [f"Gagal hapus {names.get(file_id)}: {message}" for file_id, message in errors.items()]
+
+
+# --- Deferred Deletes ---
+class DeferredDeleter:
+    """Collects one Google account's temp-copy deletes and sends them in batches.
+
+    ``add`` returns at once; a background thread sends a batch when
+    BATCH_LIMIT IDs are waiting or the oldest has waited ``interval``
+    seconds. ``close`` sends what is left and waits for every batch. An
+    ``on_deleted`` callback runs (on a pool thread) once its file is gone.
+    """
+
+    def __init__(self, account, interval=DEFER_INTERVAL, workers=2):
+        self.account = account
+        self.interval = interval
+        self.deleted = 0
+        self.errors = {}
+        self._pending = []
+        self._callbacks = {}
+        self._since = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, file_id, on_deleted=None):
+        with self._lock:
+            if on_deleted is not None:
+                self._callbacks.setdefault(file_id, []).append(on_deleted)
+            if not self._pending:
+                self._since = time.monotonic()
+            self._pending.append(file_id)
+            if len(self._pending) >= BATCH_LIMIT:
+                self._wake.notify()
+
+    def _take(self):
+        ids, self._pending = self._pending[:BATCH_LIMIT], self._pending[BATCH_LIMIT:]
+        self._since = time.monotonic() if self._pending else None
+        return ids
+
+    def _send(self, ids):
+        try:
+            deleted, errors = delete_files(self.account.drive, ids, limiter=self.account.limiter, workers=1)
+        except Exception as e:
+            deleted, errors = 0, {file_id: str(e) for file_id in ids}
+        with self._lock:
+            self.deleted += deleted
+            self.errors.update(errors)
+            callbacks = [callback for file_id in ids if file_id not in errors
+                         for callback in self._callbacks.pop(file_id, [])]
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def _loop(self):
+        with self._lock:
+            while not self._closed:
+                due = self._since is not None and time.monotonic() - self._since >= self.interval
+                if len(self._pending) >= BATCH_LIMIT or due:
+                    self._pool.submit(self._send, self._take())
+                    continue
+                timeout = self.interval if self._since is None else self._since + self.interval - time.monotonic()
+                self._wake.wait(max(0.01, timeout))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+        while self._pending:
+            self._pool.submit(self._send, self._take())
+        self._pool.shutdown(wait=True)
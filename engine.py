@@ -0,0 +1,362 @@
+import itertools
+import json
+import os
+import pickle
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+import drive_cleanup
+import ingest
+import journal
+from accounts import QuotaLedger, sender_accounts_from_env, sender_pool
+from google_clients import SCOPES, build_service, thread_safe_credentials
+from copy_pool import pool_size_from_env
+from pdf_cache import PdfCache
+from pipeline import (CertificateContext, batch_size_from_env, check_template_fields, concurrency_from_env,
+                      dry_run, run_certificates)
+from templating import parse_fields
+
+# Headless certificate engine. Everything a run needs (settings, roster
+# parsing, Google auth, storage housekeeping and the run itself) lives here
+# so the Streamlit page and the send_certificates.py CLI share one code path.
+# Google libraries and the local renderer are imported where they are used
+# to keep startup fast.
+
+
+# --- Validasi Email ---
+is_valid_email = ingest.is_valid_email
+
+# --- Google API Auth ---
+def get_service_account_credentials(service_account_info):
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_info(service_account_info, scopes=SCOPES)
+
+def google_services(creds):
+    drive_service = build_service('drive', 'v3', creds)
+    slides_service = build_service('slides', 'v1', creds)
+    return drive_service, slides_service
+
+def authenticate_google(service_account_info):
+    return google_services(get_service_account_credentials(service_account_info))
+
+# --- Google OAuth User Auth ---
+class LoginRequired(RuntimeError):
+    """The saved OAuth token is unusable and no browser login is possible here."""
+
+
+def get_oauth_credentials(client_config, interactive=True):
+    """Credentials from token.pickle, refreshed if needed.
+
+    Without a usable token, ``interactive`` opens the browser login;
+    otherwise (background workers, which no browser can reach) it raises
+    LoginRequired.
+    """
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    creds = None
+    # The file token.pickle stores the user's access and refresh tokens, and is
+    # created automatically when the authorization flow completes for the first
+    # time.
+    if os.path.exists('token.pickle'):
+        with open('token.pickle', 'rb') as token:
+            creds = pickle.load(token)
+            
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+            except Exception:
+                creds = None
+                
+        if not creds and not interactive:
+            raise LoginRequired("Login Google (OAuth) kedaluwarsa atau dicabut. Login ulang dari halaman "
+                                "aplikasi (Logout / Reset Token, lalu login), kemudian kirim ulang job.")
+        if not creds:
+            # Create a temporary file for client_secret if it's passed as dict
+            # But here we expect client_config to be the dict from json.load
+            # Flow.from_client_config is cleaner than saving to file
+            flow = InstalledAppFlow.from_client_config(
+                client_config, SCOPES)
+            creds = flow.run_local_server(port=0)
+            
+        # Save the credentials for the next run
+        with open('token.pickle', 'wb') as token:
+            pickle.dump(creds, token)
+
+    return creds
+
+def authenticate_user_oauth(client_config):
+    return google_services(get_oauth_credentials(client_config))
+
+# --- Clear Token Function ---
+def clear_token():
+    if os.path.exists('token.pickle'):
+        os.remove('token.pickle')
+        return True
+    return False
+
+# --- Storage Management ---
+def check_storage_quota(service):
+    try:
+        about = service.about().get(fields="storageQuota").execute()
+        quota = about.get('storageQuota', {})
+        usage = int(quota.get('usage', 0))
+        limit_str = quota.get('limit')
+        limit = int(limit_str) if limit_str else -1
+        
+        usage_mb = usage / (1024 * 1024)
+        limit_mb = limit / (1024 * 1024) if limit != -1 else -1
+        return usage_mb, limit_mb
+    except Exception as e:
+        return 0, 0
+
+def thread_drive_factory(creds):
+    """Callable returning a Drive client per calling thread, for parallel sweeps."""
+    local = threading.local()
+
+    def factory():
+        if not hasattr(local, 'drive'):
+            local.drive = build_service('drive', 'v3', creds)
+        return local.drive
+
+    return factory
+
+def count_temp_files(service, tagged_only=True):
+    """Dry run of cleanup_service_account_files: how many files it would delete."""
+    try:
+        return drive_cleanup.sweep(service, tagged_only=tagged_only, dry_run=True)[0], []
+    except Exception as e:
+        return 0, [str(e)]
+
+def cleanup_service_account_files(service, creds=None, tagged_only=True, on_progress=None):
+    """Delete the temporary copies this tool left in the account's Drive.
+
+    Only files tagged by this tool unless ``tagged_only`` is False (then
+    every file owned by the account, as older versions did). With ``creds``
+    the deletes run as several concurrent batch requests.
+    """
+    try:
+        deleted_count, errors = drive_cleanup.sweep(
+            service, thread_drive_factory(creds) if creds is not None else None,
+            tagged_only=tagged_only, on_progress=on_progress
+        )
+    except Exception as e:
+        return 0, [str(e)]
+
+    # Also empty headers trash if possible (not always necessary if we delete permanently)
+    try:
+         service.files().emptyTrash().execute()
+    except:
+         pass
+
+    return deleted_count, errors
+
+# --- Load Email Body ---
+EMAIL_BODY_FILES = ("email_body.html", "email_body.txt")
+
+def load_email_body():
+    """The email body template; email_body.html (sent as HTML) wins over email_body.txt."""
+    for path in EMAIL_BODY_FILES:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            continue
+    return None
+
+# --- Settings ---
+def load_settings():
+    """Read the run settings from .env and email_body.html/.txt."""
+    load_dotenv()
+    return {
+        'email_sender': os.getenv("EMAIL_SENDER"),
+        'email_password': os.getenv("EMAIL_PASSWORD"),
+        'email_subject': os.getenv("EMAIL_SUBJECT"),
+        'target_folder_id': os.getenv("TARGET_FOLDER_ID"),
+        'email_body_template': load_email_body(),
+        # Fixed template fields, e.g. TEMPLATE_FIELDS="acara=Seminar Nasional;tanggal=1 Mei 2026".
+        'fields': parse_fields(os.getenv("TEMPLATE_FIELDS")),
+        'render_mode': os.getenv("RENDER_MODE", "google"),
+        'batch_size': batch_size_from_env(),
+        'copy_pool_size': pool_size_from_env(),
+        'concurrency': concurrency_from_env(),
+        'metrics_path': os.getenv("METRICS_PATH"),
+        'sender_accounts': sender_accounts_from_env(os.getenv("EMAIL_SENDER"), os.getenv("EMAIL_PASSWORD")),
+        'credential_files': [path.strip() for path in (os.getenv("GOOGLE_CREDENTIAL_FILES") or "").split(",")
+                             if path.strip()],
+    }
+
+def job_fields(fields=None, settings=None):
+    """The fixed fields of a run: TEMPLATE_FIELDS overridden by the job's own ``fields``."""
+    settings = settings or load_settings()
+    return dict(settings['fields'], **(fields or {}))
+
+def missing_settings(settings):
+    missing_config = []
+    if not settings['email_sender']: missing_config.append("EMAIL_SENDER di .env")
+    if not settings['email_password']: missing_config.append("EMAIL_PASSWORD di .env")
+    if not settings['email_subject']: missing_config.append("EMAIL_SUBJECT di .env")
+    if not settings['email_body_template']: missing_config.append("File email_body.txt atau email_body.html")
+    return missing_config
+
+# --- Data Peserta ---
+def parse_participants(raw_participants, stats=None):
+    """Parse pasted ``Nama, email`` lines into a list of valid, unique participants."""
+    return list(ingest.stream_participants(ingest.read_chunks(raw_participants.strip()), stats))
+
+def open_participants(source, filename, stats=None):
+    """Stream participants from an uploaded or local CSV/TXT/XLSX roster.
+
+    Returns a generator that parses lazily (the run plans the whole
+    roster before sending, see planning.py).
+    """
+    return ingest.stream_participants(ingest.read_chunks(source, filename), stats)
+
+# --- Credentials ---
+def load_credentials(auth_type, credential_info=None, interactive=True):
+    """Credentials for ``auth_type`` ("service_account" or "oauth").
+
+    ``credential_info`` is the parsed service_account.json or
+    client_secret.json. OAuth may pass None when token.pickle exists;
+    with ``interactive`` False it never starts a browser login (see
+    get_oauth_credentials). The returned credentials are safe to share
+    between worker threads.
+    """
+    if auth_type == "service_account":
+        return thread_safe_credentials(get_service_account_credentials(credential_info))
+    return thread_safe_credentials(get_oauth_credentials(credential_info, interactive))
+
+def load_credential_files(paths):
+    """Extra service-account credentials from JSON key files (GOOGLE_CREDENTIAL_FILES)."""
+    credentials = []
+    for path in paths:
+        with open(path) as f:
+            credentials.append(load_credentials("service_account", json.load(f)))
+    return credentials
+
+# --- Run ---
+def run_job(credentials, template_id, participants, settings, concurrency=None,
+            batch_size=None, render_mode=None, resume=True, on_notice=None,
+            summary=None, metrics=None):
+    """Send certificates to ``participants``; yield ``(row, log_entry)`` as rows finish.
+
+    ``credentials`` is one Google credential or a list; the service accounts
+    in ``settings['credential_files']`` are added to it, and rows are sharded
+    over all of them and over ``settings['sender_accounts']``.
+
+    ``participants`` may be a list or a lazy generator (see
+    open_participants).
+    Before anything is sent, the placeholders in the template and email are
+    checked against the first participant's columns and
+    ``settings['fields']``; a placeholder without a value raises
+    templating.TemplateFieldError.
+    ``on_notice(level, message)`` receives setup messages such as the local
+    renderer falling back to Google Slides; ``level`` is "info" or "warning".
+    ``summary``, if given, is filled with run totals (the run plan, PDF
+    cache and copy pool hits and misses) once the run ends. ``metrics`` is
+    an optional metrics.RunMetrics the caller can read while the run is
+    going; its summary is written to ``settings['metrics_path']`` at the
+    end when that is set.
+    """
+    notify = on_notice or (lambda level, message: None)
+    if not isinstance(credentials, (list, tuple)):
+        credentials = [credentials]
+    credentials = list(credentials) + load_credential_files(settings.get('credential_files') or [])
+    ctx = CertificateContext(
+        credentials, template_id, settings['target_folder_id'],
+        settings['email_sender'], settings['email_password'],
+        settings['email_subject'], settings['email_body_template']
+    )
+    ctx.fields = dict(settings.get('fields') or {})
+    ctx.journal = journal.JobJournal(run_key=journal.run_key(template_id, ctx.fields))
+    ctx.pdf_cache = PdfCache.from_env()
+    ctx.copy_pool_size = settings.get('copy_pool_size', 0)
+    if settings.get('sender_accounts'):
+        ctx.senders = sender_pool(settings['sender_accounts'], QuotaLedger(ctx.journal.path))
+    if len(ctx.google_accounts) > 1 or len(ctx.senders) > 1:
+        notify("info", f"Memakai {len(ctx.google_accounts)} akun Google dan {len(ctx.senders)} akun pengirim.")
+    if metrics is not None:
+        ctx.metrics = metrics
+    if not resume:
+        ctx.journal.reset()
+
+    try:
+        # The first participant's columns stand for the roster's.
+        participants = iter(participants)
+        first = next(participants, None)
+        if first is not None:
+            participants = itertools.chain([first], participants)
+            unused = check_template_fields(ctx, first)
+            if unused:
+                notify("info", f"Kolom tanpa placeholder di template/email (diabaikan): {', '.join(unused)}")
+
+        local_template = None
+        if (render_mode or settings['render_mode']) == "local":
+            try:
+                import local_render
+
+                local_template = local_render.prepare_template(ctx)
+                notify("info", f"Render lokal aktif ({len(local_template['placements'])} kotak teks dengan placeholder).")
+            except Exception as e:
+                notify("warning", f"Render lokal tidak bisa dipakai, kembali ke Google Slides: {e}")
+
+        yield from run_certificates(
+            ctx, participants,
+            concurrency or settings['concurrency'],
+            batch_size or settings['batch_size'],
+            local_template
+        )
+    finally:
+        try:
+            ctx.journal.close()
+        except sqlite3.Error as e:
+            notify("warning", f"Journal gagal disimpan: {e}. Resume untuk run ini mungkin tidak lengkap.")
+        if ctx.cleanup_errors:
+            notify("warning", f"{len(ctx.cleanup_errors)} file sementara gagal dihapus; "
+                              f"bersihkan lewat Manajemen Penyimpanan. Contoh: {next(iter(ctx.cleanup_errors.values()))}")
+        if ctx.plan and (ctx.plan['merged'] or ctx.plan['shared'] or ctx.plan['emails'] < ctx.plan['rows']):
+            notify("info", f"Rencana: {ctx.plan['rows']} baris → {ctx.plan['emails']} email, "
+                           f"{ctx.plan['renders']} sertifikat dirender ({ctx.plan['merged']} baris digabung, "
+                           f"{ctx.plan['shared']} alamat berbagi PDF).")
+        if summary is not None:
+            if ctx.plan:
+                summary['plan'] = ctx.plan
+            if ctx.pdf_cache is not None:
+                summary.update(ctx.pdf_cache.stats())
+            if ctx.copy_pool_size:
+                summary.update(ctx.copy_pool_stats)
+        if settings.get('metrics_path'):
+            try:
+                ctx.metrics.dump(settings['metrics_path'])
+            except OSError as e:
+                notify("warning", f"Gagal menulis metrics ke {settings['metrics_path']}: {e}")
+
+def plan_run(credentials, template_id, participants, settings, batch_size=None, render_mode=None):
+    """Dry run of run_job: what the run would render and send, without doing it.
+
+    Returns planning.estimate() of the run. With ``credentials`` the
+    template is read (its placeholders are checked as in run_job, and PDF
+    cache hits are counted); with None the plan is made offline from the
+    roster alone.
+    """
+    ctx = CertificateContext(
+        credentials, template_id, settings['target_folder_id'],
+        settings['email_sender'], settings['email_password'],
+        settings['email_subject'], settings['email_body_template']
+    )
+    ctx.fields = dict(settings.get('fields') or {})
+    participants = iter(participants)
+    first = next(participants, None)
+    if first is not None:
+        participants = itertools.chain([first], participants)
+        if credentials is not None:
+            check_template_fields(ctx, first)
+    if credentials is not None:
+        ctx.pdf_cache = PdfCache.from_env()
+    return dry_run(ctx, participants, batch_size or settings['batch_size'],
+                   render_mode or settings['render_mode'], read_template=credentials is not None)
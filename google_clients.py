@@ -0,0 +1,77 @@
+import functools
+import hashlib
+import threading
+
+# Google credential and API client helpers shared by the app, the CLI and
+# the pipeline workers. googleapiclient and google-auth are imported inside
+# the functions so importing this module (and the app) stays cheap.
+
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/presentations'
+]
+
+
+# --- Discovery ---
+@functools.lru_cache(maxsize=None)
+def discovery_document(name, version):
+    """The discovery document bundled with googleapiclient, read once per process."""
+    from googleapiclient.discovery_cache import get_static_doc
+
+    return get_static_doc(name, version)
+
+
+def build_service(name, version, credentials):
+    """Build a ``name``/``version`` client without fetching discovery over HTTP.
+
+    Service objects are not thread-safe; build one per thread.
+    """
+    from googleapiclient.discovery import build, build_from_document
+
+    document = discovery_document(name, version)
+    if document is None:
+        return build(name, version, credentials=credentials, cache_discovery=False, static_discovery=False)
+    return build_from_document(document, credentials=credentials)
+
+
+# --- Credentials ---
+def credential_identity(auth_type, credential_info=None):
+    """Stable cache key for a credential without keeping the secret itself.
+
+    Service accounts are identified by their key ID and private key, OAuth
+    clients by their client ID and secret (or the cached token.pickle when no
+    client file is given). The secret is part of the key so an edited key
+    under the same ID never reuses credentials built from the old one.
+    """
+    info = credential_info or {}
+    if auth_type == "service_account":
+        parts = (info.get('client_email'), info.get('private_key_id'), info.get('private_key'))
+    else:
+        client = info.get('installed') or info.get('web') or {}
+        parts = (client.get('client_id') or "token.pickle", client.get('client_secret'))
+    raw = "|".join(part or "" for part in parts)
+    return f"{auth_type}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def thread_safe_credentials(credentials):
+    """Serialize token refreshes when many worker threads share ``credentials``.
+
+    Without this, every thread that sees an expired token refreshes it at
+    once. A refresh is skipped when another thread already replaced the
+    token while this one waited for the lock.
+    """
+    if getattr(credentials, '_refresh_lock', None) is not None:
+        return credentials
+    lock = threading.Lock()
+    refresh = credentials.refresh
+
+    def locked_refresh(request):
+        stale_token = credentials.token
+        with lock:
+            if credentials.token is not None and credentials.token != stale_token and credentials.valid:
+                return
+            refresh(request)
+
+    credentials._refresh_lock = lock
+    credentials.refresh = locked_refresh
+    return credentials
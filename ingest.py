@@ -0,0 +1,192 @@
+import csv
+import datetime
+import io
+import re
+
+from templating import ROSTER_FIELDS, field_key
+
+# Streaming roster ingestion. CSV/TXT and XLSX rosters are read in chunks
+# through generators, each chunk is validated and de-duplicated with
+# vectorized pandas operations, and valid participants are yielded one by
+# one, so no DataFrame of the whole file is ever held. The run still reads
+# every row before sending, to plan it (see planning.py). pandas is
+# imported on the first chunk, not at import time.
+# Columns besides name and email are kept as template fields, keyed by
+# templating.field_key of their header.
+
+DEFAULT_CHUNK_SIZE = 1000
+
+NAME_COLUMNS = ("nama", "name", "nama lengkap", "full name", "nama peserta")
+EMAIL_COLUMNS = ("email", "e-mail", "alamat email", "email address", "mail")
+
+# Practical RFC 5322 subset: dot-atom local part, dotted domain with a
+# letters-only TLD of at least two characters.
+EMAIL_PATTERN = (
+    r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}"
+)
+_EMAIL_RE = re.compile(EMAIL_PATTERN)
+
+
+def new_stats():
+    return {'read': 0, 'valid': 0, 'invalid': 0, 'duplicate': 0, 'done': False}
+
+
+# --- Validasi Email ---
+def is_valid_email(email):
+    return isinstance(email, str) and _EMAIL_RE.fullmatch(email.strip()) is not None
+
+
+def valid_email_mask(emails):
+    """Vectorized is_valid_email over a Series of strings."""
+    return emails.str.fullmatch(EMAIL_PATTERN, na=False)
+
+
+# --- Reading ---
+def _pick_columns(header):
+    """Return ``(name_index, email_index, extras)`` if ``header`` is a header row.
+
+    ``extras`` lists ``(index, field_key)`` for the other named columns.
+    """
+    normalized = [str(cell or '').strip().lower() for cell in header]
+    name_idx = next((i for i, cell in enumerate(normalized) if cell in NAME_COLUMNS), None)
+    email_idx = next((i for i, cell in enumerate(normalized) if cell in EMAIL_COLUMNS), None)
+    if name_idx is None or email_idx is None:
+        return None
+    extras, keys = [], set(ROSTER_FIELDS)
+    for i, cell in enumerate(header):
+        key = field_key(cell or '')
+        if i not in (name_idx, email_idx) and key and key not in keys:
+            keys.add(key)
+            extras.append((i, key))
+    return name_idx, email_idx, extras
+
+
+def _cell_text(cell):
+    """Spreadsheet cell as text: whole numbers without ``.0``, dates without midnight."""
+    if cell is None:
+        return ''
+    if isinstance(cell, float) and cell.is_integer():
+        return str(int(cell))
+    if isinstance(cell, datetime.datetime) and cell.time() == datetime.time():
+        return cell.date().isoformat()
+    return str(cell)
+
+
+def _split_row(cells, columns):
+    if columns:
+        name_idx, email_idx, extras = columns
+        return tuple(_cell_text(cells[i]) if i < len(cells) else ''
+                     for i in (name_idx, email_idx, *(i for i, _ in extras)))
+    # Headerless "Nama, email": the email is the last field, so an unquoted
+    # comma inside the name (e.g. "Budi, S.Kom, budi@example.com") still works.
+    cells = [str(cell).strip() for cell in cells if cell is not None and str(cell).strip()]
+    if len(cells) < 2:
+        return None
+    return ', '.join(cells[:-1]), cells[-1]
+
+
+def _chunked(rows, chunk_size):
+    import pandas as pd
+
+    columns = None
+    names = list(ROSTER_FIELDS)
+    chunk = []
+    for index, cells in enumerate(rows):
+        if index == 0:
+            columns = _pick_columns(cells)
+            if columns:
+                names += [key for _, key in columns[2]]
+                continue
+        values = _split_row(cells, columns)
+        if values is None:
+            continue
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame(chunk, columns=names)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=names)
+
+
+def _text_stream(source):
+    if isinstance(source, str):
+        return io.StringIO(source)
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+
+
+def read_csv_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield DataFrames of raw ``nama``/``email`` (plus extra columns) from CSV text or a file."""
+    return _chunked(csv.reader(_text_stream(source), skipinitialspace=True), chunk_size)
+
+
+def read_xlsx_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield DataFrames from the first sheet of an XLSX workbook."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield from _chunked(workbook.worksheets[0].iter_rows(values_only=True), chunk_size)
+    finally:
+        workbook.close()
+
+
+def read_chunks(source, filename="", chunk_size=DEFAULT_CHUNK_SIZE):
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        return read_xlsx_chunks(source, chunk_size)
+    return read_csv_chunks(source, chunk_size)
+
+
+# --- Validation ---
+def validate_chunk(df, seen, stats):
+    """Keep rows with a name and a valid email that were not seen before.
+
+    Duplicates are rows with the same email, name and extra columns (case
+    and whitespace ignored); a different name or e.g. session at one address
+    is a separate certificate.
+    """
+    import pandas as pd
+
+    df = df.assign(**{column: df[column].str.strip() for column in df.columns})
+    # "Budi  Santoso" and "Budi Santoso" are the same name.
+    df = df.assign(nama=df['nama'].str.split().str.join(' '))
+    key = df['email'].str.lower() + '|' + df['nama'].str.casefold()
+    for column in sorted(c for c in df.columns if c not in ROSTER_FIELDS):
+        key = key + '|' + df[column].str.split().str.join(' ').str.casefold()
+    valid = valid_email_mask(df['email']) & (df['nama'] != '')
+    # Membership per key keeps this O(chunk); Series.isin would copy the
+    # whole ``seen`` set for every chunk.
+    already_seen = pd.Series([k in seen for k in key], index=key.index, dtype=bool)
+    duplicate = valid & (key.duplicated() | already_seen)
+    keep = valid & ~duplicate
+
+    seen.update(key[keep])
+    stats['read'] += len(df)
+    stats['invalid'] += int((~valid).sum())
+    stats['duplicate'] += int(duplicate.sum())
+    stats['valid'] += int(keep.sum())
+    return df.loc[keep]
+
+
+def stream_participants(chunks, stats=None):
+    """Yield ``{'nama', 'email'}`` dicts from raw chunks, validating as it goes.
+
+    Rosters with extra columns add ``'fields': {key: value}``.
+    """
+    stats = stats if stats is not None else new_stats()
+    seen = set()
+    try:
+        for chunk in chunks:
+            valid = validate_chunk(chunk, seen, stats)
+            extras = [column for column in valid.columns if column not in ROSTER_FIELDS]
+            if not extras:
+                for name, email in zip(valid['nama'], valid['email']):
+                    yield {'nama': name, 'email': email}
+                continue
+            for name, email, *values in zip(valid['nama'], valid['email'], *(valid[c] for c in extras)):
+                yield {'nama': name, 'email': email, 'fields': dict(zip(extras, values))}
+    finally:
+        stats['done'] = True
+
@@ -0,0 +1,547 @@
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import ingest
+import journal
+from pipeline import RESULT_FIELDS
+
+# Local job queue for certificate runs. The Streamlit page (or any other
+# client) submits a job spec to a SQLite queue and returns immediately;
+# separate worker processes claim queued jobs, run them through
+# engine.run_job and write progress, notices and per-row results back to
+# the queue, where the page polls them. Runs therefore survive page
+# reloads and reruns, and several events can run at once, one per worker
+# process.
+#
+# Finished rows are appended to job_results in batches (REPORT_INTERVAL) as
+# they complete; the page pages through them and streams the final report
+# from there, so no run's results are ever held in memory as a whole.
+#
+# Workers heartbeat while they run. A job whose worker stopped
+# heartbeating (crash, killed process) is put back in the queue and picked
+# up again with resume on, so the journal skips rows that were already sent.
+
+DEFAULT_QUEUE_PATH = "jobs.sqlite3"
+DEFAULT_JOBS_DIR = ".jobs"
+DEFAULT_WORKERS = 2
+# Seconds an idle worker waits for new jobs before exiting (0 = never).
+DEFAULT_IDLE_EXIT = 600
+HEARTBEAT_INTERVAL = 5
+# A worker or job silent for this long is considered dead.
+STALE_AFTER = 60
+# Seconds between result/progress writes from a running job.
+REPORT_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    worker INTEGER,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    roster_done INTEGER NOT NULL DEFAULT 0,
+    throughput REAL NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    summary TEXT,
+    run_key TEXT
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    nama TEXT,
+    email TEXT,
+    waktu TEXT,
+    status TEXT,
+    detail TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_notices (
+    job_id INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    started REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    job_id INTEGER,
+    PRIMARY KEY (pid, host)
+);
+"""
+
+_HOST = socket.gethostname()
+
+
+class DuplicateJobError(Exception):
+    """A queued or running job already sends this template with the same fixed fields."""
+
+    def __init__(self, job_id):
+        super().__init__(f"Job #{job_id} dengan template dan field tetap yang sama masih berjalan.")
+        self.job_id = job_id
+
+
+class JobQueue:
+    """SQLite-backed queue of certificate jobs, shared by the page and the workers.
+
+    Every call opens its own short-lived connection, so one instance can be
+    used from several threads and many processes can use the same file.
+    """
+
+    def __init__(self, path=None, jobs_dir=None):
+        self.path = path or os.getenv("JOBS_PATH") or DEFAULT_QUEUE_PATH
+        self.jobs_dir = jobs_dir or os.getenv("JOBS_DIR") or DEFAULT_JOBS_DIR
+        created = not os.path.exists(self.path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Queues created before the duplicate check lack the run_key column.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'run_key' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN run_key TEXT")
+        if created:
+            # Job specs carry credentials until the job finishes.
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # --- Submitting ---
+    def submit(self, spec, title, roster=None, roster_name=None):
+        """Queue a job and return its id.
+
+        ``roster`` (bytes or a binary file) is copied into ``jobs_dir`` so the
+        worker can stream it; its path lands in ``spec['roster_path']``.
+        Raises DuplicateJobError while a queued or running job has the same
+        journal run key: both would work on the same journal rows at once.
+        """
+        spec = dict(spec)
+        if roster is not None:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            path = os.path.join(self.jobs_dir, f"{uuid.uuid4().hex}-{os.path.basename(roster_name or 'peserta.txt')}")
+            with open(path, "wb") as f:
+                if isinstance(roster, bytes):
+                    f.write(roster)
+                else:
+                    roster.seek(0)
+                    shutil.copyfileobj(roster, f)
+            spec['roster_path'] = path
+            spec['roster_name'] = roster_name or os.path.basename(path)
+        key = _run_key(spec)
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                "SELECT id FROM jobs WHERE run_key = ? AND status IN (?, ?) ORDER BY id LIMIT 1",
+                (key, QUEUED, RUNNING),
+            ).fetchone()
+            if active is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (title, status, spec, created, run_key) VALUES (?, ?, ?, ?, ?)",
+                    (title, QUEUED, json.dumps(spec), time.time(), key),
+                ).lastrowid
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if active is not None:
+            if roster is not None:
+                _remove(spec['roster_path'])
+            raise DuplicateJobError(active[0])
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask the worker to stop a running one."""
+        with self._connect() as conn:
+            queued = conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            ).rowcount
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING))
+        if queued:
+            self.finish(job_id, CANCELLED)
+
+    # --- Claiming ---
+    def claim(self, pid):
+        """Take the oldest queued job for worker ``pid``; None when there is none.
+
+        Running jobs whose heartbeat went stale are re-queued first, or
+        finished as cancelled when cancelling them was already asked for.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat < ? AND cancel_requested = 0",
+                (QUEUED, RUNNING, now - STALE_AFTER),
+            )
+            cancelled = [job_id for job_id, in conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND heartbeat < ? AND cancel_requested = 1",
+                (RUNNING, now - STALE_AFTER),
+            )]
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - STALE_AFTER,))
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND cancel_requested = 0 ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, started = COALESCE(started, ?), heartbeat = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, pid, now, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        # Outside the transaction: finish() drops the roster and credentials.
+        for job_id in cancelled:
+            self.finish(job_id, CANCELLED)
+        return self.get(row[0], with_spec=True) if row is not None else None
+
+    # --- Reporting (workers) ---
+    def heartbeat(self, pid, job_id=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO workers (pid, host, started, heartbeat, job_id) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (pid, host) DO UPDATE SET heartbeat = excluded.heartbeat, job_id = excluded.job_id",
+                (pid, _HOST, now, now, job_id),
+            )
+            if job_id is not None:
+                conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?", (now, job_id, pid))
+
+    def unregister(self, pid):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE pid = ? AND host = ?", (pid, _HOST))
+
+    def report(self, job_id, results, total, roster_done, throughput):
+        """Store finished rows (``(idx, log_entry)`` pairs) and the job's progress."""
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_results (job_id, idx, nama, email, waktu, status, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, idx, e['Nama'], e['Email'], e['Waktu'], e['Status'], e['Detail']) for idx, e in results],
+            )
+            conn.execute(
+                "UPDATE jobs SET total = ?, roster_done = ?, throughput = ?, heartbeat = ? WHERE id = ?",
+                (total, int(roster_done), throughput, time.time(), job_id),
+            )
+            return conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 1
+
+    def notice(self, job_id, level, message):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_notices (job_id, level, message, created) VALUES (?, ?, ?, ?)",
+                (job_id, level, message, time.time()),
+            )
+
+    def finish(self, job_id, status, error=None, summary=None):
+        """Mark a job finished, drop its roster copy and the credentials in its spec.
+
+        Every move into FINISHED_STATES goes through here.
+        """
+        job = self.get(job_id, with_spec=True)
+        spec = job['spec'] if job else {}
+        if spec.get('roster_path'):
+            _remove(spec['roster_path'])
+        spec = {key: value for key, value in spec.items() if key not in ('credential_info', 'extra_credentials')}
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ?, summary = ?, spec = ?, worker = NULL "
+                "WHERE id = ?",
+                (status, time.time(), error, json.dumps(summary) if summary is not None else None,
+                 json.dumps(spec), job_id),
+            )
+
+    # --- Reading (page) ---
+    _JOB_COLUMNS = ("id", "title", "status", "created", "started", "finished", "attempts", "total",
+                    "roster_done", "throughput", "cancel_requested", "error", "summary")
+
+    def _select_jobs(self, where="", params=(), with_spec=False):
+        columns = ", ".join(f"j.{c}" for c in self._JOB_COLUMNS) + (", j.spec" if with_spec else "")
+        query = (
+            f"SELECT {columns}, "
+            "(SELECT COUNT(*) FROM job_results r WHERE r.job_id = j.id), "
+            "(SELECT COUNT(*) FROM job_results r WHERE r.job_id = j.id AND r.status NOT LIKE '✅%') "
+            f"FROM jobs j {where}"
+        )
+        names = self._JOB_COLUMNS + (("spec",) if with_spec else ()) + ("done", "failed")
+        with self._connect() as conn:
+            jobs = [dict(zip(names, row)) for row in conn.execute(query, params)]
+        for job in jobs:
+            job['summary'] = json.loads(job['summary']) if job['summary'] else None
+            if with_spec:
+                job['spec'] = json.loads(job['spec'])
+            job['total'] = max(job['total'], job['done'])
+        return jobs
+
+    def get(self, job_id, with_spec=False):
+        jobs = self._select_jobs("WHERE j.id = ?", (job_id,), with_spec)
+        return jobs[0] if jobs else None
+
+    def list(self, limit=20):
+        return self._select_jobs("ORDER BY j.id DESC LIMIT ?", (limit,))
+
+    _RESULT_QUERY = "SELECT idx, nama, email, waktu, status, detail FROM job_results WHERE job_id = ?"
+
+    @staticmethod
+    def _entries(rows):
+        return [
+            (idx, {'Nama': nama, 'Email': email, 'Waktu': waktu, 'Status': status, 'Detail': detail})
+            for idx, nama, email, waktu, status, detail in rows
+        ]
+
+    def recent(self, job_id, limit=20):
+        """The ``limit`` most recently finished rows, newest first, as ``(idx, log_entry)``."""
+        with self._connect() as conn:
+            rows = conn.execute(self._RESULT_QUERY + " ORDER BY rowid DESC LIMIT ?", (job_id, limit)).fetchall()
+        return self._entries(rows)
+
+    def failures(self, job_id, limit=50, offset=0):
+        """One page of failed rows in roster order, as ``(idx, log_entry)``."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                self._RESULT_QUERY + " AND status NOT LIKE '✅%' ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return self._entries(rows)
+
+    def export_csv(self, job_id):
+        """All results of ``job_id`` in roster order as CSV bytes (UTF-8 with BOM).
+
+        Bytes rather than a file object: ``st.download_button`` only takes
+        str, bytes or in-memory buffers, and holds the whole report anyway.
+        """
+        fh = io.BytesIO()
+        text = io.TextIOWrapper(fh, encoding="utf-8-sig", newline="", write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(RESULT_FIELDS)
+        with self._connect() as conn:
+            writer.writerows(conn.execute(
+                "SELECT nama, email, waktu, status, detail FROM job_results WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            ))
+        text.detach()
+        return fh.getvalue()
+
+    def notices(self, job_id):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT level, message FROM job_notices WHERE job_id = ? ORDER BY rowid", (job_id,)
+            ).fetchall()
+
+    def live_workers(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - STALE_AFTER,)
+            ).fetchone()[0]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _run_key(spec):
+    """The journal run key the worker will use for ``spec``."""
+    from engine import job_fields
+
+    return journal.run_key(spec['template_id'], job_fields(spec.get('fields')))
+
+
+# --- Worker ---
+def _run(queue, job):
+    """Run one claimed job to completion, reporting into ``queue``."""
+    from engine import job_fields, load_credentials, load_settings, open_participants, run_job
+    from metrics import RunMetrics
+
+    job_id, spec = job['id'], job['spec']
+    settings = load_settings()
+    settings['fields'] = job_fields(spec.get('fields'), settings)
+    notify = lambda level, message: queue.notice(job_id, level, message)  # noqa: E731
+    if job['attempts'] > 1:
+        notify("info", "Worker sebelumnya berhenti; job dilanjutkan dari journal.")
+
+    # No browser reaches a worker: an expired OAuth login fails the job
+    # (engine.LoginRequired) instead of waiting for one forever.
+    creds = [load_credentials(spec['auth_type'], spec.get('credential_info'), interactive=False)]
+    creds += [load_credentials("service_account", info) for info in spec.get('extra_credentials') or []]
+    roster_stats = ingest.new_stats()
+    run_summary = {}
+    run_metrics = RunMetrics()
+    pending = []
+    reported = [0]
+    status = DONE
+    with open(spec['roster_path'], "rb") as roster:
+        participants = open_participants(roster, spec['roster_name'], roster_stats)
+        run = run_job(
+            creds, spec['template_id'], participants, settings,
+            concurrency=spec.get('concurrency'), batch_size=spec.get('batch_size'),
+            render_mode=spec.get('render_mode'),
+            # A retried job must never reset the journal of its first attempt.
+            resume=spec.get('resume', True) or job['attempts'] > 1,
+            on_notice=notify, summary=run_summary, metrics=run_metrics,
+        )
+
+        def flush():
+            """Write pending rows; True when the page asked to cancel."""
+            reported[0] += len(pending)
+            cancelled = queue.report(job_id, pending, max(roster_stats['valid'], reported[0]),
+                                     roster_stats['done'], run_metrics.throughput())
+            pending.clear()
+            return cancelled
+
+        last_report = time.monotonic()
+        try:
+            for row, log_entry in run:
+                pending.append((row['idx'], log_entry))
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    if flush():
+                        status = CANCELLED
+                        break
+        finally:
+            run.close()
+            flush()
+
+    if roster_stats['invalid'] or roster_stats['duplicate']:
+        notify("warning", f"Dilewati saat membaca data: {roster_stats['invalid']} baris tidak valid, "
+                          f"{roster_stats['duplicate']} duplikat.")
+    summary = dict(run_summary, roster=roster_stats, metrics=run_metrics.summary(),
+                   prometheus=run_metrics.to_prometheus())
+    queue.finish(job_id, status, summary=summary)
+
+
+def work(queue, idle_exit=DEFAULT_IDLE_EXIT, poll_interval=1.0):
+    """Worker loop: claim and run jobs until idle for ``idle_exit`` seconds."""
+    pid = os.getpid()
+    current = {'job': None}
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                queue.heartbeat(pid, current['job'])
+            except sqlite3.Error:
+                pass
+
+    queue.heartbeat(pid)
+    threading.Thread(target=beat, daemon=True).start()
+    idle_since = time.monotonic()
+    try:
+        while True:
+            job = queue.claim(pid)
+            if job is None:
+                if idle_exit and time.monotonic() - idle_since > idle_exit:
+                    return
+                time.sleep(poll_interval)
+                continue
+            current['job'] = job['id']
+            queue.heartbeat(pid, job['id'])
+            try:
+                _run(queue, job)
+            except Exception as e:
+                queue.notice(job['id'], "warning", f"Job gagal: {e}")
+                queue.finish(job['id'], FAILED, error=str(e))
+            current['job'] = None
+            queue.heartbeat(pid)
+            idle_since = time.monotonic()
+    finally:
+        stop.set()
+        queue.unregister(pid)
+
+
+def workers_from_env():
+    try:
+        return max(1, int(os.getenv("JOB_WORKERS") or DEFAULT_WORKERS))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+
+def ensure_workers(queue, count=None):
+    """Start worker processes until ``count`` are alive; returns how many were started.
+
+    Workers run in their own session, so they keep going when the page or
+    the Streamlit server that started them goes away.
+    """
+    count = count or workers_from_env()
+    missing = count - queue.live_workers()
+    for _ in range(max(0, missing)):
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker", "--queue", queue.path, "--jobs-dir", queue.jobs_dir],
+            cwd=os.getcwd(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        # Register right away so a quick rerun does not start another one.
+        queue.heartbeat(process.pid)
+    return max(0, missing)
+
+
+# --- CLI ---
+def build_parser():
+    parser = argparse.ArgumentParser(description="Worker & antrian job pengiriman sertifikat.")
+    parser.add_argument("command", choices=("worker", "list"), help="worker: jalankan worker; list: tampilkan job.")
+    parser.add_argument("--queue", help=f"File antrian SQLite (default JOBS_PATH atau {DEFAULT_QUEUE_PATH}).")
+    parser.add_argument("--jobs-dir", help=f"Folder salinan data peserta (default JOBS_DIR atau {DEFAULT_JOBS_DIR}).")
+    parser.add_argument("--idle-exit", type=float,
+                        help=f"Berhenti setelah idle sekian detik (default JOB_WORKER_IDLE_SECONDS atau "
+                             f"{DEFAULT_IDLE_EXIT}; 0 = tidak pernah).")
+    return parser
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    queue = JobQueue(args.queue, args.jobs_dir)
+    if args.command == "list":
+        for job in queue.list():
+            print(f"#{job['id']:<4} {job['status']:<10} {job['done']:>6}/{job['total']:<6} "
+                  f"gagal {job['failed']:<5} {job['title']}")
+        return 0
+    idle_exit = args.idle_exit
+    if idle_exit is None:
+        idle_exit = float(os.getenv("JOB_WORKER_IDLE_SECONDS") or DEFAULT_IDLE_EXIT)
+    work(queue, idle_exit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import SKIPPED
+from templating import normalize_value
+
+# Durable per-row progress for a run. Every stage transition of a
+# participant is appended to a SQLite journal so a restarted run can skip
+# rows that were already sent and resume rows that were in flight.
+#
+# Writes go through one background thread that commits them in batches.
+# Callers that need durability (around the SMTP send) wait for the batch
+# holding their record to commit, so many workers share one commit. A
+# failed commit (a lock held too long by another worker process, a full
+# disk) is raised to the callers waiting on it instead of killing the
+# writer.
+
+DEFAULT_JOURNAL_PATH = "journal.sqlite3"
+# Seconds a connection waits for another process's write lock.
+LOCK_TIMEOUT = 30.0
+
+# Row states in the order a participant moves through them.
+STATES = ("copied", "rendered", "exported", "sending", "sent", "cleaned")
+STAGE_STATES = {
+    "copy": "copied",
+    "replace": "rendered",
+    "render": "rendered",
+    "export": "exported",
+    "cleanup": "cleaned",
+}
+DONE_STATES = ("sent", "cleaned")
+
+# Where a per-row job picks up again when its copy survived the last run.
+# Exported PDFs are not persisted, so an exported row is exported again.
+RESUME_STAGE = {
+    "copied": "replace",
+    "rendered": "export",
+    "exported": "export",
+    "sent": "cleanup",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    run_key TEXT NOT NULL,
+    row_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    copy_id TEXT,
+    status TEXT,
+    detail TEXT,
+    updated REAL NOT NULL,
+    account TEXT,
+    PRIMARY KEY (run_key, row_key)
+)
+"""
+
+
+def run_key(template_id, fields=None):
+    """Identify a run by its template and fixed fields so a rerun finds its journal.
+
+    The roster is left out on purpose: rows are journaled per recipient
+    (row_key), so an edited or extended roster still skips everyone who
+    already got their certificate.
+    """
+    digest = hashlib.sha1(template_id.encode("utf-8"))
+    if fields:
+        digest.update(json.dumps(fields, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Commit:
+    """A caller waiting for the batch that holds its write."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._error = None
+
+    def set(self, error=None):
+        self._error = error
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+
+
+def row_key(row):
+    """Identify a participant by email, name and extra roster fields (normalized).
+
+    The same person in two sessions is two rows, each with its own state.
+    Case and spacing are ignored, as in the roster's duplicate check.
+    """
+    key = f"{row['email'].strip().lower()}|{normalize_value(row['nama'])}"
+    if row.get('fields'):
+        fields = {name: normalize_value(value) for name, value in row['fields'].items()}
+        key += "|" + json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return key
+
+
+class JobJournal:
+    def __init__(self, path=None, run_key="default", flush_interval=0.05, max_batch=500):
+        self.path = path or os.getenv("JOURNAL_PATH") or DEFAULT_JOURNAL_PATH
+        self.run_key = run_key
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._closed = False
+        # Set when a batch without waiters failed; raised by the next flush.
+        self._failed = None
+        # Set when the writer thread stopped for good.
+        self._dead = None
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            # Journals written before account pools lack the account column.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(journal)")}
+            if 'account' not in columns:
+                conn.execute("ALTER TABLE journal ADD COLUMN account TEXT")
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+
+    # --- Reading ---
+    def load(self):
+        """Return ``{row_key: {state, copy_id, account, status, detail}}`` for this run."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT row_key, state, copy_id, account, status, detail FROM journal WHERE run_key = ?",
+                (self.run_key,),
+            )
+            return {
+                key: {'state': state, 'copy_id': copy_id, 'account': account, 'status': status, 'detail': detail}
+                for key, state, copy_id, account, status, detail in cursor
+            }
+
+    def reset(self):
+        self.flush()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM journal WHERE run_key = ?", (self.run_key,))
+
+    # --- Writing ---
+    def record(self, row, state, copy_id=None, durable=False, account=None):
+        """Queue a state change for ``row``; block until committed if ``durable``.
+
+        ``account`` names the Google account that owns the copy; a record
+        without copy or account keeps the ones journaled before. A durable
+        write raises the sqlite3 error if its commit failed.
+        """
+        if self._dead is not None:
+            raise self._dead
+        log_entry = row['log']
+        item = (
+            self.run_key, row_key(row), state, copy_id or row.get('copy_id'),
+            log_entry.get('Status'), log_entry.get('Detail'), time.time(),
+            account or row.get('google_account'),
+        )
+        done = _Commit() if durable else None
+        self._put((item, done))
+        if done is not None:
+            done.wait()
+
+    def _put(self, entry):
+        self._queue.put(entry)
+        if self._dead is not None:
+            # The writer may have drained the queue before this put.
+            self._stop(self._dead)
+
+    def flush(self):
+        """Wait until every queued write is committed; raises if one failed."""
+        if self._dead is not None:
+            raise self._dead
+        done = _Commit()
+        self._put((None, done))
+        try:
+            done.wait()
+        finally:
+            # Raised at most once, even when it also reached this flush.
+            failed, self._failed = self._failed, None
+        if failed is not None:
+            raise failed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    def _write_loop(self):
+        try:
+            conn = self._connect()
+            conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            self._stop(e)
+            return
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    return
+                batch = [first]
+                deadline = time.monotonic() + self.flush_interval
+                # Keep collecting until the batch is full, the interval ran
+                # out, or someone is waiting on a durable write.
+                while len(batch) < self.max_batch and not any(done for _, done in batch):
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(item)
+                # Pick up whatever else is already queued for the same commit.
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(item)
+
+                rows = [item for item, _ in batch if item is not None]
+                error = None
+                try:
+                    self._commit(conn, rows)
+                except sqlite3.Error as e:
+                    error = e
+                    if not any(done for item, done in batch if item is not None):
+                        self._failed = e
+                for _, done in batch:
+                    if done is not None:
+                        done.set(error)
+        except Exception as e:
+            self._stop(e)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, rows):
+        if rows:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO journal (run_key, row_key, state, copy_id, status, detail, updated, account) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (run_key, row_key) DO UPDATE SET "
+                    "state = excluded.state, copy_id = COALESCE(excluded.copy_id, journal.copy_id), "
+                    "status = excluded.status, detail = excluded.detail, updated = excluded.updated, "
+                    "account = COALESCE(excluded.account, journal.account)",
+                    rows,
+                )
+
+    def _stop(self, error):
+        """The writer is gone: fail everyone waiting now and every later write."""
+        self._dead = error
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None and entry[1] is not None:
+                entry[1].set(error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Pipeline Integration ---
+def journaled(stage_index, stage_name, func, journal):
+    """Wrap a stage so its outcome is journaled for every row it touches.
+
+    Per-row jobs resumed from the journal carry ``resume_from``; stages
+    before that index already happened in an earlier run and are skipped.
+    """
+    state = STAGE_STATES.get(stage_name)
+
+    def wrapped(job):
+        if stage_index < job.get('resume_from', 0):
+            return SKIPPED
+        result = func(job)
+        for row in job.get('rows', [job]):
+            if row['log']['Status'].startswith('❌'):
+                if row.get('journal_state') != 'failed':
+                    journal.record(row, 'failed', copy_id=job.get('copy_id'), account=job.get('google_account'))
+                    row['journal_state'] = 'failed'
+            elif state == 'cleaned':
+                # Recorded by pipeline.journal_cleaned once the deferred
+                # delete went through, not when it was queued.
+                continue
+            elif state is not None:
+                journal.record(row, state, copy_id=job.get('copy_id'), account=job.get('google_account'))
+                row['journal_state'] = state
+        return result
+
+    return wrapped
@@ -0,0 +1,264 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.colors import Color
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from drive_cleanup import tag
+from metrics import SKIPPED
+from pipeline import cache_store, certificate_fields, describe_copy_error, download_pdf, stage_send
+from spool import close_quietly, spooled
+from templating import PLACEHOLDER_RE, TextTemplate, text_content
+
+# Offline rendering: the template is copied, blanked and exported from
+# Google once per run. The background PDF and the position/style of every
+# text box holding a {{...}} placeholder are kept, and each participant's
+# text (the box's content with their fields filled in) is stamped onto that
+# background locally across CPU cores, with no per-row API calls.
+
+EMU_PER_PT = 12700
+# Line height as a multiple of the font size for boxes with several lines.
+LINE_SPACING = 1.2
+
+# Slides fonts that are not available locally fall back to Helvetica unless
+# LOCAL_RENDER_FONT_PATH points to a TTF file.
+CUSTOM_FONT_NAME = 'CertificateFont'
+
+
+# --- Template Preparation (Google, once per run) ---
+def _to_pt(dimension):
+    if not dimension:
+        return 0.0
+    magnitude = dimension.get('magnitude', 0)
+    return magnitude / EMU_PER_PT if dimension.get('unit', 'EMU') == 'EMU' else float(magnitude)
+
+
+def _rgb(style):
+    rgb = style.get('foregroundColor', {}).get('opaqueColor', {}).get('rgbColor')
+    if rgb is None:
+        return (0.0, 0.0, 0.0)
+    return (rgb.get('red', 0.0), rgb.get('green', 0.0), rgb.get('blue', 0.0))
+
+
+def find_placements(presentation):
+    """Locate every shape holding a placeholder and capture its box, style and text.
+
+    Positions are returned in points, measured from the slide's top-left
+    corner. Rotation and shear are ignored; placeholders are expected to be
+    plain text boxes. The whole box is re-drawn locally, so its static text
+    keeps the style of the first placeholder in it.
+    """
+    placements = []
+    for page_index, slide in enumerate(presentation.get('slides', [])):
+        for element in slide.get('pageElements', []):
+            text = element.get('shape', {}).get('text')
+            if not text:
+                continue
+            elements = text.get('textElements', [])
+            content = text_content(text)
+            if not PLACEHOLDER_RE.search(content):
+                continue
+
+            style = {}
+            alignment = 'START'
+            for e in elements:
+                if 'paragraphMarker' in e:
+                    alignment = e['paragraphMarker'].get('style', {}).get('alignment', alignment)
+                run = e.get('textRun', {})
+                if '{{' in run.get('content', ''):
+                    style = run.get('style', {})
+                    break
+
+            transform = element.get('transform', {})
+            size = element.get('size', {})
+            unit_scale = 1 / EMU_PER_PT if transform.get('unit', 'EMU') == 'EMU' else 1.0
+            placements.append({
+                'page': page_index,
+                'object_id': element.get('objectId'),
+                # Slides separates lines with newlines and soft breaks (\v).
+                'text': TextTemplate(content.rstrip('\n').replace('\v', '\n')),
+                'x': transform.get('translateX', 0) * unit_scale,
+                'y': transform.get('translateY', 0) * unit_scale,
+                'width': _to_pt(size.get('width')) * transform.get('scaleX', 1),
+                'height': _to_pt(size.get('height')) * transform.get('scaleY', 1),
+                'font_size': _to_pt(style.get('fontSize')) or 24.0,
+                'bold': bool(style.get('bold')),
+                'italic': bool(style.get('italic')),
+                'color': _rgb(style),
+                'align': alignment,
+                'valign': element.get('shape', {}).get('shapeProperties', {}).get('contentAlignment', 'TOP'),
+            })
+    return placements
+
+
+def prepare_template(ctx):
+    """Export a blank background PDF and the placeholder layout from the template.
+
+    Makes one copy of the template, reads the placeholder geometry, empties
+    the boxes holding placeholders, exports the deck and deletes the copy. Raises on any
+    failure so the caller can fall back to the Google-backed pipeline.
+    """
+    body = tag({'name': "Sertifikat - Template Lokal"})
+    if ctx.target_folder_id:
+        body['parents'] = [ctx.target_folder_id]
+    try:
+        copy_id = ctx.drive().files().copy(fileId=ctx.template_id, body=body).execute().get('id')
+    except Exception as copy_error:
+        status, detail = describe_copy_error(ctx.template_id, copy_error)
+        raise RuntimeError(f"{status}: {detail}")
+
+    try:
+        presentation = ctx.slides().presentations().get(presentationId=copy_id).execute()
+        placements = find_placements(presentation)
+        if not placements:
+            raise ValueError("Tidak ada placeholder {{...}} di template.")
+
+        ctx.slides().presentations().batchUpdate(
+            presentationId=copy_id,
+            body={'requests': [
+                {'deleteText': {'objectId': p['object_id'], 'textRange': {'type': 'ALL'}}}
+                for p in placements
+            ]}
+        ).execute()
+        # Read into memory: worker processes receive the template pickled.
+        with download_pdf(ctx.drive(), copy_id) as pdf:
+            background = pdf.read()
+    finally:
+        try:
+            ctx.drive().files().delete(fileId=copy_id).execute()
+        except Exception:
+            pass
+
+    page_size = presentation.get('pageSize', {})
+    return {
+        'background': background,
+        'placements': placements,
+        'slide_width': _to_pt(page_size.get('width')),
+        'font_path': os.getenv("LOCAL_RENDER_FONT_PATH"),
+    }
+
+
+# --- Local Stamping (runs in worker processes) ---
+_template = None
+
+
+def _font_name(placement, font_path):
+    if font_path:
+        return CUSTOM_FONT_NAME
+    if placement['bold'] and placement['italic']:
+        return 'Helvetica-BoldOblique'
+    if placement['bold']:
+        return 'Helvetica-Bold'
+    if placement['italic']:
+        return 'Helvetica-Oblique'
+    return 'Helvetica'
+
+
+def _init_worker(template):
+    global _template
+    _template = template
+    if template.get('font_path'):
+        pdfmetrics.registerFont(TTFont(CUSTOM_FONT_NAME, template['font_path']))
+
+
+def _overlay(page_width, page_height, scale, placements, values, font_path):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+    for p in placements:
+        font = _font_name(p, font_path)
+        x, y = p['x'] * scale, p['y'] * scale
+        width, height = p['width'] * scale, p['height'] * scale
+        size = p['font_size'] * scale
+        lines = p['text'].render(values).split('\n')
+        # Shrink long lines so they stay inside the placeholder box.
+        widest = max(pdfmetrics.stringWidth(line, font, size) for line in lines)
+        if width and widest > width:
+            size *= width / widest
+        block = size * LINE_SPACING * (len(lines) - 1)
+
+        # Slides measures from the top, PDF from the bottom.
+        top = page_height - y
+        if p['valign'] == 'MIDDLE':
+            baseline = top - height / 2 + block / 2 - size * 0.35
+        elif p['valign'] == 'BOTTOM':
+            baseline = top - height + block + size * 0.25
+        else:
+            baseline = top - size
+
+        c.setFont(font, size)
+        c.setFillColor(Color(*p['color']))
+        for line in lines:
+            text_width = pdfmetrics.stringWidth(line, font, size)
+            if p['align'] == 'CENTER':
+                left = x + (width - text_width) / 2
+            elif p['align'] == 'END':
+                left = x + width - text_width
+            else:
+                left = x
+            c.drawString(left, baseline, line)
+            baseline -= size * LINE_SPACING
+    c.save()
+    return PdfReader(buffer).pages[0]
+
+
+def render_certificate(values, template=None):
+    """Stamp one row's field ``values`` onto the background and return the PDF bytes."""
+    template = template or _template
+    reader = PdfReader(io.BytesIO(template['background']))
+    writer = PdfWriter()
+    for index, page in enumerate(reader.pages):
+        placements = [p for p in template['placements'] if p['page'] == index]
+        if placements:
+            page_width = float(page.mediabox.width)
+            page_height = float(page.mediabox.height)
+            scale = page_width / template['slide_width'] if template['slide_width'] else 1.0
+            page.merge_page(_overlay(page_width, page_height, scale, placements, values, template.get('font_path')))
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def workers_from_env():
+    """Render processes (LOCAL_RENDER_WORKERS, default: one per CPU core)."""
+    try:
+        return max(1, int(os.getenv("LOCAL_RENDER_WORKERS") or os.cpu_count() or 1))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def open_executor(template, workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(template,),
+    )
+
+
+# --- Local Stages ---
+def local_stages(ctx, executor):
+    def stage_release(job):
+        # PDFs of a job that failed before sending; nothing to delete remotely.
+        for row in job.get('rows', [job]):
+            close_quietly(row.pop('pdf', None))
+        return SKIPPED
+
+    def stage_render(job):
+        rows = [row for row in job.get('rows', [job]) if not row.get('cached')]
+        if not rows:
+            return SKIPPED
+        # An address's certificates render in parallel.
+        futures = [executor.submit(render_certificate, certificate_fields(row)) for row in rows]
+        for row, future in zip(rows, futures):
+            row['pdf'] = spooled(future.result())
+            cache_store(ctx, row, row['pdf'])
+
+    return [
+        ("render", stage_render, False),
+        ("send", lambda job: stage_send(ctx, job), False),
+        ("cleanup", stage_release, True),
+    ]
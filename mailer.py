@@ -0,0 +1,263 @@
+import base64
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email import policy
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+# --- SMTP Settings ---
+DEFAULT_SMTP_HOST = 'smtp.gmail.com'
+DEFAULT_SMTP_PORT = 587
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def smtp_settings_from_env():
+    """SMTP host/port/session options, overridable from .env."""
+    return {
+        'host': os.getenv("SMTP_HOST") or DEFAULT_SMTP_HOST,
+        'port': int(os.getenv("SMTP_PORT") or DEFAULT_SMTP_PORT),
+        'use_tls': _env_flag("SMTP_STARTTLS", True),
+        'max_messages': int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION") or 100),
+    }
+
+
+# --- Spooled Messages ---
+# Raw bytes per base64 block: a whole number of 76-character lines.
+ENCODE_BLOCK = 57 * 1024
+# Bytes handed to the socket per write while streaming DATA.
+SEND_BLOCK = 64 * 1024
+
+
+class SpooledMessage:
+    """A MIME message rendered into a file and streamed to the server.
+
+    Built by build_spooled_message; neither the PDF nor its base64 form is
+    held in memory as a whole. SMTPPool.send_message accepts it like an
+    email.message.Message.
+    """
+
+    def __init__(self, from_addr, to_addr, fh):
+        self.from_addr = from_addr
+        self.to_addrs = [to_addr]
+        self.file = fh
+
+    def close(self):
+        self.file.close()
+
+
+def _headers(part):
+    """Header block (ending in the blank line) of a part with an empty body."""
+    part.set_payload("")
+    return part.as_bytes()
+
+
+def _body_part(body, html_body):
+    """The text part, or a multipart/alternative of text and HTML."""
+    text = MIMEText(body, 'plain', policy=policy.SMTP)
+    if html_body is None:
+        return text
+    alternative = MIMEMultipart('alternative', policy=policy.SMTP)
+    alternative.attach(text)
+    alternative.attach(MIMEText(html_body, 'html', policy=policy.SMTP))
+    return alternative
+
+
+def build_spooled_message(sender_email, recipient_email, subject, body, attachments, fh, html_body=None):
+    """Write a multipart/mixed message with the body and any number of PDFs into ``fh``.
+
+    ``attachments`` lists ``(file, filename)`` pairs; each file is read
+    from the start in ENCODE_BLOCK pieces. ``fh`` is an empty binary file,
+    e.g. from spool.spooled().
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    root = MIMEBase('multipart', 'mixed', boundary=boundary, policy=policy.SMTP)
+    root['From'] = sender_email
+    root['To'] = recipient_email
+    root['Subject'] = subject
+    fh.write(_headers(root))
+
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+    fh.write(delimiter)
+    fh.write(_body_part(body, html_body).as_bytes())
+
+    for attachment, filename in attachments:
+        part = MIMEBase('application', 'octet-stream', name=filename, policy=policy.SMTP)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part['Content-Disposition'] = f'attachment; filename="{filename}"'
+        fh.write(b"\r\n" + delimiter + _headers(part))
+        attachment.seek(0)
+        for block in iter(lambda: attachment.read(ENCODE_BLOCK), b""):
+            fh.write(base64.encodebytes(block).replace(b"\n", b"\r\n"))
+        attachment.seek(0)
+    fh.write(f"\r\n--{boundary}--\r\n".encode("ascii"))
+    fh.seek(0)
+    return SpooledMessage(sender_email, recipient_email, fh)
+
+
+def send_spooled(server, msg):
+    """MAIL/RCPT/DATA for a SpooledMessage, streaming the body from its file."""
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(msg.from_addr)
+    if code != 250:
+        if code == 421:
+            server.close()
+        raise smtplib.SMTPSenderRefused(code, resp, msg.from_addr)
+    refused = {}
+    for addr in msg.to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(msg.to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = server.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    msg.file.seek(0)
+    pending, size = [], 0
+    for line in msg.file:
+        if line.startswith(b"."):
+            line = b"." + line
+        pending.append(line)
+        size += len(line)
+        if size >= SEND_BLOCK:
+            server.send(b"".join(pending))
+            pending, size = [], 0
+    pending.append(b".\r\n")
+    server.send(b"".join(pending))
+    code, resp = server.getreply()
+    if code != 250:
+        if code == 421:
+            server.close()
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+# --- SMTP Connection Pool ---
+class SMTPPool:
+    """Keeps authenticated SMTP sessions open and reuses them across messages.
+
+    A session is checked with NOOP before reuse when it has been idle for a
+    while, reconnected transparently when the server dropped it, and retired
+    after ``max_messages`` sends so long runs don't trip provider limits on a
+    single connection. ``use_tls=False`` and an empty password allow running
+    against a local SMTP sink.
+    """
+
+    # Errors that mean the session is unusable and a fresh one should be tried.
+    CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+    def __init__(self, sender_email, sender_password, host=DEFAULT_SMTP_HOST, port=DEFAULT_SMTP_PORT,
+                 use_tls=True, size=2, max_messages=100, idle_check_after=30, timeout=60):
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.max_messages = max_messages
+        self.idle_check_after = idle_check_after
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._closed = False
+
+    @classmethod
+    def from_env(cls, sender_email, sender_password, size=2):
+        return cls(sender_email, sender_password, size=size, **smtp_settings_from_env())
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.sender_password:
+            server.login(self.sender_email, self.sender_password)
+        return {'server': server, 'sent': 0, 'last_used': time.monotonic()}
+
+    @staticmethod
+    def _discard(session):
+        try:
+            session['server'].quit()
+        except Exception:
+            try:
+                session['server'].close()
+            except Exception:
+                pass
+
+    def _is_alive(self, session):
+        if time.monotonic() - session['last_used'] < self.idle_check_after:
+            return True
+        try:
+            return session['server'].noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._is_alive(session):
+                return session
+            self._discard(session)
+
+    def _checkin(self, session):
+        session['last_used'] = time.monotonic()
+        if self._closed or session['sent'] >= self.max_messages:
+            self._discard(session)
+        else:
+            self._idle.put(session)
+
+    @staticmethod
+    def _deliver(server, msg):
+        if isinstance(msg, SpooledMessage):
+            send_spooled(server, msg)
+        else:
+            server.send_message(msg)
+
+    def send_message(self, msg):
+        """Send ``msg`` (a Message or SpooledMessage) on a pooled session.
+
+        Reconnects once if the server dropped the session.
+        """
+        with self._slots:
+            session = self._checkout()
+            try:
+                try:
+                    self._deliver(session['server'], msg)
+                except self.CONNECTION_ERRORS:
+                    self._discard(session)
+                    session = self._connect()
+                    self._deliver(session['server'], msg)
+            except Exception:
+                self._discard(session)
+                raise
+            session['sent'] += 1
+            self._checkin(session)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
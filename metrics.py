@@ -0,0 +1,135 @@
+import collections
+import json
+import math
+import os
+import threading
+import time
+
+# Run metrics: how long every stage and every external API call takes, how
+# often jobs were retried and how many bytes were moved. Durations are kept
+# as raw samples (a few floats per row) so the end-of-run summary can report
+# exact p50/p95/p99 per stage, as JSON or Prometheus text.
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Returned by a stage that had nothing to do for a job (cached PDF, resumed
+# row, no copy to delete) so the no-op is not counted as a latency sample.
+SKIPPED = object()
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self._samples = collections.defaultdict(list)
+        self._retries = collections.Counter()
+        self._bytes = collections.Counter()
+        self._rows = collections.Counter()
+        self._lock = threading.Lock()
+
+    # --- Recording ---
+    def observe(self, kind, name, seconds):
+        """Add one duration sample; ``kind`` is "stage" or "api"."""
+        with self._lock:
+            self._samples[(kind, name)].append(seconds)
+
+    def retry(self, stage):
+        with self._lock:
+            self._retries[stage] += 1
+
+    def add_bytes(self, direction, count):
+        with self._lock:
+            self._bytes[direction] += count
+
+    def row_done(self, status):
+        """Count a finished row; ``status`` is "ok", "failed" or "skipped"."""
+        with self._lock:
+            self._rows[status] += 1
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.monotonic()
+
+    # --- Reading ---
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def throughput(self):
+        """Certificates processed per minute so far (skipped rows excluded)."""
+        with self._lock:
+            processed = self._rows['ok'] + self._rows['failed']
+        elapsed = self.elapsed()
+        return processed * 60 / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+            retries = dict(self._retries)
+            transferred = dict(self._bytes)
+            rows = dict(self._rows)
+        histograms = {'stage': {}, 'api': {}}
+        for (kind, name), values in samples.items():
+            histograms.setdefault(kind, {})[name] = {
+                'count': len(values),
+                'sum': round(sum(values), 6),
+                **{f"p{round(q * 100)}": round(percentile(values, q), 6) for q in QUANTILES},
+                'max': round(values[-1], 6),
+            }
+        return {
+            'elapsed_seconds': round(self.elapsed(), 3),
+            'certificates_per_minute': round(self.throughput(), 2),
+            'rows': rows,
+            'stages': histograms['stage'],
+            'api': histograms['api'],
+            'retries': retries,
+            'bytes': transferred,
+        }
+
+    # --- Export ---
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = []
+
+        def histogram(metric, label, values):
+            lines.append(f"# TYPE {metric} summary")
+            for name, stats in sorted(values.items()):
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{label}="{name}",quantile="{q}"}} {stats[f"p{round(q * 100)}"]}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {stats["sum"]}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {stats["count"]}')
+
+        def counter(metric, label, values):
+            lines.append(f"# TYPE {metric} counter")
+            for name, value in sorted(values.items()):
+                lines.append(f'{metric}{{{label}="{name}"}} {value}')
+
+        histogram("certificate_stage_seconds", "stage", summary['stages'])
+        histogram("certificate_api_seconds", "api", summary['api'])
+        counter("certificate_retries_total", "stage", summary['retries'])
+        counter("certificate_bytes_total", "direction", summary['bytes'])
+        counter("certificate_rows_total", "status", summary['rows'])
+        lines.append("# TYPE certificate_run_seconds gauge")
+        lines.append(f"certificate_run_seconds {summary['elapsed_seconds']}")
+        lines.append("# TYPE certificate_throughput_per_minute gauge")
+        lines.append(f"certificate_throughput_per_minute {summary['certificates_per_minute']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write the summary to ``path``: Prometheus text for .prom/.txt, JSON otherwise."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
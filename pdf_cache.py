@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from spool import copy_file, file_size
+
+# On-disk, content-addressed cache of rendered certificate PDFs. The key is
+# a hash of the template ID, the template's Drive revision, the renderer and
+# every substituted field, so any edit to the template or the data produces
+# a new entry and a resend of an unchanged certificate needs no Google API
+# call at all. Entries are evicted by age and, past the size budget, least
+# recently used first (file mtime is bumped on every hit).
+
+DEFAULT_CACHE_DIR = ".pdf_cache"
+DEFAULT_MAX_MB = 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+def cache_key(template_id, revision, fields, renderer="google"):
+    payload = json.dumps([template_id, revision, renderer, fields], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PdfCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024,
+                 max_age=DEFAULT_MAX_AGE_DAYS * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+        self.evict()
+
+    @classmethod
+    def from_env(cls):
+        """Cache configured by PDF_CACHE_*; None when PDF_CACHE is off."""
+        if os.getenv("PDF_CACHE", "on").strip().lower() in ("0", "off", "false", "no"):
+            return None
+        return cls(
+            directory=os.getenv("PDF_CACHE_DIR") or DEFAULT_CACHE_DIR,
+            max_bytes=int(float(os.getenv("PDF_CACHE_MAX_MB") or DEFAULT_MAX_MB) * 1024 * 1024),
+            max_age=float(os.getenv("PDF_CACHE_MAX_AGE_DAYS") or DEFAULT_MAX_AGE_DAYS) * 86400,
+        )
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def contains(self, key):
+        """Whether an entry exists; counts as the hit or miss for ``key``.
+
+        Planning checks every row up front, so this opens nothing; the PDF
+        is opened with get when it is sent.
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def get(self, key):
+        """The cached PDF opened for reading (caller closes it), or None."""
+        try:
+            return open(self._path(key), "rb")
+        except OSError:
+            return None
+
+    def put(self, key, source):
+        """Store the PDF in the binary file ``source`` (rewound afterwards)."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see partial PDFs.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                copy_file(source, f)
+                size = file_size(f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._size += size
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones over budget.
+
+        Trims to 90% of the budget so the next few puts don't rescan.
+        """
+        with self._lock:
+            now = time.time()
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            size = sum(entry_size for _, entry_size, _ in entries)
+            target = self.max_bytes if size <= self.max_bytes else self.max_bytes * 0.9
+            for path, entry_size, mtime in entries:
+                if now - mtime <= self.max_age and size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entry_size
+                except OSError:
+                    pass
+            self._size = size
+
+    def stats(self):
+        with self._lock:
+            return {'cache_hits': self.hits, 'cache_misses': self.misses}
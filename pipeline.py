@@ -0,0 +1,983 @@
+import collections
+import heapq
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+
+import copy_pool
+import journal
+from accounts import AccountExhausted, AccountPool, SenderAccount, google_accounts
+from drive_cleanup import DeferredDeleter, tag
+from mailer import build_spooled_message
+from metrics import SKIPPED, RunMetrics
+from pdf_cache import cache_key
+from rate_limit import RetryLater, backoff_delay, http_status, is_account_limit_error, max_retries_from_env
+from spool import close_quietly, file_size, spooled
+from templating import EmailTemplate, TemplateFieldError, presentation_placeholders
+
+# Stage order for one certificate. Every stage gets its own worker pool and
+# the stages are connected by bounded queues, so a run takes roughly as long
+# as its slowest stage instead of the sum of every round trip.
+STAGES = ("copy", "replace", "export", "send", "cleanup")
+
+DEFAULT_CONCURRENCY = {
+    "copy": 4,
+    "replace": 4,
+    "export": 4,
+    "send": 2,
+    "cleanup": 2,
+}
+
+# Stages that call Google APIs; their worker counts are per Google account.
+GOOGLE_STAGES = ("copy", "replace", "export", "cleanup")
+
+# How many jobs may wait between two stages before upstream workers block.
+DEFAULT_QUEUE_SIZE = 32
+
+# Megabytes fetched per request when exporting a PDF (EXPORT_CHUNK_MB).
+DEFAULT_EXPORT_CHUNK_MB = 4
+
+# --- Configuration ---
+def concurrency_from_env():
+    """Read per-stage worker counts from PIPELINE_<STAGE>_WORKERS."""
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for stage in STAGES:
+        value = os.getenv(f"PIPELINE_{stage.upper()}_WORKERS")
+        if value:
+            try:
+                concurrency[stage] = max(1, int(value))
+            except ValueError:
+                pass
+    return concurrency
+
+
+def batch_size_from_env():
+    """Participants rendered per presentation copy (RENDER_BATCH_SIZE, default 1)."""
+    try:
+        return max(1, int(os.getenv("RENDER_BATCH_SIZE") or 1))
+    except ValueError:
+        return 1
+
+
+def scale_concurrency(concurrency, google_count, sender_count):
+    """Worker counts are per account: multiply each stage by the accounts serving it."""
+    scaled = {}
+    for stage, workers in concurrency.items():
+        if stage == "send":
+            scaled[stage] = workers * sender_count
+        elif stage in GOOGLE_STAGES:
+            scaled[stage] = workers * google_count
+        else:
+            scaled[stage] = workers
+    return scaled
+
+
+# Columns of a result row (log entry), in report order.
+RESULT_FIELDS = ['Nama', 'Email', 'Waktu', 'Status', 'Detail']
+
+
+def new_log_entry(name, email):
+    return {'Nama': name, 'Email': email, 'Waktu': time.strftime("%H:%M:%S"), 'Status': '', 'Detail': ''}
+
+
+def linked_rows(row):
+    """``row``, the rows merged into it, and the rows sharing its PDF (with theirs)."""
+    yield row
+    yield from row.get('merged', [])
+    for recipient in row.get('recipients', []):
+        yield from linked_rows(recipient)
+
+
+def mark_system_error(job, error):
+    """Fail every row of ``job``, including merged and sharing rows, that was not sent yet."""
+    for row in job.get('rows', [job]):
+        for target in linked_rows(row):
+            if target['log']['Status'] != '✅ Berhasil':
+                target['log']['Status'] = '❌ Error System'
+                target['log']['Detail'] = str(error)
+
+
+def job_rows(job):
+    """Every row a finished job reports: its own rows and the rows merged into
+    them or sharing their PDF. A linked row without an outcome of its own was
+    never sent; it takes over its row's failure, never a success."""
+    for row in job.get('rows', [job]):
+        for target in linked_rows(row):
+            if not target['log']['Status']:
+                if row['log']['Status'].startswith('❌'):
+                    target['log']['Status'] = row['log']['Status']
+                    target['log']['Detail'] = row['log']['Detail']
+                else:
+                    target['log']['Status'] = '❌ Error System'
+                    target['log']['Detail'] = "Email tidak terkirim."
+            yield target
+
+
+def describe_copy_error(template_id, copy_error):
+    """Map a failed template copy to the (Status, Detail) shown in the report."""
+    error_msg = str(copy_error)
+    status = http_status(copy_error)
+    if status == 404 or (status is None and "404" in error_msg):
+        return '❌ Template Tidak Ditemukan', (
+            f"File Template ID '{template_id}' tidak ditemukan atau tidak bisa diakses "
+            f"oleh akun yang login saat ini. Pastikan file ada dan Anda memiliki akses."
+        )
+    if status == 403 or (status is None and "403" in error_msg):
+        return '❌ Akses Ditolak', "Akun tidak memiliki izin untuk mengedit/copy template ini."
+    return '❌ Gagal Copy Template', error_msg
+
+
+# --- Generic Staged Pipeline ---
+class StagedPipeline:
+    """Runs jobs through a chain of stages, each on its own thread pool.
+
+    ``stages`` is a list of ``(name, func, always_run)`` tuples. ``func(job)``
+    mutates the job dict in place. Once a job is marked ``failed`` it skips
+    every later stage except those flagged ``always_run`` (cleanup).
+    A stage that raises RetryLater gets the job back after an exponential
+    backoff, up to ``max_retries`` times. Other exceptions are recorded with
+    ``on_error(job, exc)``. Finished jobs are yielded back to the calling
+    thread, which keeps Streamlit calls on the script thread.
+
+    With ``metrics`` (a metrics.RunMetrics) every stage call is timed and
+    retries are counted; per-job durations are kept in ``job['timings']``.
+    Stages that return SKIPPED are not timed.
+    """
+
+    def __init__(self, stages, concurrency=None, queue_size=DEFAULT_QUEUE_SIZE, on_error=None,
+                 max_retries=None, metrics=None):
+        self.stages = stages
+        self.on_error = on_error or mark_system_error
+        self.metrics = metrics
+        self.max_retries = max_retries_from_env() if max_retries is None else max_retries
+        concurrency = concurrency or {}
+        self.workers = [max(1, int(concurrency.get(name, 1))) for name, _, _ in stages]
+        self.queue_size = queue_size
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._retry_cond = threading.Condition()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _schedule_retry(self, index, job, error):
+        attempts = job.setdefault('attempts', {})
+        name = self.stages[index][0]
+        attempts[name] = attempts.get(name, 0) + 1
+        if attempts[name] > self.max_retries:
+            return False
+        with self._lock:
+            self._pending[index] += 1
+        with self._retry_cond:
+            self._retry_seq += 1
+            heapq.heappush(self._retries, (time.monotonic() + backoff_delay(attempts[name]), self._retry_seq, index, job))
+            self._retry_cond.notify()
+        return True
+
+    def _retry_loop(self):
+        while not self._stop.is_set() and not self._done[-1].is_set():
+            with self._retry_cond:
+                if not self._retries:
+                    self._retry_cond.wait(0.1)
+                    continue
+                due = self._retries[0][0] - time.monotonic()
+                if due > 0:
+                    self._retry_cond.wait(min(due, 0.1))
+                    continue
+                _, _, index, job = heapq.heappop(self._retries)
+            self._put(self._queues[index], job)
+            with self._lock:
+                self._pending[index] -= 1
+
+    def _stage_finished(self, index, inbox):
+        with self._lock:
+            return self._done[index].is_set() and self._pending[index] == 0 and inbox.empty()
+
+    def _record(self, name, job, started):
+        elapsed = time.perf_counter() - started
+        self.metrics.observe('stage', name, elapsed)
+        timings = job.setdefault('timings', {})
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+    def _worker(self, index):
+        name, func, always_run = self.stages[index]
+        inbox, outbox = self._queues[index], self._queues[index + 1]
+        try:
+            while not self._stop.is_set():
+                try:
+                    job = inbox.get(timeout=0.1)
+                except queue.Empty:
+                    if self._stage_finished(index, inbox):
+                        break
+                    continue
+
+                if always_run or not job.get('failed'):
+                    started = time.perf_counter()
+                    try:
+                        if func(job) is not SKIPPED and self.metrics is not None:
+                            self._record(name, job, started)
+                    except RetryLater as retry:
+                        if self.metrics is not None:
+                            self._record(name, job, started)
+                            self.metrics.retry(name)
+                        if self._schedule_retry(index, job, retry.error):
+                            continue
+                        job['failed'] = True
+                        self.on_error(job, retry.error)
+                    except Exception as e:
+                        if self.metrics is not None:
+                            self._record(name, job, started)
+                        job['failed'] = True
+                        self.on_error(job, e)
+                if not self._put(outbox, job):
+                    break
+        except BaseException:
+            # Anything that escapes a stage stops the whole run rather than
+            # leaving the other stages waiting forever.
+            self._stop.set()
+            raise
+        finally:
+            # The last worker of a stage tells the next stage it is done.
+            with self._lock:
+                self._remaining[index] -= 1
+                last = self._remaining[index] == 0
+            if last:
+                self._done[index + 1].set()
+
+    def _feed(self, jobs):
+        try:
+            for job in jobs:
+                if not self._put(self._queues[0], job):
+                    return
+        finally:
+            self._done[0].set()
+
+    def run(self, jobs):
+        count = len(self.stages)
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(count + 1)]
+        # _done[i] is set once nothing more can arrive from upstream of stage i.
+        self._done = [threading.Event() for _ in range(count + 1)]
+        self._remaining = list(self.workers)
+        self._pending = [0] * count
+        self._retries = []
+        self._retry_seq = 0
+
+        threads = [
+            threading.Thread(target=self._feed, args=(jobs,), daemon=True),
+            threading.Thread(target=self._retry_loop, daemon=True),
+        ]
+        for index, workers in enumerate(self.workers):
+            for _ in range(workers):
+                threads.append(threading.Thread(target=self._worker, args=(index,), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        outbox = self._queues[-1]
+        try:
+            while not self._stop.is_set():
+                try:
+                    yield outbox.get(timeout=0.1)
+                except queue.Empty:
+                    if self._done[-1].is_set() and outbox.empty():
+                        break
+        finally:
+            # Consumer stopped early (or finished): release blocked workers.
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+
+
+# --- Certificate Stages ---
+class CertificateContext:
+    """Shared settings for one run plus the Google and sender accounts it uses.
+
+    ``credentials`` is one Google credential or a list of them. Rows are
+    spread over the Google accounts (a row keeps its account for every
+    stage, since the copy belongs to it) and over the sender accounts in
+    ``senders``; see accounts.py. ``drive()``, ``slides()`` and ``limiter``
+    belong to the primary account and serve per-run reads of the template.
+    """
+
+    def __init__(self, credentials, template_id, target_folder_id,
+                 email_sender, email_password, email_subject, email_body_template):
+        self.credentials = credentials
+        self.template_id = template_id
+        self.target_folder_id = target_folder_id
+        self.email_sender = email_sender
+        self.email_password = email_password
+        self.email_subject = email_subject
+        self.email_body_template = email_body_template
+        # Subject and body compiled once for the whole run.
+        self.email = EmailTemplate(email_subject, email_body_template)
+        # Fixed template fields shared by every row; roster columns win.
+        self.fields = {}
+        self.google_accounts = AccountPool(google_accounts(credentials))
+        # One sender by default; the engine swaps in the configured pool.
+        # Its SMTP pools are opened by run_certificates for the run.
+        self.senders = AccountPool([SenderAccount(email_sender, email_password, daily_limit=0)])
+        # Optional journal.JobJournal for resumable, exactly-once runs.
+        self.journal = None
+        # Latency, retry and byte counters for this run.
+        self.metrics = RunMetrics()
+        # Optional pdf_cache.PdfCache; ``renderer`` is part of its key.
+        self.pdf_cache = None
+        self.renderer = "google"
+        # Temp copies that could not be deleted: {copy_id: error}.
+        self.cleanup_errors = {}
+        self._deleters = {}
+        # Template copies kept ready per Google account (0 = off); see copy_pool.py.
+        self.copy_pool_size = 0
+        self.copy_pool_stats = {'copy_pool_hits': 0, 'copy_pool_misses': 0}
+        # planning.plan_rows stats of this run, set once the rows are planned.
+        self.plan = None
+        self._copy_pools = {}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def cached(self, key, factory):
+        """Compute a per-run value once, even when several workers ask at once."""
+        with self._cache_lock:
+            if key not in self._cache:
+                self._cache[key] = factory()
+            return self._cache[key]
+
+    @property
+    def limiter(self):
+        return self.google_accounts.primary.limiter
+
+    def drive(self):
+        return self.google_accounts.primary.drive()
+
+    def slides(self):
+        return self.google_accounts.primary.slides()
+
+    def google(self, job):
+        """The Google account that owns ``job``'s copy, assigning one if needed."""
+        name = job.get('google_account')
+        if name is None:
+            account = self.google_accounts.next()
+            job['google_account'] = account.name
+            return account
+        return self.google_accounts.get(name)
+
+    def fail_over(self, job, account, error):
+        """Retire ``account`` after a hard limit and retry ``job`` on another one.
+
+        Returns normally (so the caller reports the error) when no other
+        account is left.
+        """
+        self.google_accounts.exhaust(account)
+        job.pop('google_account', None)
+        if self.google_accounts.available():
+            raise RetryLater(error)
+
+    def defer_delete(self, account, file_id, on_deleted=None):
+        """Queue a temp copy of ``account`` for deletion in a later batch request.
+
+        ``on_deleted()`` is called once the delete went through.
+        """
+        with self._cache_lock:
+            deleter = self._deleters.get(account.name)
+            if deleter is None:
+                deleter = self._deleters[account.name] = DeferredDeleter(account)
+        deleter.add(file_id, on_deleted)
+
+    def close_deleters(self):
+        """Send the remaining deferred deletes and wait for them."""
+        with self._cache_lock:
+            deleters, self._deleters = list(self._deleters.values()), {}
+        for deleter in deleters:
+            deleter.close()
+            self.cleanup_errors.update(deleter.errors)
+
+    def open_copy_pools(self, needed=None):
+        """Start prefetching template copies, first clearing this run's leftovers.
+
+        Pool copies from an earlier, interrupted attempt at the same run are
+        deleted unless the journal has a row using them. ``needed`` is the
+        number of copies the planned run makes; the pools together make no
+        more than that.
+        """
+        if not self.copy_pool_size:
+            return
+        run_id = self.journal.run_key if self.journal else uuid.uuid4().hex
+        in_use = {e['copy_id'] for e in self.journal.load().values() if e['copy_id']} if self.journal else set()
+        body = copy_pool.pool_body(self, run_id)
+        workers = copy_pool.pool_workers_from_env()
+        accounts = self.google_accounts.available()
+        budget = None if needed is None else math.ceil(needed / max(1, len(accounts)))
+        for account in accounts:
+            try:
+                for copy_id in copy_pool.leftover_copies(account.drive(), run_id):
+                    if copy_id not in in_use:
+                        self.defer_delete(account, copy_id)
+            except Exception:
+                pass
+            if budget == 0:
+                continue
+            size = self.copy_pool_size if budget is None else min(self.copy_pool_size, budget)
+            self._copy_pools[account.name] = copy_pool.CopyPool(
+                account, self.template_id, body, size, workers, budget=budget)
+
+    def take_copy(self, account):
+        """A pre-made template copy of ``account``, or None to copy directly."""
+        pool = self._copy_pools.get(account.name)
+        return pool.take() if pool is not None else None
+
+    def close_copy_pools(self):
+        """Stop prefetching; unused copies go to the deferred deleter."""
+        pools, self._copy_pools = self._copy_pools, {}
+        for name, pool in pools.items():
+            for copy_id in pool.close():
+                self.defer_delete(pool.account, copy_id)
+            self.copy_pool_stats['copy_pool_hits'] += pool.hits
+            self.copy_pool_stats['copy_pool_misses'] += pool.misses
+
+    def attach_metrics(self):
+        for account in self.google_accounts.accounts + self.senders.accounts:
+            account.limiter.metrics = self.metrics
+
+
+# --- Template Fields ---
+def certificate_fields(row):
+    """Values substituted into the slides and the email for ``row``."""
+    return dict(row.get('fields') or {}, nama=row['nama'], email=row['email'])
+
+
+def template_placeholders(ctx):
+    """``{placeholder_text: key}`` of the template's slides, read once per run."""
+    def fetch():
+        presentation = ctx.slides().presentations().get(
+            presentationId=ctx.template_id, fields='slides(pageElements)').execute()
+        return presentation_placeholders(presentation)
+
+    return ctx.cached('template_placeholders', fetch)
+
+
+def check_template_fields(ctx, sample):
+    """Make sure every placeholder in the slides and the email has a value.
+
+    ``sample`` is the first participant; its columns stand for the whole
+    roster. Raises TemplateFieldError for placeholders nothing fills and
+    returns the sorted keys of fields that no placeholder uses. A template
+    that cannot be read is left for the copy stage to report per row.
+    """
+    try:
+        slide_keys = set(template_placeholders(ctx).values())
+    except Exception:
+        return []
+    available = set(ctx.fields) | set(sample.get('fields') or {}) | {'nama', 'email'}
+    used = slide_keys | ctx.email.keys
+    missing = used - available
+    if missing:
+        raise TemplateFieldError(
+            "Placeholder tanpa isian: " + ", ".join("{{" + key + "}}" for key in sorted(missing))
+            + ". Tambahkan kolom dengan nama itu di data peserta atau isi di TEMPLATE_FIELDS.")
+    if not slide_keys:
+        raise TemplateFieldError("Template tidak memiliki placeholder {{...}}.")
+    return sorted(available - used - {'email'})
+
+
+def replace_requests(placeholders, values, page_ids=None):
+    """One replaceAllText per placeholder, for a single batchUpdate."""
+    requests = []
+    for text, key in placeholders.items():
+        request = {
+            'containsText': {
+                'text': text,
+                'matchCase': True
+            },
+            'replaceText': values.get(key) or ''
+        }
+        if page_ids is not None:
+            request['pageObjectIds'] = page_ids
+        requests.append({'replaceAllText': request})
+    return requests
+
+
+# --- PDF Cache ---
+
+
+def template_revision(ctx):
+    """Drive revision of the template, read once per run (None if unknown)."""
+    def fetch():
+        try:
+            meta = ctx.drive().files().get(
+                fileId=ctx.template_id, fields='headRevisionId,modifiedTime,version',
+                supportsAllDrives=True).execute()
+        except Exception:
+            return None
+        return meta.get('headRevisionId') or f"{meta.get('version')}:{meta.get('modifiedTime')}"
+
+    return ctx.cached('template_revision', fetch)
+
+
+def cache_lookup(ctx, row):
+    """Mark ``row`` as cached if its PDF is in the cache; returns True on a hit.
+
+    Only the key is kept; open_pdf opens the file when the row is sent.
+    """
+    if ctx.pdf_cache is None:
+        return False
+    revision = template_revision(ctx)
+    if revision is None:
+        return False
+    try:
+        keys = set(template_placeholders(ctx).values())
+    except Exception:
+        return False
+    # Only the fields on the slides change the PDF.
+    fields = {key: value for key, value in certificate_fields(row).items() if key in keys}
+    row['cache_key'] = cache_key(ctx.template_id, revision, fields, ctx.renderer)
+    if not ctx.pdf_cache.contains(row['cache_key']):
+        return False
+    row['cached'] = True
+    return True
+
+
+def open_pdf(ctx, row):
+    """The PDF to attach for ``row``: rendered, or opened from the cache; None if gone."""
+    if row.get('pdf') is None and row.get('cached'):
+        row['pdf'] = ctx.pdf_cache.get(row['cache_key'])
+    return row.get('pdf')
+
+
+def cache_store(ctx, row, pdf):
+    if ctx.pdf_cache is not None and row.get('cache_key'):
+        ctx.pdf_cache.put(row['cache_key'], pdf)
+
+
+# --- Per-row Stages ---
+def stage_copy(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    log_entry = job['log']
+    account = ctx.google(job)
+    pooled = ctx.take_copy(account)
+    if pooled:
+        job['copy_id'] = pooled
+        return
+    body = tag({'name': f"Sertifikat - {job['nama']}"})
+    # Use target folder if specified
+    if ctx.target_folder_id:
+        body['parents'] = [ctx.target_folder_id]
+
+    try:
+        drive_response = account.limiter.call('drive_copy', lambda: account.drive().files().copy(
+            fileId=ctx.template_id, body=body).execute())
+        job['copy_id'] = drive_response.get('id')
+    except RetryLater:
+        raise
+    except Exception as copy_error:
+        if is_account_limit_error(copy_error):
+            ctx.fail_over(job, account, copy_error)
+        log_entry['Status'], log_entry['Detail'] = describe_copy_error(ctx.template_id, copy_error)
+        job['failed'] = True
+
+
+def stage_replace(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    # Every field of the row in one batchUpdate.
+    requests = replace_requests(template_placeholders(ctx), certificate_fields(job))
+    if not requests:
+        return SKIPPED
+    account = ctx.google(job)
+    account.limiter.call('slides_update', lambda: account.slides().presentations().batchUpdate(
+        presentationId=job['copy_id'], body={'requests': requests}).execute())
+
+
+def export_chunk_size():
+    """Bytes per MediaIoBaseDownload request, from EXPORT_CHUNK_MB."""
+    try:
+        megabytes = float(os.getenv("EXPORT_CHUNK_MB") or DEFAULT_EXPORT_CHUNK_MB)
+    except ValueError:
+        megabytes = DEFAULT_EXPORT_CHUNK_MB
+    return max(256 * 1024, int(megabytes * 1024 * 1024))
+
+
+def download_pdf(drive_service, file_id):
+    """Export ``file_id`` as PDF into a spooled file, returned rewound.
+
+    The caller owns the file and closes it once the PDF has been sent.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    request_pdf = drive_service.files().export_media(
+        fileId=file_id, mimeType='application/pdf')
+    fh = spooled()
+    try:
+        downloader = MediaIoBaseDownload(fh, request_pdf, chunksize=export_chunk_size())
+        done = False
+        while done is False:
+            status, done = downloader.next_chunk()
+    except BaseException:
+        fh.close()
+        raise
+    fh.seek(0)
+    return fh
+
+
+def attachment_names(rows):
+    """PDF file names for ``rows``, numbered when a name repeats in one email."""
+    names, seen = [], collections.Counter()
+    for row in rows:
+        base = f"Sertifikat_{row['nama'].replace(' ', '_')}"
+        seen[base] += 1
+        names.append(f"{base}.pdf" if seen[base] == 1 else f"{base}_{seen[base]}.pdf")
+    return names
+
+
+def _record_all(ctx, rows, state):
+    """Journal ``state`` for ``rows``; the last write waits for the commit of all."""
+    for row in rows[:-1]:
+        ctx.journal.record(row, state)
+    ctx.journal.record(rows[-1], state, durable=True)
+
+
+def send_certificates(ctx, rows, pdfs):
+    """Email ``pdfs`` (one per row, all for the same address) in one message.
+
+    The subject and body use the first row's fields. The outcome is
+    recorded in every row's log, and in the logs of rows merged into them.
+    """
+    targets = [target for row in rows for target in [row] + row.get('merged', [])]
+    own = {id(row) for row in rows}
+    subject, personal_body, html_body = ctx.email.render(certificate_fields(rows[0]))
+    try:
+        # Counts against the sender's daily quota until given back below.
+        sender = ctx.senders.reserve()
+    except AccountExhausted as e:
+        sender, sent, msg = None, False, str(e)
+    if sender is not None:
+        if ctx.journal:
+            # Committed before the send: a crash from here on leaves the rows in
+            # 'sending', which a resumed run flags instead of sending again.
+            _record_all(ctx, targets, 'sending')
+        message = build_spooled_message(
+            sender.email, rows[0]['email'], subject, personal_body,
+            list(zip(pdfs, attachment_names(rows))), spooled(), html_body=html_body
+        )
+        try:
+            sender.limiter.call('smtp_send', lambda: sender.pool.send_message(message))
+            sent = True
+        except Exception as e:
+            ctx.senders.release(sender)
+            failover = not isinstance(e, RetryLater) and is_account_limit_error(e)
+            if failover:
+                # Daily cap or rejected login: retire this sender and let
+                # another one take the rows.
+                ctx.senders.exhaust(sender)
+            if isinstance(e, RetryLater) or (failover and ctx.senders.available()):
+                if ctx.journal:
+                    # Transient SMTP errors mean the message was not accepted.
+                    for target in targets:
+                        ctx.journal.record(target, 'exported')
+                if isinstance(e, RetryLater):
+                    raise
+                raise RetryLater(e) from e
+            sent, msg = False, str(e)
+        finally:
+            message.close()
+    for target in targets:
+        if sent:
+            target['log']['Status'] = '✅ Berhasil'
+            if id(target) in own and len(rows) > 1:
+                target['log']['Detail'] = f"{len(rows)} sertifikat dalam satu email."
+            elif id(target) not in own:
+                target['log']['Detail'] = "Digabung dengan baris lain (alamat & sertifikat sama)."
+        else:
+            target['log']['Status'] = '❌ Gagal Email'
+            target['log']['Detail'] = msg
+    if sent:
+        ctx.metrics.add_bytes('send', sum(file_size(pdf) for pdf in pdfs))
+    if ctx.journal:
+        state = 'sent' if sent else 'failed'
+        _record_all(ctx, targets, state)
+        for target in targets:
+            target['journal_state'] = state
+    return sent
+
+
+def _fail_missing_pdf(rows):
+    for row in rows:
+        for target in [row] + row.get('merged', []):
+            target['log']['Status'] = '❌ Error System'
+            target['log']['Detail'] = "PDF di cache terhapus sebelum dikirim; jalankan ulang untuk merender lagi."
+
+
+def send_job(ctx, job):
+    """Send everything ``job`` rendered; True when its own rows all went out.
+
+    Rows for one address go out together in one email; rows sharing a PDF
+    get their own email with it. Rows that already have a status were
+    handled before the job was re-queued for a retry. The PDFs are closed
+    once every email is out; a RetryLater keeps them for the next attempt.
+    """
+    rows = job.get('rows', [job])
+    envelopes = collections.OrderedDict()
+    for row in rows:
+        envelopes.setdefault(row.get('envelope') or row['email'].strip().lower(), []).append(row)
+    sent = True
+    for envelope in envelopes.values():
+        if envelope[0]['log']['Status']:
+            sent = sent and envelope[0]['log']['Status'].startswith('✅')
+            continue
+        pdfs = [open_pdf(ctx, row) for row in envelope]
+        if None in pdfs:
+            _fail_missing_pdf(envelope)
+            sent = False
+            continue
+        sent = send_certificates(ctx, envelope, pdfs) and sent
+    for row in rows:
+        pending = [recipient for recipient in row.get('recipients', []) if not recipient['log']['Status']]
+        if pending and open_pdf(ctx, row) is None:
+            _fail_missing_pdf(pending)
+            continue
+        for recipient in pending:
+            send_certificates(ctx, [recipient], [row['pdf']])
+    for row in rows:
+        close_quietly(row.pop('pdf', None))
+    return sent
+
+
+def stage_export(ctx, job):
+    if job.get('cached'):
+        return SKIPPED
+    account = ctx.google(job)
+    job['pdf'] = account.limiter.call('drive_export', lambda: download_pdf(account.drive(), job['copy_id']))
+    ctx.metrics.add_bytes('export', file_size(job['pdf']))
+    cache_store(ctx, job, job['pdf'])
+
+
+def stage_send(ctx, job):
+    # The PDFs are released as soon as they are sent, while the job waits
+    # for cleanup.
+    if not send_job(ctx, job):
+        job['failed'] = True
+
+
+def journal_cleaned(ctx, job):
+    """Callback for defer_delete: journal ``job``'s sent rows as cleaned.
+
+    Only called once the copy is really deleted, so a crash before that
+    leaves the rows 'sent' and a resumed run deletes the copy again.
+    """
+    if not ctx.journal:
+        return None
+    copy_id, account = job.get('copy_id'), job.get('google_account')
+
+    def cleaned():
+        for row in job.get('rows', [job]):
+            if row.get('journal_state') == 'sent':
+                ctx.journal.record(row, 'cleaned', copy_id=copy_id, account=account)
+                row['journal_state'] = 'cleaned'
+
+    return cleaned
+
+
+def stage_cleanup(ctx, job):
+    # A row that failed before sending may still hold its PDF.
+    close_quietly(job.pop('pdf', None))
+    # Delete temp file - ALWAYS RUN when a copy was made. The delete goes
+    # out later in a batch request so the row does not wait for it.
+    copy_id = job.get('copy_id')
+    if not copy_id:
+        return SKIPPED
+    ctx.defer_delete(ctx.google(job), copy_id, journal_cleaned(ctx, job))
+
+
+def certificate_stages(ctx):
+    """Per-row stages; a job with several certificates for one address is
+    rendered like a batch chunk (one copy, one batchUpdate, one export)."""
+    import batch_render
+
+    def stage(row_stage, chunk_stage):
+        return lambda job: chunk_stage(ctx, job) if 'rows' in job else row_stage(ctx, job)
+
+    return [
+        ("copy", stage(stage_copy, batch_render.stage_copy_chunk), False),
+        ("replace", stage(stage_replace, batch_render.stage_render_chunk), False),
+        ("export", stage(stage_export, batch_render.stage_export_chunk), False),
+        ("send", stage(stage_send, batch_render.stage_send_chunk), False),
+        ("cleanup", stage(stage_cleanup, batch_render.stage_cleanup_chunk), True),
+    ]
+
+
+def _resume_rows(ctx, participants, per_row, skipped):
+    """Build row dicts, applying what the journal knows from earlier runs.
+
+    Rows that were already sent (or whose send was interrupted) go to
+    ``skipped`` instead of the pipeline. In per-row mode an in-flight row
+    keeps its Drive copy and resumes at the next stage; otherwise (and
+    always for a copy shared by several rows) the leftover copy is deleted
+    and the row starts over. A copy can only be reused or deleted through
+    the Google account that made it; entries without an account predate
+    account pools and belong to the primary one. Rows that still need a
+    PDF are checked against the PDF cache; nothing is opened until the row
+    is sent.
+    """
+    previous = ctx.journal.load() if ctx.journal else {}
+    # A copy journaled for several rows rendered a whole unit (several
+    # certificates for one address); its rows can't resume one by one.
+    copy_users = collections.Counter(entry['copy_id'] for entry in previous.values() if entry['copy_id'])
+    stale_copies = set()
+    for idx, p in enumerate(participants):
+        row = {'idx': idx, 'nama': p['nama'], 'email': p['email'], 'log': new_log_entry(p['nama'], p['email'])}
+        if ctx.fields or p.get('fields'):
+            row['fields'] = dict(ctx.fields, **p.get('fields', {}))
+        entry = previous.get(journal.row_key(row))
+        if entry is None:
+            cache_lookup(ctx, row)
+            yield row
+            continue
+
+        state, copy_id = entry['state'], entry['copy_id']
+        owner = ctx.google_accounts.get(entry['account']) if entry['account'] else ctx.google_accounts.primary
+        resumable = (per_row and copy_id and owner is not None and state in journal.RESUME_STAGE
+                     and copy_users[copy_id] == 1)
+        # A failed row's copy may not have been deleted yet either.
+        if (copy_id and owner is not None and not resumable and state != 'cleaned'
+                and copy_id not in stale_copies):
+            stale_copies.add(copy_id)
+            ctx.defer_delete(owner, copy_id)
+
+        if state == 'sending':
+            row['log']['Status'] = '⚠️ Perlu Cek Manual'
+            row['log']['Detail'] = "Run sebelumnya terhenti saat mengirim; email mungkin sudah terkirim."
+            skipped.append(row)
+        elif state in journal.DONE_STATES and not resumable:
+            row['log']['Status'] = entry['status'] or '✅ Berhasil'
+            row['log']['Detail'] = "Sudah terkirim di run sebelumnya (dilewati)."
+            skipped.append(row)
+        elif resumable:
+            row['copy_id'] = copy_id
+            row['google_account'] = owner.name
+            row['resume_from'] = STAGES.index(journal.RESUME_STAGE[state])
+            row['journal_state'] = state
+            if state == 'sent':
+                row['log']['Status'] = entry['status'] or '✅ Berhasil'
+            else:
+                cache_lookup(ctx, row)
+            yield row
+        else:
+            cache_lookup(ctx, row)
+            yield row
+
+
+def plan_units(ctx, rows, read_template=True):
+    """Plan ``rows`` (see planning.plan_rows); the stats land in ``ctx.plan``.
+
+    Without ``read_template`` every field counts as a slide field.
+    """
+    import planning
+
+    slide_keys = None
+    if read_template:
+        try:
+            slide_keys = set(template_placeholders(ctx).values())
+        except Exception:
+            pass
+    units, ctx.plan = planning.plan_rows(rows, slide_keys)
+    return units
+
+
+def dry_run(ctx, participants, batch_size=1, render_mode="google", read_template=True):
+    """Plan ``participants`` without rendering or sending; returns planning.estimate().
+
+    The journal is not consulted, so rows sent in an earlier run count as
+    work. PDF cache hits count when ``ctx.pdf_cache`` is set.
+    """
+    import planning
+
+    if render_mode == "local":
+        ctx.renderer = "local"
+    units = plan_units(ctx, _resume_rows(ctx, participants, False, collections.deque()), read_template)
+    return planning.estimate(units, ctx.plan, render_mode, batch_size)
+
+
+def run_certificates(ctx, participants, concurrency=None, batch_size=1, local_template=None):
+    """Yield ``(row, log_entry)`` for every participant as it finishes.
+
+    The rows are planned first (see planning.py): every address gets one
+    email with each of its distinct certificates, rendered once. With
+    ``local_template`` (from local_render.prepare_template) names are
+    stamped locally without any per-row API call. Otherwise, with
+    ``batch_size`` > 1 participants are rendered in chunks that share one
+    presentation copy and one PDF export (see batch_render.py). When
+    ``ctx.journal`` is set, rows finished in an earlier run are skipped and
+    in-flight rows are resumed. Worker counts in ``concurrency`` are per
+    account and scaled by the size of the Google and sender pools.
+    """
+    # Imported here because these modules build on the helpers above.
+    import batch_render
+    import local_render
+    import planning
+
+    concurrency = concurrency or concurrency_from_env()
+    per_row = local_template is None and batch_size <= 1
+    skipped = collections.deque()
+    if local_template is not None:
+        ctx.renderer = "local"
+    units = plan_units(ctx, _resume_rows(ctx, participants, per_row, skipped))
+
+    executor = None
+    if local_template is not None:
+        jobs = (planning.unit_job(unit) for unit in units)
+        render_workers = local_render.workers_from_env()
+        executor = local_render.open_executor(local_template, render_workers)
+        concurrency = dict(concurrency, render=render_workers)
+        stages = local_render.local_stages(ctx, executor)
+    elif batch_size > 1:
+        jobs = batch_render.chunk_units(units, batch_size)
+        stages = batch_render.chunk_stages(ctx)
+    else:
+        jobs = (planning.unit_job(unit) for unit in units)
+        stages = certificate_stages(ctx)
+
+    if ctx.journal:
+        stages = [
+            (name, journal.journaled(index, name, func, ctx.journal), always_run)
+            for index, (name, func, always_run) in enumerate(stages)
+        ]
+    # One authenticated SMTP session per send worker and sender, reused for
+    # the whole run.
+    ctx.senders.open(size=concurrency.get("send", 1))
+    ctx.attach_metrics()
+    if local_template is None:
+        # Rows resumed mid-pipeline keep the copy they already have.
+        fresh = [unit for unit in units if not unit[0].get('resume_from')]
+        ctx.open_copy_pools(planning.render_jobs(fresh, "google", batch_size))
+    concurrency = scale_concurrency(concurrency, len(ctx.google_accounts), len(ctx.senders))
+    pipeline = StagedPipeline(stages, concurrency, metrics=ctx.metrics)
+    try:
+        for job in pipeline.run(jobs):
+            while skipped:
+                row = skipped.popleft()
+                ctx.metrics.row_done('skipped')
+                yield row, row['log']
+            for row in job_rows(job):
+                ctx.metrics.row_done('ok' if row['log']['Status'].startswith('✅') else 'failed')
+                yield row, row['log']
+        while skipped:
+            row = skipped.popleft()
+            ctx.metrics.row_done('skipped')
+            yield row, row['log']
+    finally:
+        ctx.close_copy_pools()
+        ctx.close_deleters()
+        ctx.metrics.finish()
+        ctx.senders.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if ctx.journal:
+            ctx.journal.flush()
@@ -0,0 +1,152 @@
+import collections
+import math
+
+from drive_cleanup import BATCH_LIMIT
+from pipeline import certificate_fields
+from templating import normalize_value
+
+# Run planning. Before anything is rendered the rows of a run are grouped
+# by recipient (email, case-insensitive) and by certificate: the slide
+# fields of a row, with whitespace and case normalized, decide which
+# certificate it gets. Per address every distinct certificate is rendered
+# once and all of them go out in one email; a repeated line for the same
+# address and certificate (a name variant, a pasted duplicate) is merged
+# into the first. An address that needs a single certificate someone else
+# already gets (e.g. a template without personal fields) shares that PDF
+# instead of rendering its own.
+#
+# Planning reads the whole roster first and keeps every row (a small dict)
+# in memory, so sending starts once the roster is parsed rather than while
+# it is.
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def render_key(fields, keys=None):
+    """What makes two certificates identical: the slide fields, normalized.
+
+    ``keys`` are the fields the slides use; None (template not read) means
+    every field except the email address.
+    """
+    if keys is None:
+        keys = [key for key in fields if key != 'email']
+    return tuple(sorted((key, normalize_value(fields.get(key, ''))) for key in keys))
+
+
+def new_plan_stats():
+    return {'rows': 0, 'emails': 0, 'renders': 0, 'cached': 0, 'merged': 0, 'shared': 0}
+
+
+def plan_rows(rows, slide_keys=None, stats=None):
+    """Group ``rows`` into work units; returns ``(units, stats)``.
+
+    A unit is the list of distinct certificates one address receives in one
+    email. A row merged into another is listed in that row's ``'merged'``,
+    a row sharing another row's PDF in its ``'recipients'``; neither is
+    part of a unit. Rows resumed mid-pipeline from the journal keep their
+    own unit untouched.
+    """
+    stats = stats if stats is not None else new_plan_stats()
+    envelopes = collections.OrderedDict()
+    units = []
+    for row in rows:
+        stats['rows'] += 1
+        row['envelope'] = normalize_email(row['email'])
+        if row.get('resume_from'):
+            units.append([row])
+            continue
+        row['render_key'] = render_key(certificate_fields(row), slide_keys)
+        certificates = envelopes.setdefault(row['envelope'], collections.OrderedDict())
+        first = certificates.get(row['render_key'])
+        if first is not None:
+            row.pop('cached', None)
+            first.setdefault('merged', []).append(row)
+            stats['merged'] += 1
+            continue
+        certificates[row['render_key']] = row
+
+    renderers = {}
+    for certificates in envelopes.values():
+        unit = list(certificates.values())
+        if len(unit) == 1 and not unit[0].get('cached') and unit[0]['render_key'] in renderers:
+            renderers[unit[0]['render_key']].setdefault('recipients', []).append(unit[0])
+            stats['shared'] += 1
+            continue
+        for row in unit:
+            renderers.setdefault(row['render_key'], row)
+        units.append(unit)
+
+    for unit in units:
+        stats['emails'] += 1 + sum(len(row.get('recipients', ())) for row in unit)
+        for row in unit:
+            stats['cached' if row.get('cached') else 'renders'] += 1
+    return units, stats
+
+
+def unit_job(unit):
+    """The pipeline job for one unit: the row itself, or a multi-row job."""
+    if len(unit) == 1:
+        return unit[0]
+    job = {'rows': unit}
+    if all(row.get('cached') for row in unit):
+        job['cached'] = True
+    return job
+
+
+def render_jobs(units, render_mode="google", batch_size=1):
+    """How many template copies (each one copy, batchUpdate and export) the units need."""
+    if render_mode == "local":
+        return 0
+    sizes = [sum(1 for row in unit if not row.get('cached')) for unit in units]
+    if batch_size <= 1:
+        return sum(1 for size in sizes if size)
+    # Same packing as batch_render.chunk_units.
+    jobs, filled = 0, 0
+    for size in sizes:
+        if not size:
+            continue
+        if filled and filled + size > batch_size:
+            jobs, filled = jobs + 1, 0
+        filled += size
+        if filled >= batch_size:
+            jobs, filled = jobs + 1, 0
+    return jobs + (1 if filled else 0)
+
+
+def estimate(units, stats, render_mode="google", batch_size=1):
+    """Expected Google API calls and emails for a planned run (a dry run).
+
+    Counts the first attempt of every call: per template copy one
+    files.copy, one batchUpdate and one export, deletes in batches of
+    BATCH_LIMIT, plus the per-run template reads. The local renderer makes
+    its copy, read, blank, export and delete once.
+    """
+    copies = render_jobs(units, render_mode, batch_size)
+    if render_mode == "local":
+        api_calls = 5 if stats['renders'] else 0
+    else:
+        api_calls = copies * 3 + math.ceil(copies / BATCH_LIMIT)
+    # Template placeholders and revision.
+    api_calls += 2
+    return dict(stats, copies=copies, api_calls=api_calls, render_mode=render_mode, batch_size=batch_size)
+
+
+def describe(plan):
+    """Indonesian summary lines of an estimate() result."""
+    lines = [
+        f"{plan['rows']} baris peserta → {plan['emails']} email.",
+        f"{plan['renders']} sertifikat dirender" + (f", {plan['cached']} diambil dari cache PDF" if plan['cached'] else "")
+        + ".",
+    ]
+    if plan['merged']:
+        lines.append(f"{plan['merged']} baris digabung (alamat & isi sertifikat sama dengan baris lain).")
+    if plan['shared']:
+        lines.append(f"{plan['shared']} alamat memakai PDF yang sama dengan peserta lain (tanpa render ulang).")
+    if plan['render_mode'] == "local":
+        lines.append(f"Render lokal: sekitar {plan['api_calls']} panggilan API Google untuk seluruh run.")
+    else:
+        lines.append(f"{plan['copies']} salinan template, sekitar {plan['api_calls']} panggilan API Google "
+                     f"(tanpa retry).")
+    return lines
@@ -0,0 +1,208 @@
+import os
+import random
+import smtplib
+import threading
+import time
+
+# Central rate limiting for every external call in a run. Each API gets its
+# own token bucket; quota errors halve that bucket's rate and successes
+# slowly bring it back up (AIMD), so a run settles at the highest rate the
+# quotas allow. Transient errors surface as RetryLater so the pipeline can
+# re-queue the job with exponential backoff instead of failing the row.
+
+# name: (env var, default requests per second)
+# Slides allows 60 write requests per minute per user by default.
+DEFAULT_RATES = {
+    "drive_copy": ("RATE_DRIVE_COPY", 10.0),
+    "drive_export": ("RATE_DRIVE_EXPORT", 10.0),
+    "drive_delete": ("RATE_DRIVE_DELETE", 10.0),
+    "slides_update": ("RATE_SLIDES_UPDATE", 1.0),
+    "smtp_send": ("RATE_SMTP_SEND", 5.0),
+}
+
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+
+RETRYABLE_HTTP_STATUS = (429, 500, 502, 503, 504)
+QUOTA_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+# Errors that mean an account is used up for now rather than throttled:
+# full Drive storage or a spent daily API limit.
+ACCOUNT_LIMIT_REASONS = ("storageQuotaExceeded", "dailyLimitExceeded")
+# 421: service not available / try again later, 45x: transient mailbox or
+# local errors. 5xx replies (e.g. Gmail's daily sending limit) are final.
+RETRYABLE_SMTP_CODES = (421, 450, 451, 452, 454)
+# Permanent replies a sending cap may come as; see is_account_limit_error.
+SMTP_ACCOUNT_LIMIT_CODES = (550, 554)
+
+
+class RetryLater(Exception):
+    """A transient failure; the job should be re-queued after a backoff."""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+# --- Error Classification ---
+def http_status(error):
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None) or getattr(error, 'status_code', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_reasons(error):
+    reasons = set()
+    for detail in getattr(error, 'error_details', None) or []:
+        if isinstance(detail, dict) and detail.get('reason'):
+            reasons.add(detail['reason'])
+    text = str(error)
+    reasons.update(reason for reason in QUOTA_REASONS + ACCOUNT_LIMIT_REASONS if reason in text)
+    return reasons
+
+
+def is_quota_error(error):
+    status = http_status(error)
+    if status == 429:
+        return True
+    if status == 403 and _error_reasons(error) & set(QUOTA_REASONS):
+        return True
+    return getattr(error, 'smtp_code', None) == 421
+
+
+def _smtp_text(error):
+    detail = getattr(error, 'smtp_error', None) or str(error)
+    return (detail.decode('utf-8', 'replace') if isinstance(detail, bytes) else str(detail)).lower()
+
+
+def is_account_limit_error(error):
+    """True when the account itself can't go on (quota spent, login refused).
+
+    Covers Drive storage and daily API limits, Gmail's daily sending cap
+    (550 5.4.5, or a "daily ... limit/quota" reply) and rejected SMTP
+    logins; another account may still work. Other 5xx replies, such as
+    552 5.2.3 for an oversized message, fail only the message.
+    """
+    if http_status(error) == 403 and _error_reasons(error) & set(ACCOUNT_LIMIT_REASONS):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if getattr(error, 'smtp_code', None) in SMTP_ACCOUNT_LIMIT_CODES:
+        text = _smtp_text(error)
+        return '5.4.5' in text or ('daily' in text and ('limit' in text or 'quota' in text))
+    return False
+
+
+def is_retryable(error):
+    if isinstance(error, RetryLater):
+        return True
+    if is_quota_error(error):
+        return True
+    if http_status(error) in RETRYABLE_HTTP_STATUS:
+        return True
+    if getattr(error, 'smtp_code', None) in RETRYABLE_SMTP_CODES:
+        return True
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter for the given 1-based attempt."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def max_retries_from_env():
+    try:
+        return max(0, int(os.getenv("RETRY_MAX_ATTEMPTS") or DEFAULT_MAX_RETRIES))
+    except ValueError:
+        return DEFAULT_MAX_RETRIES
+
+
+# --- Token Bucket ---
+class TokenBucket:
+    def __init__(self, rate, burst=None, min_rate=None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min_rate or max(self.max_rate / 100, 0.01)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, cost=1):
+        """Take ``cost`` tokens. A cost above the burst size is taken once a
+        token is available and paid back as debt by later callers."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= cost
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self):
+        """Multiplicative decrease after a quota error."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def recover(self):
+        """Additive increase after a success, up to the configured rate."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    def __init__(self, rates):
+        self.buckets = {name: TokenBucket(rate) for name, rate in rates.items()}
+        # Optional metrics.RunMetrics; gets the duration of every call.
+        self.metrics = None
+
+    @classmethod
+    def from_env(cls):
+        rates = {}
+        for name, (env_var, default) in DEFAULT_RATES.items():
+            try:
+                rates[name] = float(os.getenv(env_var) or default)
+            except ValueError:
+                rates[name] = default
+        return cls(rates)
+
+    def call(self, name, func, cost=1):
+        """Run ``func`` under the ``name`` bucket.
+
+        ``cost`` is the number of API calls ``func`` makes (e.g. the size of
+        a batch request). Quota errors slow the bucket down; retryable errors
+        are raised as RetryLater, everything else is re-raised unchanged.
+        """
+        bucket = self.buckets[name]
+        bucket.acquire(cost)
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.observe('api', name, time.perf_counter() - started)
+            if is_quota_error(e):
+                bucket.throttle()
+            if is_retryable(e):
+                raise RetryLater(e) from e
+            raise
+        if self.metrics is not None:
+            self.metrics.observe('api', name, time.perf_counter() - started)
+        bucket.recover()
+        return result
+
+    def current_rates(self):
+        return {name: bucket.rate for name, bucket in self.buckets.items()}
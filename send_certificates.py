@@ -0,0 +1,159 @@
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from engine import load_credentials, load_settings, missing_settings, open_participants, plan_run, run_job
+from ingest import new_stats
+from metrics import RunMetrics
+from pipeline import RESULT_FIELDS, STAGES
+from planning import describe
+from templating import TemplateFieldError, parse_fields
+
+# Seconds between progress lines on stderr; failures are printed at once.
+PROGRESS_INTERVAL = 1.0
+
+
+def parse_workers(value):
+    """Parse ``copy=4,send=2`` into a per-stage worker dict."""
+    workers = {}
+    for item in value.split(','):
+        stage, _, count = item.partition('=')
+        stage = stage.strip()
+        if stage not in STAGES and stage != 'render':
+            raise argparse.ArgumentTypeError(f"Tahap tidak dikenal: {stage}")
+        workers[stage] = int(count)
+    return workers
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Kirim sertifikat massal tanpa Streamlit. Konfigurasi email diambil dari .env dan email_body.txt/.html."
+    )
+    parser.add_argument("participants",
+                        help="File peserta: CSV/XLSX dengan kolom Nama & Email (kolom lain jadi placeholder), "
+                             "atau satu 'Nama, email' per baris.")
+    parser.add_argument("--template-id", required=True, help="ID Google Slides template.")
+    auth = parser.add_mutually_exclusive_group()
+    auth.add_argument("--service-account", metavar="JSON", help="File service_account.json.")
+    auth.add_argument("--client-secret", metavar="JSON",
+                      help="File client_secret.json untuk OAuth (boleh dikosongkan jika token.pickle sudah ada).")
+    parser.add_argument("--extra-service-account", metavar="JSON", action="append", default=[],
+                        help="Service account tambahan untuk membagi peserta (boleh diulang).")
+    parser.add_argument("--output", "-o", default="-", help="File CSV hasil (default: stdout).")
+    parser.add_argument("--render-mode", choices=("google", "local"), help="Override RENDER_MODE.")
+    parser.add_argument("--batch-size", type=int, help="Override RENDER_BATCH_SIZE.")
+    parser.add_argument("--workers", type=parse_workers, help="Worker per tahap, misal copy=4,send=2.")
+    parser.add_argument("--field", metavar="KUNCI=NILAI", action="append", default=[],
+                        help="Isian tetap untuk placeholder {{KUNCI}} (boleh diulang). Menambah TEMPLATE_FIELDS.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Hanya tampilkan rencana: jumlah render, email, dan panggilan API. Tidak ada yang dikirim.")
+    parser.add_argument("--no-resume", action="store_true", help="Abaikan journal dan mulai dari awal.")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Tulis metrics run ke PATH (.json, atau .prom untuk format Prometheus). Override METRICS_PATH.")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    settings = load_settings()
+    if args.metrics:
+        settings['metrics_path'] = args.metrics
+    settings['fields'] = dict(settings['fields'], **parse_fields("\n".join(args.field)))
+    missing_config = missing_settings(settings)
+    if missing_config:
+        print(f"Konfigurasi belum lengkap: {', '.join(missing_config)}", file=sys.stderr)
+        return 2
+
+    if args.service_account:
+        with open(args.service_account) as f:
+            creds = load_credentials("service_account", json.load(f))
+    else:
+        client_config = None
+        if args.client_secret:
+            with open(args.client_secret) as f:
+                client_config = json.load(f)
+        elif not os.path.exists('token.pickle'):
+            print("Butuh --service-account atau --client-secret (atau token.pickle).", file=sys.stderr)
+            return 2
+        creds = load_credentials("oauth", client_config)
+
+    if args.extra_service_account:
+        settings['credential_files'] = settings['credential_files'] + args.extra_service_account
+
+    # The roster is parsed in chunks; the run plans all of it before sending.
+    roster_stats = new_stats()
+    roster = open(args.participants, "rb")
+    participants = open_participants(roster, args.participants, roster_stats)
+
+    if args.dry_run:
+        try:
+            plan = plan_run(creds, args.template_id, participants, settings,
+                            batch_size=args.batch_size, render_mode=args.render_mode)
+        except TemplateFieldError as e:
+            print(f"Template tidak cocok dengan data peserta: {e}", file=sys.stderr)
+            return 2
+        finally:
+            roster.close()
+        print("\n".join(describe(plan)))
+        if roster_stats['invalid'] or roster_stats['duplicate']:
+            print(f"Dilewati: {roster_stats['invalid']} baris tidak valid, {roster_stats['duplicate']} duplikat.")
+        return 0
+
+    concurrency = dict(settings['concurrency'], **(args.workers or {}))
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    failed = 0
+    run_summary = {}
+    run_metrics = RunMetrics()
+    try:
+        writer = csv.DictWriter(out, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        done_count = 0
+        last_progress = 0.0
+        for done_count, (row, log_entry) in enumerate(run_job(
+            creds, args.template_id, participants, settings,
+            concurrency=concurrency, batch_size=args.batch_size,
+            render_mode=args.render_mode, resume=not args.no_resume,
+            on_notice=lambda level, message: print(f"[{level}] {message}", file=sys.stderr),
+            summary=run_summary, metrics=run_metrics
+        ), start=1):
+            writer.writerow(log_entry)
+            ok = log_entry['Status'].startswith('✅')
+            if not ok:
+                failed += 1
+            # The CSV is flushed and progress shown once per interval, not per row.
+            if not ok or time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                out.flush()
+                total = max(roster_stats['valid'], done_count)
+                print(f"[{done_count}/{total}] {log_entry['Status']} {row['nama']} <{row['email']}> "
+                      f"({run_metrics.throughput():.1f} sertifikat/menit)", file=sys.stderr)
+    except TemplateFieldError as e:
+        print(f"Template tidak cocok dengan data peserta: {e}", file=sys.stderr)
+        return 2
+    finally:
+        roster.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if roster_stats['invalid'] or roster_stats['duplicate']:
+        print(f"Dilewati: {roster_stats['invalid']} baris tidak valid, {roster_stats['duplicate']} duplikat.",
+              file=sys.stderr)
+    for stage, stats in run_metrics.summary()['stages'].items():
+        print(f"  {stage:<8} p50 {stats['p50']:.2f}s  p95 {stats['p95']:.2f}s  p99 {stats['p99']:.2f}s  (n={stats['count']})",
+              file=sys.stderr)
+    if 'cache_hits' in run_summary:
+        print(f"Cache PDF: {run_summary['cache_hits']} hit, {run_summary['cache_misses']} miss.", file=sys.stderr)
+    if 'copy_pool_hits' in run_summary:
+        print(f"Salinan siap pakai: {run_summary['copy_pool_hits']} dipakai, "
+              f"{run_summary['copy_pool_misses']} disalin langsung.", file=sys.stderr)
+    print(f"Selesai: {done_count - failed} berhasil, {failed} gagal.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
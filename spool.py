@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import threading
+
+# Bounded-memory buffers for certificate PDFs and outgoing messages. Each
+# buffer is a SpooledTemporaryFile that moves to disk past SPOOL_FILE_MB,
+# and all buffers together may keep at most SPOOL_MEMORY_MB in RAM; once
+# that budget is taken new buffers start on disk. Peak memory for PDFs is
+# therefore capped no matter how many workers hold one.
+
+DEFAULT_FILE_MB = 2
+DEFAULT_MEMORY_MB = 64
+COPY_BUFFER = 1024 * 1024
+
+
+def _mb_from_env(name, default):
+    try:
+        return max(0.0, float(os.getenv(name) or default))
+    except ValueError:
+        return default
+
+
+class SpoolBudget:
+    def __init__(self, file_bytes, total_bytes):
+        self.file_bytes = int(file_bytes)
+        self.total_bytes = int(total_bytes)
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(_mb_from_env("SPOOL_FILE_MB", DEFAULT_FILE_MB) * 1024 * 1024,
+                   _mb_from_env("SPOOL_MEMORY_MB", DEFAULT_MEMORY_MB) * 1024 * 1024)
+
+    def _take(self):
+        with self._lock:
+            if self.file_bytes <= 0 or self.in_use + self.file_bytes > self.total_bytes:
+                return False
+            self.in_use += self.file_bytes
+            return True
+
+    def _release(self):
+        with self._lock:
+            self.in_use -= self.file_bytes
+
+    def open(self):
+        """A new empty binary buffer: in memory while the budget allows, else on disk."""
+        if self._take():
+            return _BudgetedSpool(self)
+        return tempfile.TemporaryFile()
+
+
+class _BudgetedSpool(tempfile.SpooledTemporaryFile):
+    def __init__(self, budget):
+        super().__init__(max_size=budget.file_bytes)
+        self._budget = budget
+
+    def close(self):
+        budget, self._budget = self._budget, None
+        super().close()
+        if budget is not None:
+            budget._release()
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def budget():
+    """The process-wide budget, configured from SPOOL_* on first use."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = SpoolBudget.from_env()
+        return _budget
+
+
+def spooled(data=None):
+    """A buffer from the shared budget, optionally filled with ``data`` and rewound."""
+    f = budget().open()
+    if data:
+        f.write(data)
+        f.seek(0)
+    return f
+
+
+def copy_file(source, target):
+    """Copy all of ``source`` into ``target`` and rewind both."""
+    source.seek(0)
+    shutil.copyfileobj(source, target, COPY_BUFFER)
+    source.seek(0)
+    target.seek(0)
+    return target
+
+
+def file_size(f):
+    position = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(position)
+    return size
+
+
+def close_quietly(f):
+    if f is not None:
+        try:
+            f.close()
+        except Exception:
+            pass
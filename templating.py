@@ -0,0 +1,129 @@
+import html
+import re
+
+# Template fields. Slides, the email subject and the email body use
+# {{kunci}} placeholders; ``nama`` and ``email`` come from the roster's
+# name and email columns, every other roster column becomes a field named
+# after its header (see field_key), and fixed values such as the event name
+# come from TEMPLATE_FIELDS. Email templates are compiled once per run into
+# literal pieces and keys, so rendering a row is a single join.
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+ROSTER_FIELDS = ('nama', 'email')
+
+
+class TemplateFieldError(ValueError):
+    """The template uses a placeholder that no roster column or fixed field fills."""
+
+
+def field_key(name):
+    """Normalize a column header or placeholder name: ``Nomor Sertifikat`` -> ``nomor_sertifikat``."""
+    return re.sub(r"[^0-9a-z]+", "_", str(name).strip().lower()).strip("_")
+
+
+def find_placeholders(text):
+    """``{placeholder_text: key}`` for every ``{{...}}`` in ``text``."""
+    return {match.group(0): field_key(match.group(1)) for match in PLACEHOLDER_RE.finditer(text or "")}
+
+
+def normalize_value(value):
+    """A field value for comparisons: whitespace collapsed, case folded."""
+    return " ".join(str(value).split()).casefold()
+
+
+def parse_fields(text):
+    """Fixed fields from ``kunci=nilai`` entries separated by newlines or ``;``."""
+    fields = {}
+    for entry in re.split(r"[;\n]", text or ""):
+        key, sep, value = entry.partition("=")
+        if sep and field_key(key):
+            fields[field_key(key)] = value.strip()
+    return fields
+
+
+# --- Slides ---
+def _shape_texts(elements):
+    for element in elements:
+        text = element.get('shape', {}).get('text')
+        if text:
+            yield text
+        for row in element.get('table', {}).get('tableRows', []):
+            for cell in row.get('tableCells', []):
+                if cell.get('text'):
+                    yield cell['text']
+        yield from _shape_texts(element.get('elementGroup', {}).get('children', []))
+
+
+def text_content(text):
+    """Plain content of a Slides ``text`` object (runs joined, so split placeholders match)."""
+    return ''.join(e.get('textRun', {}).get('content', '') for e in text.get('textElements', []))
+
+
+def presentation_placeholders(presentation):
+    """``{placeholder_text: key}`` for every placeholder in shapes, tables and groups."""
+    placeholders = {}
+    for page in presentation.get('slides', []):
+        for text in _shape_texts(page.get('pageElements', [])):
+            placeholders.update(find_placeholders(text_content(text)))
+    return placeholders
+
+
+# --- Compiled Text ---
+class TextTemplate:
+    """A text split once into literal pieces and field keys.
+
+    ``render(values)`` fills every placeholder whose key is in ``values``
+    (passed through ``escape`` if given) and leaves the others as written.
+    """
+
+    def __init__(self, text, escape=None):
+        pieces = PLACEHOLDER_RE.split(text or "")
+        self._literals = pieces[0::2]
+        self._keys = [field_key(key) for key in pieces[1::2]]
+        self._raw = [match.group(0) for match in PLACEHOLDER_RE.finditer(text or "")]
+        self._escape = escape
+        self.keys = set(self._keys)
+
+    def render(self, values):
+        out = [self._literals[0]]
+        for key, raw, literal in zip(self._keys, self._raw, self._literals[1:]):
+            value = values.get(key)
+            if value is None:
+                out.append(raw)
+            else:
+                out.append(self._escape(value) if self._escape else value)
+            out.append(literal)
+        return ''.join(out)
+
+
+def looks_like_html(text):
+    return bool(text) and re.match(r"\s*<[!A-Za-z]", text) is not None
+
+
+def html_to_text(markup):
+    """Rough plain-text version of an HTML body, for the text/plain alternative."""
+    text = re.sub(r"(?is)<(script|style)\b.*?</\1>", "", markup)
+    text = re.sub(r"(?i)<br\s*/?>", "\n", text)
+    text = re.sub(r"(?i)</(p|div|h\d|li|tr)>", "\n\n", text)
+    text = html.unescape(re.sub(r"<[^>]+>", "", text))
+    lines = [line.strip() for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+
+class EmailTemplate:
+    """Subject and body compiled once; an HTML body also gets a plain-text twin."""
+
+    def __init__(self, subject, body):
+        self.subject = TextTemplate(subject)
+        if looks_like_html(body):
+            self.html = TextTemplate(body, escape=html.escape)
+            self.text = TextTemplate(html_to_text(body))
+        else:
+            self.html = None
+            self.text = TextTemplate(body)
+        self.keys = self.subject.keys | self.text.keys | (self.html.keys if self.html else set())
+
+    def render(self, values):
+        """``(subject, text_body, html_body)``; ``html_body`` is None for plain-text templates."""
+        subject = " ".join(self.subject.render(values).split())
+        return subject, self.text.render(values), self.html.render(values) if self.html else None
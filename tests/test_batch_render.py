@@ -0,0 +1,63 @@
+import pytest
+
+from batch_render import build_chunk_requests, chunk_units
+
+PLACEHOLDERS = {'{{nama}}': 'nama', '{{sesi}}': 'sesi'}
+
+
+def apply_duplicates(slide_ids, requests):
+    """Slide order after the duplicateObject requests (a copy lands right after its original)."""
+    order = list(slide_ids)
+    for request in requests:
+        duplicate = request.get('duplicateObject')
+        if duplicate:
+            source = duplicate['objectId']
+            order.insert(order.index(source) + 1, duplicate['objectIds'][source])
+    return order
+
+
+@pytest.mark.parametrize("slides, rows", [(1, 1), (1, 4), (3, 1), (3, 5), (2, 10)])
+def test_pages_match_the_slides_each_row_is_rendered_on(slides, rows):
+    slide_ids = [f"s{j}" for j in range(slides)]
+    rows_fields = [{'nama': f"P{i}", 'sesi': str(i)} for i in range(rows)]
+
+    requests, pages = build_chunk_requests(slide_ids, rows_fields, PLACEHOLDERS, "c")
+    order = apply_duplicates(slide_ids, requests)
+
+    assert len(order) == slides * rows
+    replacements = [r['replaceAllText'] for r in requests if 'replaceAllText' in r]
+    assert len(replacements) == rows * len(PLACEHOLDERS)
+    for i, fields in enumerate(rows_fields):
+        [page_ids] = {tuple(r['pageObjectIds']) for r in replacements if r['replaceText'] == fields['nama']}
+        # Row i's PDF pages are exactly the slides its replacements touch, in template order.
+        assert [order[page] for page in pages[i]] == list(page_ids)
+
+
+def test_each_row_gets_its_own_values():
+    requests, _ = build_chunk_requests(["s0"], [{'nama': "A"}, {'nama': "B"}], {'{{nama}}': 'nama'}, "c")
+    texts = [r['replaceAllText']['replaceText'] for r in requests if 'replaceAllText' in r]
+    assert texts == ["A", "B"]
+
+
+def unit(*names, cached=False):
+    return [{'nama': name, 'cached': cached} for name in names]
+
+
+def names(job):
+    return [row['nama'] for row in job['rows']]
+
+
+def test_chunk_units_packs_without_splitting_a_unit():
+    units = [unit("a"), unit("b", "c"), unit("d"), unit("e", "f", "g"), unit("h")]
+    jobs = list(chunk_units(units, 3))
+    assert [names(job) for job in jobs] == [["a", "b", "c"], ["d"], ["e", "f", "g"], ["h"]]
+
+
+def test_chunk_units_gives_an_oversized_unit_its_own_chunk():
+    jobs = list(chunk_units([unit("a"), unit("b", "c", "d", "e")], 2))
+    assert [names(job) for job in jobs] == [["a"], ["b", "c", "d", "e"]]
+
+
+def test_chunk_units_sends_cached_units_on_their_own():
+    jobs = list(chunk_units([unit("a"), unit("b", cached=True), unit("c")], 5))
+    assert [(names(job), job.get('cached', False)) for job in jobs] == [(["b"], True), (["a", "c"], False)]
@@ -0,0 +1,52 @@
+import pandas as pd
+
+import ingest
+from ingest import new_stats, validate_chunk
+
+
+def frame(rows, extras=()):
+    return pd.DataFrame(rows, columns=['nama', 'email', *extras])
+
+
+def test_invalid_rows_are_dropped_and_counted():
+    stats = new_stats()
+    df = validate_chunk(frame([("Budi", "budi@example.com"), ("", "x@example.com"), ("Siti", "not-an-email")]),
+                        set(), stats)
+    assert list(df['nama']) == ["Budi"]
+    assert (stats['valid'], stats['invalid'], stats['duplicate']) == (1, 2, 0)
+
+
+def test_duplicates_ignore_case_and_whitespace():
+    stats = new_stats()
+    df = validate_chunk(frame([("Budi  Santoso", "budi@example.com"), ("budi santoso ", "BUDI@example.com")]),
+                        set(), stats)
+    assert list(df['nama']) == ["Budi Santoso"]
+    assert stats['duplicate'] == 1
+
+
+def test_other_columns_make_a_row_distinct():
+    stats = new_stats()
+    rows = [("Budi", "budi@example.com", "Sesi 1"), ("Budi", "budi@example.com", "Sesi 2"),
+            ("Budi", "budi@example.com", " sesi  1")]
+    df = validate_chunk(frame(rows, ['sesi']), set(), stats)
+    assert list(df['sesi']) == ["Sesi 1", "Sesi 2"]
+    assert stats['duplicate'] == 1
+
+
+def test_duplicates_are_found_across_chunks():
+    seen, stats = set(), new_stats()
+    validate_chunk(frame([("Budi", "budi@example.com")]), seen, stats)
+    df = validate_chunk(frame([("Budi", "budi@example.com"), ("Siti", "siti@example.com")]), seen, stats)
+    assert list(df['nama']) == ["Siti"]
+    assert stats['duplicate'] == 1
+
+
+def test_stream_participants_keeps_extra_columns_as_fields():
+    csv = "Nama,Email,Nomor Sertifikat\nBudi,budi@example.com,001\n"
+    rows = list(ingest.stream_participants(ingest.read_chunks(csv, "peserta.csv")))
+    assert rows == [{'nama': "Budi", 'email': "budi@example.com", 'fields': {'nomor_sertifikat': "001"}}]
+
+
+def test_headerless_lines_keep_commas_in_names():
+    rows = list(ingest.stream_participants(ingest.read_chunks("Budi, S.Kom, budi@example.com")))
+    assert rows == [{'nama': "Budi, S.Kom", 'email': "budi@example.com"}]
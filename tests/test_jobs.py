@@ -0,0 +1,63 @@
+import csv
+import io
+import os
+import time
+
+import pytest
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+from jobs import CANCELLED, DONE, STALE_AFTER, DuplicateJobError, JobQueue
+from pipeline import RESULT_FIELDS, new_log_entry
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "jobs"))
+
+
+def spec(template_id="tpl", **extra):
+    return dict({'template_id': template_id, 'auth_type': "service_account",
+                 'credential_info': {'private_key': "secret"}}, **extra)
+
+
+def test_export_csv_is_accepted_by_download_button(queue):
+    job_id = queue.submit(spec(), "Tes", roster=b"Budi,budi@example.com\n", roster_name="peserta.txt")
+    entry = dict(new_log_entry("Budí", "budi@example.com"), Status="✅ Berhasil")
+    queue.report(job_id, [(0, entry)], 1, True, 0.0)
+
+    data, _ = convert_data_to_bytes_and_infer_mime(queue.export_csv(job_id), RuntimeError("unsupported"))
+
+    assert data.startswith(b"\xef\xbb\xbf")
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+    assert rows[0] == list(RESULT_FIELDS)
+    assert rows[1][:2] == ["Budí", "budi@example.com"]
+    assert rows[1][3] == "✅ Berhasil"
+
+
+def test_submit_rejects_a_run_already_queued(queue):
+    first = queue.submit(spec(), "Tes", roster=b"Budi,budi@example.com\n")
+
+    with pytest.raises(DuplicateJobError) as error:
+        queue.submit(spec(), "Tes lagi", roster=b"Budi,budi@example.com\n")
+
+    assert error.value.job_id == first
+    assert len(os.listdir(queue.jobs_dir)) == 1
+    # Another template is another run.
+    queue.submit(spec("tpl-2"), "Tes", roster=b"Budi,budi@example.com\n")
+    queue.finish(first, DONE)
+    queue.submit(spec(), "Tes lagi", roster=b"Budi,budi@example.com\n")
+
+
+def test_stale_cancelled_job_is_cleaned_up(queue):
+    job_id = queue.submit(spec(), "Tes", roster=b"Budi,budi@example.com\n")
+    assert queue.claim(pid=1)['id'] == job_id
+    queue.cancel(job_id)
+    with queue._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - STALE_AFTER - 1, job_id))
+
+    assert queue.claim(pid=2) is None
+
+    job = queue.get(job_id, with_spec=True)
+    assert job['status'] == CANCELLED
+    assert 'credential_info' not in job['spec']
+    assert os.listdir(queue.jobs_dir) == []
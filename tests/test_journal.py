@@ -0,0 +1,245 @@
+import collections
+import sqlite3
+import time
+
+import pytest
+
+import journal
+import planning
+from pipeline import STAGES, _resume_rows, new_log_entry
+
+
+class Account:
+    def __init__(self, name):
+        self.name = name
+
+
+class Accounts:
+    def __init__(self, *names):
+        self.accounts = {name: Account(name) for name in names}
+        self.primary = self.accounts[names[0]]
+
+    def get(self, name):
+        return self.accounts.get(name)
+
+
+class Context:
+    """What _resume_rows needs from a CertificateContext."""
+
+    def __init__(self, journal_):
+        self.journal = journal_
+        self.google_accounts = Accounts("g1", "g2")
+        self.fields = {}
+        self.pdf_cache = None
+        self.deleted = []
+
+    def defer_delete(self, account, copy_id, on_deleted=None):
+        self.deleted.append((account.name, copy_id))
+
+
+@pytest.fixture
+def jrnl(tmp_path):
+    with journal.JobJournal(str(tmp_path / "journal.sqlite3"), run_key="run") as j:
+        yield j
+
+
+def person(i, **fields):
+    p = {'nama': f"P{i}", 'email': f"p{i}@example.com"}
+    if fields:
+        p['fields'] = fields
+    return p
+
+
+def record(jrnl, p, state, copy_id=None, account="g1", status=''):
+    row = dict(p, log=dict(new_log_entry(p['nama'], p['email']), Status=status))
+    jrnl.record(row, state, copy_id=copy_id, account=account)
+
+
+def resume(jrnl, people, per_row=True):
+    skipped = collections.deque()
+    ctx = Context(jrnl)
+    jrnl.flush()
+    rows = list(_resume_rows(ctx, people, per_row, skipped))
+    return ctx, rows, list(skipped)
+
+
+def test_copy_shared_by_a_unit_is_redone_as_a_whole(jrnl):
+    people = [person(0, sesi="1"), person(0, sesi="2")]
+    for p in people:
+        record(jrnl, p, 'rendered', copy_id="unit-copy")
+
+    ctx, rows, skipped = resume(jrnl, people)
+
+    assert not skipped
+    assert all('resume_from' not in row and 'copy_id' not in row for row in rows)
+    assert ctx.deleted == [("g1", "unit-copy")]
+    units, _ = planning.plan_rows(rows)
+    # Planned again as one email with both certificates.
+    assert units == [rows]
+
+
+def test_copy_of_a_single_row_still_resumes(jrnl):
+    people = [person(0), person(1)]
+    record(jrnl, people[0], 'rendered', copy_id="own-copy")
+    record(jrnl, people[1], 'rendered', copy_id="unit-copy")
+    record(jrnl, person(2), 'rendered', copy_id="unit-copy")
+
+    ctx, rows, _ = resume(jrnl, people)
+
+    assert rows[0]['copy_id'] == "own-copy"
+    assert rows[0]['resume_from'] == STAGES.index('export')
+    assert 'resume_from' not in rows[1]
+    assert ctx.deleted == [("g1", "unit-copy")]
+
+
+# --- Resume states ---
+@pytest.mark.parametrize("state, stage", [
+    ('copied', 'replace'),
+    ('rendered', 'export'),
+    ('exported', 'export'),
+    ('sent', 'cleanup'),
+])
+def test_in_flight_row_resumes_at_the_next_stage(jrnl, state, stage):
+    p = person(0)
+    record(jrnl, p, state, copy_id="copy", account="g2", status="✅ Berhasil" if state == 'sent' else '')
+
+    ctx, rows, skipped = resume(jrnl, [p])
+
+    assert not skipped and not ctx.deleted
+    [row] = rows
+    assert row['resume_from'] == STAGES.index(stage)
+    assert row['copy_id'] == "copy" and row['google_account'] == "g2"
+    assert row['journal_state'] == state
+    if state == 'sent':
+        assert row['log']['Status'] == "✅ Berhasil"
+
+
+def test_interrupted_send_is_left_for_a_manual_check(jrnl):
+    p = person(0)
+    record(jrnl, p, 'sending', copy_id="copy")
+
+    ctx, rows, skipped = resume(jrnl, [p])
+
+    assert rows == []
+    assert skipped[0]['log']['Status'] == '⚠️ Perlu Cek Manual'
+    assert ctx.deleted == [("g1", "copy")]
+
+
+def test_cleaned_row_is_skipped(jrnl):
+    p = person(0)
+    record(jrnl, p, 'cleaned', copy_id="copy", status="✅ Berhasil")
+
+    ctx, rows, skipped = resume(jrnl, [p])
+
+    assert rows == [] and not ctx.deleted
+    assert skipped[0]['log']['Status'] == "✅ Berhasil"
+    assert "dilewati" in skipped[0]['log']['Detail']
+
+
+def test_failed_row_starts_over_and_its_copy_is_deleted(jrnl):
+    p = person(0)
+    record(jrnl, p, 'failed', copy_id="copy", status="❌ Gagal")
+
+    ctx, rows, skipped = resume(jrnl, [p])
+
+    assert not skipped
+    assert 'resume_from' not in rows[0] and 'copy_id' not in rows[0]
+    assert ctx.deleted == [("g1", "copy")]
+
+
+def test_batch_mode_restarts_in_flight_rows(jrnl):
+    p = person(0)
+    record(jrnl, p, 'rendered', copy_id="copy")
+
+    ctx, rows, _ = resume(jrnl, [p], per_row=False)
+
+    assert 'resume_from' not in rows[0]
+    assert ctx.deleted == [("g1", "copy")]
+
+
+def test_copy_of_a_removed_account_is_left_alone(jrnl):
+    p = person(0)
+    record(jrnl, p, 'rendered', copy_id="copy", account="gone")
+
+    ctx, rows, _ = resume(jrnl, [p])
+
+    assert 'resume_from' not in rows[0] and not ctx.deleted
+
+
+def test_edited_roster_skips_who_already_got_theirs(jrnl):
+    record(jrnl, person(0), 'cleaned', copy_id="c0", status="✅ Berhasil")
+    record(jrnl, person(1), 'cleaned', copy_id="c1", status="✅ Berhasil")
+    # The rerun's roster fixes spacing and case, reorders and adds a row.
+    edited = [person(2), {'nama': " p1 ", 'email': "P1@example.com"}, person(0)]
+
+    _, rows, skipped = resume(jrnl, edited)
+
+    assert [row['nama'] for row in rows] == ["P2"]
+    assert sorted(row['email'] for row in skipped) == ["P1@example.com", "p0@example.com"]
+
+
+# --- run_key ---
+def test_run_key_ignores_the_roster_but_not_template_or_fields():
+    key = journal.run_key("tpl", {'acara': "Seminar", 'tanggal': "1 Mei"})
+    assert key == journal.run_key("tpl", {'tanggal': "1 Mei", 'acara': "Seminar"})
+    assert key != journal.run_key("tpl-2", {'acara': "Seminar", 'tanggal': "1 Mei"})
+    assert key != journal.run_key("tpl", {'acara': "Lokakarya", 'tanggal': "1 Mei"})
+    assert journal.run_key("tpl") == journal.run_key("tpl", {})
+
+
+# --- Writer ---
+def reopen(jrnl):
+    with journal.JobJournal(jrnl.path, run_key=jrnl.run_key) as other:
+        return other.load()
+
+
+def test_batched_writes_are_committed_on_flush(tmp_path):
+    with journal.JobJournal(str(tmp_path / "j.sqlite3"), run_key="run", flush_interval=60) as jrnl:
+        for i in range(3):
+            record(jrnl, person(i), 'copied', copy_id=f"c{i}")
+        started = time.monotonic()
+        jrnl.flush()
+        # A flush ends the batch instead of waiting out the interval.
+        assert time.monotonic() - started < 5
+        assert {entry['copy_id'] for entry in reopen(jrnl).values()} == {"c0", "c1", "c2"}
+
+
+def test_durable_write_commits_the_batch_before_it(tmp_path):
+    with journal.JobJournal(str(tmp_path / "j.sqlite3"), run_key="run", flush_interval=60) as jrnl:
+        record(jrnl, person(0), 'copied', copy_id="c0")
+        p = person(1)
+        jrnl.record(dict(p, log=new_log_entry(p['nama'], p['email'])), 'sending', copy_id="c1", durable=True)
+        states = {key.split("|")[0]: entry['state'] for key, entry in reopen(jrnl).items()}
+        assert states == {"p0@example.com": 'copied', "p1@example.com": 'sending'}
+
+
+def test_full_batch_is_committed_without_waiting(tmp_path):
+    with journal.JobJournal(str(tmp_path / "j.sqlite3"), run_key="run", flush_interval=60, max_batch=2) as jrnl:
+        record(jrnl, person(0), 'copied', copy_id="c0")
+        record(jrnl, person(1), 'copied', copy_id="c1")
+        deadline = time.monotonic() + 5
+        while len(reopen(jrnl)) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(reopen(jrnl)) == 2
+
+
+def test_later_states_keep_the_copy_and_account(jrnl):
+    p = person(0)
+    record(jrnl, p, 'copied', copy_id="c0", account="g2")
+    record(jrnl, p, 'sent', copy_id=None, account=None, status="✅ Berhasil")
+    jrnl.flush()
+
+    [entry] = jrnl.load().values()
+    assert entry == {'state': 'sent', 'copy_id': "c0", 'account': "g2", 'status': "✅ Berhasil", 'detail': ''}
+
+
+def test_failed_commit_is_raised(jrnl):
+    with sqlite3.connect(jrnl.path) as conn:
+        conn.execute("DROP TABLE journal")
+
+    record(jrnl, person(0), 'copied', copy_id="c0")
+    with pytest.raises(sqlite3.OperationalError):
+        jrnl.flush()
+    p = person(1)
+    with pytest.raises(sqlite3.OperationalError):
+        jrnl.record(dict(p, log=new_log_entry(p['nama'], p['email'])), 'sending', durable=True)
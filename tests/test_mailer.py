@@ -0,0 +1,78 @@
+import email
+import io
+from email import policy
+
+import pytest
+
+from benchmarks.smtp_sink import SMTPSink
+from mailer import SMTPPool, build_spooled_message
+
+
+@pytest.fixture
+def sink():
+    with SMTPSink(latency=0, keep=True) as sink:
+        yield sink
+
+
+def pool_for(sink, **options):
+    return SMTPPool("panitia@example.com", "", host=sink.host, port=sink.port, use_tls=False, **options)
+
+
+def message(body="Terima kasih.", attachments=()):
+    fh = io.BytesIO()
+    return build_spooled_message("panitia@example.com", "budi@example.com", "Sertifikat", body, attachments, fh)
+
+
+def test_sessions_are_reused(sink):
+    with pool_for(sink, size=1) as pool:
+        for _ in range(3):
+            pool.send_message(message())
+
+    assert sink.messages == 3
+    assert sink.connections == 1
+
+
+def test_reconnects_after_the_server_drops_the_session(sink):
+    sink.drop_after = 1
+    with pool_for(sink, size=1) as pool:
+        pool.send_message(message())
+        # The idle session is dead now; the send must not fail because of it.
+        pool.send_message(message())
+
+    assert sink.messages == 2
+    assert sink.connections == 2
+
+
+def test_session_is_recycled_after_max_messages(sink):
+    with pool_for(sink, size=1, max_messages=2) as pool:
+        for _ in range(5):
+            pool.send_message(message())
+
+    assert sink.messages == 5
+    assert sink.connections == 3
+
+
+def test_lines_starting_with_a_dot_are_stuffed(sink):
+    body = "Baris pertama\n.\n.titik di awal\n..dua titik"
+    with pool_for(sink) as pool:
+        pool.send_message(message(body))
+
+    data = sink.data[0]
+    assert b"\r\n..\r\n" in data
+    assert b"\r\n..titik di awal\r\n" in data
+    assert b"\r\n...dua titik" in data
+    # Unstuffed, the body arrives as it was written.
+    unstuffed = b"".join(line[1:] if line.startswith(b".") else line for line in data.splitlines(True))
+    assert b"\r\n.\r\n.titik di awal\r\n..dua titik" in unstuffed
+
+
+def test_attachment_survives_the_stream(sink):
+    pdf = io.BytesIO(b"%PDF-1.4\n" + bytes(range(256)) * 800)
+    with pool_for(sink) as pool:
+        pool.send_message(message(attachments=[(pdf, "sertifikat.pdf")]))
+
+    raw = b"".join(line[1:] if line.startswith(b".") else line for line in sink.data[0].splitlines(True))
+    parsed = email.message_from_bytes(raw, policy=policy.default)
+    attachment = next(parsed.iter_attachments())
+    assert attachment.get_filename() == "sertifikat.pdf"
+    assert attachment.get_content() == pdf.getvalue()
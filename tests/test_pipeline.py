@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+import pipeline
+from metrics import SKIPPED
+from pipeline import StagedPipeline, job_rows, mark_system_error, new_log_entry
+from rate_limit import RetryLater
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pipeline, "backoff_delay", lambda attempt: 0)
+
+
+def make_job(idx):
+    return {'idx': idx, 'nama': f"P{idx}", 'email': f"p{idx}@example.com", 'log': new_log_entry(f"P{idx}", "")}
+
+
+def run(stages, jobs, **kwargs):
+    return list(StagedPipeline(stages, **kwargs).run(iter(jobs)))
+
+
+def test_every_job_passes_every_stage():
+    seen = []
+    lock = threading.Lock()
+
+    def stage(name):
+        def func(job):
+            with lock:
+                seen.append((name, job['idx']))
+        return func
+
+    stages = [(name, stage(name), False) for name in ("a", "b", "c")]
+    done = run(stages, [make_job(i) for i in range(50)], concurrency={"a": 4, "b": 2, "c": 3})
+
+    assert sorted(job['idx'] for job in done) == list(range(50))
+    for name in ("a", "b", "c"):
+        assert sorted(idx for stage_name, idx in seen if stage_name == name) == list(range(50))
+
+
+def test_failed_job_skips_later_stages_except_always_run():
+    calls = []
+
+    def fail(job):
+        raise ValueError("boom")
+
+    stages = [
+        ("copy", fail, False),
+        ("send", lambda job: calls.append("send"), False),
+        ("cleanup", lambda job: calls.append("cleanup"), True),
+    ]
+    [job] = run(stages, [make_job(0)])
+
+    assert job['failed']
+    assert job['log']['Status'] == '❌ Error System'
+    assert job['log']['Detail'] == "boom"
+    assert calls == ["cleanup"]
+
+
+def test_retry_later_requeues_until_success():
+    attempts = []
+
+    def flaky(job):
+        attempts.append(job['idx'])
+        if attempts.count(job['idx']) < 3:
+            raise RetryLater(RuntimeError("429"))
+
+    [job] = run([("export", flaky, False)], [make_job(0)], max_retries=5)
+
+    assert not job.get('failed')
+    assert job['attempts'] == {"export": 2}
+    assert attempts == [0, 0, 0]
+
+
+def test_retries_exhausted_fail_the_job():
+    def always(job):
+        raise RetryLater(RuntimeError("503"))
+
+    [job] = run([("export", always, False)], [make_job(0)], max_retries=2)
+
+    assert job['failed']
+    assert job['attempts'] == {"export": 3}
+    assert job['log']['Detail'] == "503"
+
+
+def test_run_terminates_with_no_jobs_and_with_skipped_stages():
+    assert run([("a", lambda job: SKIPPED, False)], []) == []
+    done = run([("a", lambda job: SKIPPED, False), ("b", lambda job: None, False)], [make_job(1)])
+    assert [job['idx'] for job in done] == [1]
+
+
+def test_consumer_stopping_early_releases_workers():
+    jobs = (make_job(i) for i in range(1000))
+    pipe = StagedPipeline([("a", lambda job: None, False)], concurrency={"a": 2}, queue_size=4)
+    results = pipe.run(jobs)
+    next(results)
+    results.close()
+    assert pipe._stop.is_set()
+
+
+def test_mark_system_error_keeps_sent_rows_and_fails_linked_rows():
+    sent, pending, merged, recipient = (make_job(i) for i in range(4))
+    sent['log']['Status'] = '✅ Berhasil'
+    pending['merged'] = [merged]
+    sent['recipients'] = [recipient]
+
+    mark_system_error({'rows': [sent, pending]}, RuntimeError("451"))
+
+    assert sent['log']['Status'] == '✅ Berhasil'
+    for row in (pending, merged, recipient):
+        assert row['log']['Status'] == '❌ Error System'
+
+
+def test_job_rows_never_hands_down_a_success():
+    owner, merged, recipient = (make_job(i) for i in range(3))
+    owner['log']['Status'] = '✅ Berhasil'
+    owner['merged'] = [merged]
+    owner['recipients'] = [recipient]
+    merged['log']['Status'] = '✅ Berhasil'
+
+    rows = list(job_rows(owner))
+
+    assert rows == [owner, merged, recipient]
+    assert recipient['log']['Status'] == '❌ Error System'
+
+
+def test_job_rows_hands_down_a_failure():
+    owner, merged = make_job(0), make_job(1)
+    owner['log'].update(Status='❌ Gagal Email', Detail="550")
+    owner['merged'] = [merged]
+
+    list(job_rows(owner))
+
+    assert (merged['log']['Status'], merged['log']['Detail']) == ('❌ Gagal Email', "550")
@@ -0,0 +1,103 @@
+import batch_render
+import planning
+from planning import plan_rows, render_jobs, render_key
+
+
+def row(nama, email, cached=False, **fields):
+    r = {'nama': nama, 'email': email, 'log': {'Status': '', 'Detail': ''}}
+    if fields:
+        r['fields'] = fields
+    if cached:
+        r['cached'] = True
+    return r
+
+
+def test_render_key_normalizes_whitespace_and_case():
+    assert render_key({'nama': "Budi  Santoso"}) == render_key({'nama': " budi santoso"})
+    assert render_key({'nama': "Budi", 'sesi': "1"}, keys={'nama'}) == render_key({'nama': "Budi", 'sesi': "2"}, keys={'nama'})
+    assert render_key({'nama': "Budi", 'sesi': "1"}) != render_key({'nama': "Budi", 'sesi': "2"})
+
+
+def test_same_address_different_certificates_share_one_email():
+    rows = [row("Budi", "budi@x.com", sesi="1"), row("Budi", "BUDI@x.com", sesi="2")]
+    units, stats = plan_rows(rows)
+
+    assert units == [rows]
+    assert stats == {'rows': 2, 'emails': 1, 'renders': 2, 'cached': 0, 'merged': 0, 'shared': 0}
+
+
+def test_same_address_same_certificate_is_merged():
+    first, again = row("Budi Santoso", "budi@x.com"), row("budi  santoso", "Budi@X.com")
+    units, stats = plan_rows([first, again])
+
+    assert units == [[first]]
+    assert first['merged'] == [again]
+    assert stats['merged'] == 1 and stats['emails'] == 1 and stats['renders'] == 1
+
+
+def test_identical_certificate_for_another_address_shares_the_pdf():
+    siti, other = row("Siti", "siti@x.com"), row("Siti", "siti2@x.com")
+    units, stats = plan_rows([siti, other], slide_keys={'nama'})
+
+    assert units == [[siti]]
+    assert siti['recipients'] == [other]
+    assert stats['shared'] == 1 and stats['emails'] == 2 and stats['renders'] == 1
+
+
+def test_multi_certificate_address_is_not_shared_into():
+    a1, a2 = row("A", "a@x.com", sesi="1"), row("A", "a@x.com", sesi="2")
+    b1 = row("A", "b@x.com", sesi="1")
+    units, stats = plan_rows([a1, a2, b1])
+
+    # b@x.com needs one certificate that a@x.com also gets, so it shares it.
+    assert units == [[a1, a2]]
+    assert a1['recipients'] == [b1]
+    # But an address with two certificates always renders its own.
+    c1, c2 = row("A", "c@x.com", sesi="1"), row("A", "c@x.com", sesi="2")
+    units, _ = plan_rows([row("A", "a@x.com", sesi="1"), c1, c2])
+    assert [c1, c2] in units
+
+
+def test_cached_rows_are_not_renders_and_never_share():
+    cached, fresh = row("A", "a@x.com", cached=True), row("A", "b@x.com", cached=True)
+    units, stats = plan_rows([cached, fresh], slide_keys={'nama'})
+
+    assert units == [[cached], [fresh]]
+    assert stats['cached'] == 2 and stats['renders'] == 0
+
+
+def test_resumed_rows_keep_their_own_unit():
+    resumed = row("A", "a@x.com")
+    resumed['resume_from'] = 2
+    units, _ = plan_rows([resumed, row("A", "a@x.com")])
+    assert units[0] == [resumed]
+
+
+def test_render_jobs_matches_batch_packing():
+    units = [[row(f"P{i}", f"p{i}@x.com")] for i in range(7)]
+    units.insert(2, [row("Q", "q@x.com", sesi="1"), row("Q", "q@x.com", sesi="2")])
+    units.insert(4, [row("C", "c@x.com", cached=True)])
+
+    for batch_size in (1, 2, 3, 4, 10):
+        expected = len([job for job in batch_render.chunk_units(units, batch_size) if not job.get('cached')])
+        if batch_size <= 1:
+            expected = sum(1 for unit in units if not all(r.get('cached') for r in unit))
+        assert render_jobs(units, "google", batch_size) == expected
+    assert render_jobs(units, "local", 3) == 0
+
+
+def test_estimate_counts_calls_per_copy():
+    units, stats = plan_rows([row(f"P{i}", f"p{i}@x.com") for i in range(10)])
+    plan = planning.estimate(units, stats, "google", 1)
+    assert plan['copies'] == 10
+    assert plan['api_calls'] == 10 * 3 + 1 + 2
+    assert planning.describe(plan)[0] == "10 baris peserta → 10 email."
+
+
+def test_journal_keys_tell_sessions_apart():
+    import journal
+
+    one, two = row("Budi", "budi@x.com", sesi="Sesi 1"), row("Budi", "budi@x.com", sesi="Sesi 2")
+    assert journal.row_key(one) != journal.row_key(two)
+    assert journal.row_key(one) == journal.row_key(row("Budi", "BUDI@x.com ", sesi=" sesi  1"))
+    assert journal.row_key(row("Budi", "budi@x.com")) == journal.row_key(row(" BUDI ", "budi@x.com")) == "budi@x.com|budi"
@@ -0,0 +1,64 @@
+import smtplib
+
+import pytest
+
+from rate_limit import RetryLater, is_account_limit_error, is_quota_error, is_retryable
+
+
+def smtp(code, text):
+    return smtplib.SMTPResponseException(code, text.encode("utf-8"))
+
+
+class HttpError(Exception):
+    def __init__(self, status, reason):
+        super().__init__(f"<HttpError {status}: {reason}>")
+        self.resp = type("Resp", (), {'status': status})()
+        self.error_details = [{'reason': reason}]
+
+
+@pytest.mark.parametrize("error", [
+    smtp(550, "5.4.5 Daily user sending quota exceeded. https://support.google.com/mail/?p=UnsolicitedRateLimitError"),
+    smtp(550, "5.4.5 Daily user sending limit exceeded."),
+    smtp(554, "5.7.0 Daily sending limit reached for this account"),
+    smtplib.SMTPAuthenticationError(535, b"5.7.8 Username and Password not accepted."),
+    HttpError(403, "storageQuotaExceeded"),
+    HttpError(403, "dailyLimitExceeded"),
+])
+def test_account_level_signals_retire_the_account(error):
+    assert is_account_limit_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    smtp(552, "5.2.3 Your message exceeded Google's message size limits."),
+    smtp(552, "5.2.2 The email account that you tried to reach is over quota."),
+    smtp(550, "5.1.1 The email account that you tried to reach does not exist."),
+    smtp(554, "5.6.0 Message exceeded 50 hops, this may indicate a mail loop."),
+    smtp(550, "5.7.1 Message rejected: per-message recipient limit exceeded."),
+    smtp(451, "4.3.0 Mail server temporarily rejected message."),
+    HttpError(403, "userRateLimitExceeded"),
+    HttpError(404, "notFound"),
+])
+def test_per_message_errors_do_not_retire_the_account(error):
+    assert not is_account_limit_error(error)
+
+
+def test_permanent_message_errors_are_not_retried():
+    assert not is_retryable(smtp(552, "5.2.3 message size limits"))
+    assert not is_retryable(smtp(550, "5.1.1 no such user"))
+
+
+@pytest.mark.parametrize("error", [
+    smtp(451, "4.3.0 Try again later"),
+    smtp(421, "4.7.0 Try again later, closing connection."),
+    HttpError(429, "rateLimitExceeded"),
+    HttpError(503, "backendError"),
+    RetryLater(RuntimeError("later")),
+])
+def test_transient_errors_are_retried(error):
+    assert is_retryable(error)
+
+
+def test_quota_errors():
+    assert is_quota_error(HttpError(403, "userRateLimitExceeded"))
+    assert is_quota_error(smtp(421, "4.7.0 Too many messages"))
+    assert not is_quota_error(HttpError(403, "storageQuotaExceeded"))
@@ -0,0 +1,48 @@
+from templating import (EmailTemplate, TextTemplate, field_key, find_placeholders, parse_fields,
+                        presentation_placeholders)
+
+
+def test_field_key_normalizes_headers():
+    assert field_key(" Nomor Sertifikat ") == "nomor_sertifikat"
+    assert field_key("E-mail") == "e_mail"
+
+
+def test_parse_fields_accepts_newlines_and_semicolons():
+    assert parse_fields("acara = Seminar\ntanggal=1 Mei; kosong\n=x") == {'acara': "Seminar", 'tanggal': "1 Mei"}
+
+
+def test_text_template_fills_known_keys_and_keeps_unknown():
+    template = TextTemplate("Halo {{ Nama }}, sesi {{sesi}} {{lain}}")
+    assert template.keys == {'nama', 'sesi', 'lain'}
+    assert template.render({'nama': "Budi", 'sesi': "2"}) == "Halo Budi, sesi 2 {{lain}}"
+
+
+def test_text_template_escapes_values_only():
+    template = TextTemplate("<b>{{nama}}</b>", escape=lambda value: value.replace("<", "&lt;"))
+    assert template.render({'nama': "<Budi>"}) == "<b>&lt;Budi></b>"
+
+
+def test_plain_email_template():
+    subject, text, html = EmailTemplate("Sertifikat\n{{nama}}", "Halo {{nama}}").render({'nama': "Budi"})
+    assert (subject, text, html) == ("Sertifikat Budi", "Halo Budi", None)
+
+
+def test_html_email_template_gets_a_text_twin():
+    template = EmailTemplate("S", "<p>Halo {{nama}}</p><p>Salam</p>")
+    _, text, html = template.render({'nama': "A & B"})
+    assert html == "<p>Halo A &amp; B</p><p>Salam</p>"
+    assert text == "Halo A & B\n\nSalam\n"
+
+
+def test_placeholders_found_in_split_runs_tables_and_groups():
+    def text(*runs):
+        return {'textElements': [{'textRun': {'content': run}} for run in runs]}
+
+    presentation = {'slides': [{'pageElements': [
+        {'shape': {'text': text("{{na", "ma}}")}},
+        {'table': {'tableRows': [{'tableCells': [{'text': text("{{sesi}}")}]}]}},
+        {'elementGroup': {'children': [{'shape': {'text': text("{{ Acara }}")}}]}},
+    ]}]}
+    assert presentation_placeholders(presentation) == {
+        '{{nama}}': 'nama', '{{sesi}}': 'sesi', '{{ Acara }}': 'acara'}
+    assert find_placeholders("no fields") == {}